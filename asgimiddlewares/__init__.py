@@ -2,32 +2,64 @@
 
 import enum
 
+from asgimiddlewares.access_log import AccessLogEmitter, AccessLogMiddleware
+from asgimiddlewares.compaction import compact_multiprocess_dir
+from asgimiddlewares.compression import CompressionMiddleware
 from asgimiddlewares.custom_exception import CustomExceptionMiddleware
 from asgimiddlewares.custom_header import CustomHeaderMiddleware
 from asgimiddlewares.extended_logging import ExtendedLoggingMiddleware
+from asgimiddlewares.json_formatter import JsonAccessLogFormatter
+from asgimiddlewares.observability import ObservabilityMiddleware
 from asgimiddlewares.path_id import PathIdMiddleware
-from asgimiddlewares.prometheus import PrometheusMiddleware
+from asgimiddlewares.profiler import StackProfiler, profile_middlewares
+from asgimiddlewares.prometheus import MetricsEndpoint, PrometheusMiddleware
 from asgimiddlewares.request_time import RequestTimeMiddleware
+from asgimiddlewares.response_cache import CacheRule, ResponseCacheMiddleware
 from asgimiddlewares.routing import CustomRoutingMiddleware
+from asgimiddlewares.sampling import AccessLogSampler
+from asgimiddlewares.static_headers import HeaderRule
 from asgimiddlewares.utils import (
+    LoggingContextFilter,
+    RequestPhases,
+    TraceContext,
     replace_middleware,
     server_request_hook,
+    logging_context,
+    request_phases_ctx_var,
     request_time_ctx_var,
     logging_ctx_var,
 )
 
 __all__ = [
+    "AccessLogEmitter",
+    "AccessLogMiddleware",
+    "AccessLogSampler",
+    "CacheRule",
+    "CompressionMiddleware",
     "CustomExceptionMiddleware",
     "CustomHeaderMiddleware",
     "ExtendedLoggingMiddleware",
+    "HeaderRule",
+    "JsonAccessLogFormatter",
+    "ObservabilityMiddleware",
     "PathIdMiddleware",
+    "MetricsEndpoint",
     "PrometheusMiddleware",
     "RequestTimeMiddleware",
+    "ResponseCacheMiddleware",
     "CustomRoutingMiddleware",
+    "StackProfiler",
+    "compact_multiprocess_dir",
+    "profile_middlewares",
     "replace_middleware",
     "server_request_hook",
     "CustomMiddlewarePosition",
+    "LoggingContextFilter",
+    "RequestPhases",
+    "TraceContext",
+    "request_phases_ctx_var",
     "request_time_ctx_var",
+    "logging_context",
     "logging_ctx_var",
 ]
 
@@ -36,8 +68,10 @@ class CustomMiddlewarePosition(enum.Enum):
     """
     Custom enum for positioning middlewares. Imitates Connexion's MiddlewarePosition.
 
-    Replace BEFORE_EXCEPTION
+    Replace BEFORE_EXCEPTION. BEFORE_COMPRESSION requires the CompressionMiddleware
+    in the stack, the middlewares added there see the compressed responses.
     """
 
+    BEFORE_COMPRESSION = CompressionMiddleware
     BEFORE_CUSTOM_EXCEPTION = CustomExceptionMiddleware
     BEFORE_ROUTING = CustomRoutingMiddleware
@@ -0,0 +1,187 @@
+"""Middleware writing access logs from a background thread"""
+
+import logging
+import queue
+import threading
+from typing import Any, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+from .utils import logging_context, logging_ctx_var
+
+OVERFLOW_POLICIES = ("drop", "block", "sample")
+
+# Put in the queue to stop the writing thread
+_STOP = None
+
+# Seconds a blocked emit() waits for space before it checks whether it is closed
+_BLOCK_POLL = 0.1
+
+
+class AccessLogEmitter:  # pylint: disable=too-many-instance-attributes
+    """
+    Bounded queue of access log records written in batches by a background thread,
+    so formatting and handler I/O do not run on the event loop.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        logger: Optional[logging.Logger] = None,
+        maxsize: int = 10000,
+        batch_size: int = 100,
+        overflow: str = "drop",
+        sample_every: int = 10,
+        level: int = logging.INFO,
+    ) -> None:
+        """
+        :param logging.Logger logger: Logger the records are written to,
+        defaults to the "asgimiddlewares.access" logger.
+        :param int maxsize: Maximal number of records waiting to be written.
+        :param int batch_size: Maximal number of records written at once.
+        :param str overflow: What to do with a record when the queue is full:
+        "drop" it, "block" until there is space for it, or "sample": once the queue
+        is half full, only every `sample_every`-th record is kept and records
+        are dropped when it is full.
+        :param int sample_every: Keep every n-th record with the "sample" policy.
+        :param int level: Level of the written records, defaults to INFO.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: '{overflow}'!")
+        if maxsize <= 0:
+            raise ValueError("The queue size must be positive!")
+        self.logger = logger or logging.getLogger("asgimiddlewares.access")
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.sample_every = sample_every
+        self.level = level
+        # Number of records not written because of the overflow policy
+        self.dropped = 0
+        self.written = 0
+        self._sampled = 0
+        # Guards the counters, updated by the event loop, the threadpool with
+        # the "block" policy and the writing thread
+        self._lock = threading.Lock()
+        self._closed = False
+        self._queue: queue.Queue[Optional[dict[str, Any]]] = queue.Queue(maxsize)
+        self._thread = threading.Thread(
+            target=self._run, name="access-log", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        """Number of records waiting to be written."""
+        return self._queue.qsize()
+
+    def emit(self, record: dict[str, Any]) -> None:
+        """
+        Queue a record to be written, apply the overflow policy if needed.
+
+        With the "block" policy it waits for space in the queue, so it must not be
+        called from the event loop. The records emitted after close() are dropped.
+        """
+        if self._closed:
+            self._drop()
+            return
+        if self.overflow == "block":
+            while not self._closed:
+                try:
+                    self._queue.put(record, timeout=_BLOCK_POLL)
+                    return
+                except queue.Full:
+                    pass
+            self._drop()
+            return
+        if self.overflow == "sample" and self.depth >= self._queue.maxsize // 2:
+            with self._lock:
+                self._sampled += 1
+                kept = not self._sampled % self.sample_every
+            if not kept:
+                self._drop()
+                return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._drop()
+
+    def _drop(self) -> None:
+        """Count a record not written."""
+        with self._lock:
+            self.dropped += 1
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write all queued records and stop the background thread."""
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        """Write the queued records in batches until the emitter is closed."""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is _STOP:
+                    return
+                self.logger.log(self.level, record)
+                with self._lock:
+                    self.written += 1
+
+
+class AccessLogMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Write the fields gathered by ExtendedLoggingMiddleware as an access log
+    record of every request through an AccessLogEmitter.
+
+    Needs to be positioned before ExtendedLoggingMiddleware. The records still
+    queued when the application shuts down are written before the shutdown
+    completes.
+    """
+
+    def __init__(self, app: ASGIApp, emitter: Optional[AccessLogEmitter] = None):
+        """
+        To configure the emitter, use functools.partial() with the required kwargs.
+
+        :param ASGIApp app: ASGI app or a middleware layer.
+        :param AccessLogEmitter emitter: Emitter of the records, defaults to
+        an emitter with the default settings.
+        """
+        self.app = app
+        self.emitter = emitter or AccessLogEmitter()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+
+            async def lifespan_send(message: Message) -> None:
+                if message["type"] in (
+                    "lifespan.shutdown.complete",
+                    "lifespan.shutdown.failed",
+                ):
+                    # Write the queued records before the server exits
+                    await run_in_threadpool(self.emitter.close)
+                await send(message)
+
+            await self.app(scope, receive, lifespan_send)
+            return
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Filled in by ExtendedLoggingMiddleware from inside this context
+        with logging_context({}):
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                record = logging_ctx_var.get()
+                if record and self.emitter.overflow == "block":
+                    # Waits for space in the queue off the event loop
+                    await run_in_threadpool(self.emitter.emit, record)
+                elif record:
+                    self.emitter.emit(record)
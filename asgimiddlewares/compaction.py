@@ -0,0 +1,120 @@
+"""Compaction of the files left by dead workers in PROMETHEUS_MULTIPROC_DIR.
+
+Every worker writes its metrics to its own files, named after the type of
+the metric and the PID of the worker. Recycled workers leave their files behind and
+every scrape merges all of them. The counters, histograms and summaries of dead
+workers are summed into a single archive file per type, the totals stay the same.
+Gauges are left alone, `prometheus_client.multiprocess.mark_process_dead()` deals
+with the live ones.
+
+The workers are told dead or alive by their PIDs, so all processes writing to the
+directory must run in the same PID namespace, e.g. not in separate containers
+sharing a volume."""
+
+import glob
+import os
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from prometheus_client.mmap_dict import MmapedDict
+
+__all__ = ["compact_multiprocess_dir", "multiprocess_dir_lock"]
+
+# Types whose values of all workers are summed by MultiProcessCollector
+COMPACTED_TYPES = ("counter", "histogram", "summary")
+# Takes the place of the PID in the name of the archive files
+ARCHIVE = "archive"
+LOCK_FILE = ".compaction.lock"
+
+
+def multiprocess_dir() -> Optional[str]:
+    """Return the directory of the multiprocess mode, None if it is disabled."""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get(
+        "prometheus_multiproc_dir"
+    )
+
+
+def is_alive(pid: int) -> bool:
+    """
+    Check whether a process with the PID is running in the PID namespace of this
+    process. A worker of another namespace is seen as dead or as another process.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by another user
+        return True
+    return True
+
+
+@contextmanager
+def multiprocess_dir_lock(path: str, exclusive: bool = True) -> Iterator[None]:
+    """
+    Lock the directory across processes. Compaction holds the exclusive lock,
+    the files are read under the shared one, so no scrape sees a dead worker
+    both in its own file and in the archive.
+
+    :param str path: Directory of the multiprocess mode.
+    :param bool exclusive: Take the exclusive lock, defaults to True.
+    """
+    # Not available on Windows, imported only when the lock is used
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    with open(os.path.join(path, LOCK_FILE), "a+b") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _dead_worker_files(
+    path: str, metric_type: str, alive: Callable[[int], bool]
+) -> list[str]:
+    """Return the files of the metric type written by workers no longer running."""
+    files = []
+    for filename in glob.glob(os.path.join(path, f"{metric_type}_*.db")):
+        pid = os.path.basename(filename)[len(metric_type) + 1 : -len(".db")]
+        if pid.isdigit() and not alive(int(pid)):
+            files.append(filename)
+    return sorted(files)
+
+
+def compact_multiprocess_dir(
+    path: Optional[str] = None, alive: Callable[[int], bool] = is_alive
+) -> int:
+    """
+    Sum the metrics of dead workers into the archive files and delete their files.
+    All the workers writing to the directory must share the PID namespace of this
+    process, the files of running workers would be deleted otherwise.
+
+    :param str path: Directory of the multiprocess mode, defaults to
+    PROMETHEUS_MULTIPROC_DIR.
+    :param alive: Check whether a worker with the PID is running, defaults to
+    checking the running processes.
+    :return: Number of deleted files.
+    """
+    path = path or multiprocess_dir()
+    if not path:
+        raise ValueError("PROMETHEUS_MULTIPROC_DIR is not set!")
+    deleted = 0
+    with multiprocess_dir_lock(path):
+        for metric_type in COMPACTED_TYPES:
+            files = _dead_worker_files(path, metric_type, alive)
+            if not files:
+                continue
+            archive = MmapedDict(os.path.join(path, f"{metric_type}_{ARCHIVE}.db"))
+            try:
+                for filename in files:
+                    values = MmapedDict.read_all_values_from_file(filename)
+                    for key, value, timestamp, _ in values:
+                        total, _ = archive.read_value(key)
+                        archive.write_value(key, total + value, timestamp)
+            finally:
+                archive.close()
+            for filename in files:
+                os.remove(filename)
+                deleted += 1
+    return deleted
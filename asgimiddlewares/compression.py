@@ -0,0 +1,212 @@
+"""Middleware compressing the response bodies with gzip or deflate"""
+
+import functools
+import zlib
+from typing import Iterable, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+__all__ = ["CompressionMiddleware", "accepted_encoding", "compressed_headers"]
+
+# Window bits of zlib.compressobj() selecting the container of the encoding,
+# HTTP deflate is the zlib format
+WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# Content types that are compressed already or must reach the client at once
+EXCLUDED_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zip",
+    "application/zstd",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "text/event-stream",
+)
+
+
+@functools.lru_cache(maxsize=128)
+def accepted_encoding(accept_encoding: bytes) -> Optional[str]:
+    """
+    Choose the encoding of the response from the Accept-Encoding request header.
+
+    :param bytes accept_encoding: Value of the Accept-Encoding header.
+    :return: "gzip" or "deflate", whichever has the higher quality, gzip if they
+    are equal. None if the client accepts neither of them.
+    """
+    qualities: dict[str, float] = {}
+    for coding in accept_encoding.decode("latin-1").lower().split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip()] = quality
+    wildcard = qualities.get("*", 0.0)
+    best = max(WBITS, key=lambda encoding: qualities.get(encoding, wildcard))
+    return best if qualities.get(best, wildcard) > 0 else None
+
+
+def compressed_headers(
+    raw_headers: Iterable[tuple[bytes, bytes]], encoding: str
+) -> list[tuple[bytes, bytes]]:
+    """
+    Return the raw response headers of the compressed body. The Content-Length
+    is dropped, the ETag is weakened and Accept-Encoding is added to the Vary.
+    """
+    headers = [(b"content-encoding", encoding.encode("latin-1"))]
+    vary = b"accept-encoding"
+    for name, value in raw_headers:
+        if name == b"content-length":
+            continue
+        if name == b"vary":
+            vary = value + b", " + vary
+            continue
+        if name == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value
+        headers.append((name, value))
+    headers.append((b"vary", vary))
+    return headers
+
+
+class CompressionMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Compress the response bodies with gzip or deflate as the client accepts.
+
+    The body is compressed chunk by chunk as the app sends it, nothing but the
+    state of zlib is kept between the chunks, so a streamed response stays
+    streamed. The start of the response is held until the first chunk of the
+    body, a body sent at once and shorter than the minimum size is sent as it is.
+    Responses encoded already or of an excluded content type are never compressed.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        level: int = 6,
+        chunk_size: int = 64 * 1024,
+        excluded_paths: Iterable[str] = (),
+        excluded_content_types: Iterable[str] = EXCLUDED_CONTENT_TYPES,
+    ) -> None:
+        """
+        To override the defaults, use functools.partial() with the required kwargs.
+
+        :param ASGIApp app: ASGI app or a middleware layer.
+        :param int minimum_size: Bodies sent at once and shorter than this many
+        bytes are not compressed, defaults to 1024.
+        :param int level: zlib compression level from 1 (fastest) to 9 (smallest),
+        defaults to 6.
+        :param int chunk_size: Bodies are compressed in slices of this many bytes
+        and the compressed body is sent in chunks of about this size, defaults to
+        64 KiB.
+        :param Iterable[str] excluded_paths: Responses of ALL paths that START with
+        any of these strings are not compressed, like the csp_disable of
+        CustomHeaderMiddleware.
+        :param Iterable[str] excluded_content_types: Responses whose Content-Type
+        starts with any of these strings are not compressed, defaults to the
+        compressed media, archives and event streams.
+        """
+        if not 1 <= level <= 9:
+            raise ValueError("The level must be between 1 and 9!")
+        if chunk_size < 1:
+            raise ValueError("The chunk_size must be positive!")
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.chunk_size = chunk_size
+        self.excluded_paths = tuple(excluded_paths)
+        self.excluded_content_types = tuple(
+            content_type.lower() for content_type in excluded_content_types
+        )
+
+    def _compressible(self, raw_headers: Iterable[tuple[bytes, bytes]]) -> bool:
+        """Check the response headers, whether the body may be compressed."""
+        for name, value in raw_headers:
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+                if content_type.startswith(self.excluded_content_types):
+                    return False
+            elif name == b"content-length" and int(value) < self.minimum_size:
+                return False
+        return True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope.get("path", "").startswith(
+            self.excluded_paths
+        ):
+            return await self.app(scope, receive, send)
+
+        encoding = None
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                encoding = accepted_encoding(value)
+                break
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start: Optional[Message] = None
+        compressor = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compressor
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                if self._compressible(message.get("headers", ())):
+                    # Held until the first chunk tells whether to compress
+                    start = message
+                else:
+                    await send(message)
+                return
+            if start is not None:
+                held, start = start, None
+                body = message.get("body", b"")
+                if message_type == "http.response.body" and (
+                    message.get("more_body", False)
+                    or (body and len(body) >= self.minimum_size)
+                ):
+                    compressor = zlib.compressobj(
+                        self.level, zlib.DEFLATED, WBITS[encoding]
+                    )
+                    held = {
+                        **held,
+                        "headers": compressed_headers(
+                            held.get("headers", ()), encoding
+                        ),
+                    }
+                await send(held)
+            if compressor is None or message_type != "http.response.body":
+                return await send(message)
+
+            more_body = message.get("more_body", False)
+            body = memoryview(message.get("body", b""))
+            chunk = b""
+            for offset in range(0, len(body), self.chunk_size):
+                chunk += compressor.compress(body[offset : offset + self.chunk_size])
+                if len(chunk) >= self.chunk_size:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+                    chunk = b""
+            if not more_body:
+                chunk += compressor.flush()
+            if chunk or not more_body:
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": more_body,
+                    }
+                )
+
+        await self.app(scope, receive, send_compressed)
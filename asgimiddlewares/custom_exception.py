@@ -1,37 +1,153 @@
 """Custom middleware to handle exception with extra logging"""
 
+import hashlib
 import logging
-
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
 
 from connexion.exceptions import InternalServerError
 from connexion.lifecycle import ConnexionResponse
 from connexion.middleware.exceptions import ExceptionMiddleware
-
+from prometheus_client import Counter
 from starlette.requests import Request
+from starlette.types import ASGIApp
 
 from .utils import logging_ctx_var
 
 LOG = logging.getLogger(__name__)
 
+# Innermost frames of the traceback identifying the raising site
+FINGERPRINT_FRAMES = 3
+
+
+def exception_fingerprint(exc: BaseException) -> str:
+    """
+    Identify an exception by its type and the innermost frames of its traceback,
+    the same error raised by the same code gets the same fingerprint. No source
+    lines are read.
+    """
+    frames = []
+    traceback = exc.__traceback__
+    while traceback is not None:
+        code = traceback.tb_frame.f_code
+        frames.append(f"{code.co_filename}:{traceback.tb_lineno}:{code.co_name}")
+        traceback = traceback.tb_next
+    exc_type = type(exc)
+    site = "|".join(
+        [f"{exc_type.__module__}.{exc_type.__qualname__}"]
+        + frames[-FINGERPRINT_FRAMES:]
+    )
+    return hashlib.blake2b(site.encode("utf-8"), digest_size=8).hexdigest()
+
 
 class CustomExceptionMiddleware(
     ExceptionMiddleware  # type: ignore
 ):  # pylint: disable=too-few-public-methods
-    """Custom Exception Middleware to handle unhandled exceptions"""
+    """
+    Custom Exception Middleware to handle unhandled exceptions
 
-    @staticmethod
-    def common_error_handler(_request: Request, exc: Exception) -> ConnexionResponse:
-        """Default handler for any unhandled Exception"""
+    The traceback of an unhandled exception is logged the first time its
+    fingerprint occurs and then once per interval, the occurrences in between
+    are logged as compact lines with the number of suppressed tracebacks, so an
+    error storm does not format thousands of identical tracebacks.
+    """
+
+    def __init__(
+        self,
+        next_app: ASGIApp,
+        interval: float = 60.0,
+        metrics: bool = False,
+        service_name: str = "",
+        max_fingerprints: int = 1024,
+    ) -> None:
+        """
+        To override the defaults, use functools.partial() with the required kwargs.
+
+        :param ASGIApp next_app: ASGI app or a middleware layer.
+        :param float interval: Seconds between the tracebacks logged for the same
+        fingerprint, 0 logs every traceback. Defaults to 60 seconds.
+        :param bool metrics: Count the unhandled exceptions in the Prometheus
+        counter `unhandled_exceptions_total` by exception type and fingerprint,
+        defaults to False.
+        :param str service_name: Prefix of the metric, see PrometheusMiddleware.
+        :param int max_fingerprints: Number of fingerprints whose last traceback
+        is remembered, the least recently seen ones are forgotten first and log
+        their traceback again. Defaults to 1024.
+        """
+        super().__init__(next_app)
+        self.interval = interval
+        self.max_fingerprints = max_fingerprints
+        # fingerprint -> [time of the last logged traceback, suppressed tracebacks],
+        # the least recently seen first
+        self._tracebacks: OrderedDict[str, list[float]] = OrderedDict()
+        # The sync handler runs in the threadpool, concurrently for parallel errors
+        self._lock = threading.Lock()
+        self.counter: Optional[Counter] = None
+        if metrics:
+            if service_name:
+                service_name = f"{service_name}_"
+            self.counter = Counter(
+                f"{service_name}unhandled_exceptions",
+                "Number of unhandled exceptions",
+                labelnames=("exception", "fingerprint"),
+            )
+
+    def log_exception(self, exc: Exception) -> None:
+        """Log the traceback of the exception or a compact line if it is suppressed."""
+        fingerprint = exception_fingerprint(exc)
+        if self.counter is not None:
+            self.counter.labels(type(exc).__qualname__, fingerprint).inc()
+        with self._lock:
+            now = time.monotonic()
+            logged = self._tracebacks.get(fingerprint)
+            if logged is None or now - logged[0] >= self.interval:
+                # Suppressed since the previous traceback
+                suppressed = int(logged[1]) if logged is not None else 0
+                self._tracebacks[fingerprint] = [now, 0]
+                traceback = True
+            else:
+                logged[1] += 1
+                suppressed = int(logged[1])
+                traceback = False
+            self._tracebacks.move_to_end(fingerprint)
+            if len(self._tracebacks) > self.max_fingerprints:
+                self._tracebacks.popitem(last=False)
+        if traceback:
+            LOG.error(
+                {
+                    "message": "Unhandled exception occurred",
+                    "unhandled_exception": True,
+                    "fingerprint": fingerprint,
+                    "suppressed": suppressed,
+                },
+                exc_info=exc,
+            )
+            return
         LOG.error(
             {
                 "message": "Unhandled exception occurred",
                 "unhandled_exception": True,
-            },
-            exc_info=exc,
+                "fingerprint": fingerprint,
+                "exception": repr(exc),
+                "suppressed": suppressed,
+            }
         )
+
+    def common_error_handler(  # pylint: disable=arguments-differ
+        self, request: Request, exc: Exception
+    ) -> ConnexionResponse:
+        """Default handler for any unhandled Exception"""
+        self.log_exception(exc)
         # this is needed as the unhandled exception are not
         # caught by the error handlers
         internal_server_error = InternalServerError()
-        internal_server_error.ext = {"trace_id": logging_ctx_var.get().get("trace_id")}
+        trace_id = logging_ctx_var.get().get("trace_id")
+        if trace_id is None:
+            # The fields are empty for requests the sampler of
+            # ExtendedLoggingMiddleware has not decided on yet
+            trace_id = request.scope.get("state", {}).get("trace_id")
+        internal_server_error.ext = {"trace_id": trace_id}
 
         return internal_server_error.to_problem()
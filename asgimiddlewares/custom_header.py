@@ -2,19 +2,40 @@
 
 from typing import Iterable
 
-from starlette.datastructures import MutableHeaders
 from starlette.types import ASGIApp, Receive, Scope, Send, Message
 
+from .static_headers import HeaderRule, StaticHeaders
+
+# Disables all script sources, the API is expected to return no scripts
+CONTENT_SECURITY_POLICY = "default-src 'none'; frame-ancestors 'none'"
+
+
+def has_trace_id(raw_headers: Iterable[tuple[bytes, bytes]]) -> bool:
+    """Check whether the raw response headers contain the trace_id header."""
+    for name, _ in raw_headers:
+        if name == b"trace_id":
+            return True
+    return False
+
+
+def trace_id_header(scope: Scope) -> tuple[bytes, bytes]:
+    """Return the raw trace_id header of the trace_id in the state."""
+    trace_id = scope["state"].get("trace_id")
+    return b"trace_id", str("-" if trace_id is None else trace_id).encode("latin-1")
+
 
 class CustomHeaderMiddleware:  # pylint: disable=too-few-public-methods
     """
     Custom ASGI Header Middleware
 
-    Extends header with trace_id and CSP
+    Extends header with trace_id, CSP and the configured static headers
     """
 
     def __init__(
-        self, app: ASGIApp, csp_disable: Iterable[str] = ("/ui", "/v1/ui")
+        self,
+        app: ASGIApp,
+        csp_disable: Iterable[str] = ("/ui", "/v1/ui"),
+        headers: Iterable[HeaderRule] = (),
     ) -> None:
         """
         To override default base_paths, use functools.partial() with the required
@@ -23,9 +44,21 @@ class CustomHeaderMiddleware:  # pylint: disable=too-few-public-methods
         :param Iterable[str] csp_disable: Specify all paths that should not receive the
         CSP header. ALL paths that START with any of the strings from this iterable are
         disabled. That means string '/v1/ui' disables also path '/v1/ui/#'.
+        :param Iterable[HeaderRule] headers: Additional static headers, each added to
+        the paths selected by the prefixes of its rule. Added after the CSP header.
         """
         self.app = app
         self.csp_disable = set(csp_disable)
+        self.static_headers = StaticHeaders(
+            (
+                HeaderRule(
+                    "Content-Security-Policy",
+                    CONTENT_SECURITY_POLICY,
+                    exclude=tuple(self.csp_disable),
+                ),
+                *headers,
+            )
+        )
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] != "http":
@@ -33,18 +66,12 @@ class CustomHeaderMiddleware:  # pylint: disable=too-few-public-methods
 
         async def send_with_extra_headers(message: Message) -> None:
             if message.get("type") == "http.response.start":
-                headers = MutableHeaders(scope=message)
-                if not headers.getlist("trace_id"):
+                # The headers may be shared by the app, extend a copy of them
+                message["headers"] = raw_headers = list(message.get("headers", ()))
+                if not has_trace_id(raw_headers):
                     # Check if the header hasn't been filled in yet (Flask does this)
-                    headers.append("trace_id", scope["state"].get("trace_id", "-"))
-
-                path = scope.get("path", "")
-                # handle CSP
-                if all(not path.startswith(disable) for disable in self.csp_disable):
-                    headers.append(
-                        "Content-Security-Policy",
-                        "default-src 'none'; frame-ancestors 'none'",
-                    )
+                    raw_headers.append(trace_id_header(scope))
+                raw_headers.extend(self.static_headers.for_path(scope.get("path", "")))
 
             await send(message)
 
@@ -1,11 +1,12 @@
 """Middleware for handling extended logging"""
 
-from typing import Dict, List, Tuple, Iterable
+import time
+from typing import Any, Callable, Container, Dict, List, Optional, Tuple, Iterable
 
-from starlette.datastructures import Headers
 from starlette.types import ASGIApp, Receive, Scope, Send, Message
 
-from .utils import logging_ctx_var
+from .sampling import AccessLogSampler
+from .utils import logging_context
 
 _FIELD_MAPPING = {
     "method": lambda scope, headers: scope.get("method"),
@@ -16,6 +17,7 @@ _FIELD_MAPPING = {
     "query": lambda scope, headers: scope.get("query_string", b"").decode("utf-8"),
     "referer": lambda scope, headers: headers.get("referer"),
     "remote_address": lambda scope, headers: (scope.get("client") or ("-", "-"))[0],
+    "request_length": lambda scope, headers: 0,  # counted while receiving
     "response_length": lambda scope, headers: None,  # handled in response
     "status": lambda scope, headers: None,  # handled in response
     "username": lambda scope, headers: "-",  # TODO
@@ -30,30 +32,78 @@ _FIELD_MAPPING = {
 }
 POSSIBLE_FIELDS = list(_FIELD_MAPPING.keys())
 
+# Fields filled in from the http.response.start message
+_RESPONSE_FIELD_MAPPING: Dict[str, Callable[[Scope, Message], Any]] = {
+    "status": lambda scope, message: message["status"],
+    "path_id": lambda scope, message: scope.get("state", {}).get("path_id"),
+    "response_length": lambda scope, message: content_length(message),
+}
+
+# Request headers read by the fields, only the headers of the configured fields
+# are decoded
+_FIELD_HEADERS = {
+    "referer": "referer",
+    "user_agent": "user-agent",
+    "True-Client-IP": "true-client-ip",
+    "X-Akamai-RH-Edge-Id": "x-rh-edge-request-id",
+    "X-Forwarded-For": "x-forwarded-for",
+    "X-Forwarded-Proto": "x-forwarded-proto",
+    "X-Forwarded-Port": "x-forwarded-port",
+    "X-Forwarded-Host": "x-forwarded-host",
+}
+
 
-DEFAULT_SETTINGS = tuple(POSSIBLE_FIELDS)
+# Fields added after the first release are logged only when they are selected,
+# so the default output does not change
+_OPT_IN_FIELDS = ("request_length",)
+DEFAULT_SETTINGS = tuple(
+    field for field in POSSIBLE_FIELDS if field not in _OPT_IN_FIELDS
+)
 
 
-def parse_headers(headers: List[Tuple[bytes, bytes]]) -> Dict[str, str]:
+def content_length(message: Message) -> int:
+    """Return the Content-Length of the response start message, 0 if missing."""
+    for name, value in message.get("headers", ()):
+        if name == b"content-length":
+            return int(value)
+    return 0
+
+
+def parse_headers(
+    headers: List[Tuple[bytes, bytes]], names: Optional[Container[bytes]] = None
+) -> Dict[str, str]:
     """
     Parse scope headers into a dictionary
 
     Args:
         headers (List[bytes, bytes]]): List of headers
+        names (Container[bytes], optional): Raw names of the headers to parse,
+            the other headers are skipped without being decoded. Defaults to all.
 
     Returns:
         Dict[str, str]: Dictionary of headers
     """
-    return {pair[0].decode("utf-8"): pair[1].decode("utf-8") for pair in headers}
+    if names is None:
+        return {pair[0].decode("utf-8"): pair[1].decode("utf-8") for pair in headers}
+    return {
+        pair[0].decode("utf-8"): pair[1].decode("utf-8")
+        for pair in headers
+        if pair[0] in names
+    }
 
 
-class ExtendedLoggingMiddleware:  # pylint: disable=too-few-public-methods
+class ExtendedLoggingMiddleware:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
     """
     Custom middleware to make selected request related
     variables available outside of the request loop.
     """
 
-    def __init__(self, app: ASGIApp, fields: Iterable[str] = DEFAULT_SETTINGS) -> None:
+    def __init__(
+        self,
+        app: ASGIApp,
+        fields: Iterable[str] = DEFAULT_SETTINGS,
+        sampler: Optional[AccessLogSampler] = None,
+    ) -> None:
         """
         To override default fields, use functools.partial() with the required
         keyword argument.
@@ -62,34 +112,157 @@ class ExtendedLoggingMiddleware:  # pylint: disable=too-few-public-methods
                     Is called in the middleware stack.
         :param fields: Fields to be included in the logging.
                        See POSSIBLE_FIELDS for possible fields.
+        :param sampler: Fill in the fields only for the requests it keeps, once
+                        the response starts, and add their "sample_weight".
+                        Defaults to every request.
         """
         for field in fields:
             if field not in _FIELD_MAPPING:
                 raise ValueError(f"Unknown field to log: '{field}'!")
         self.app = app
-        self.fields = fields
+        self.fields = tuple(fields)
+        self.sampler = sampler
+        # The field list is resolved once, so a request only calls the getters
+        # and the response only updates the fields it is needed for
+        self._request_fields = tuple((key, _FIELD_MAPPING[key]) for key in self.fields)
+        self._response_fields = tuple(
+            (key, _RESPONSE_FIELD_MAPPING[key])
+            for key in self.fields
+            if key in _RESPONSE_FIELD_MAPPING
+        )
+        self._count_request = "request_length" in self.fields
+        self._count_response = "response_length" in self.fields
+        # Lowercase raw names of the request headers read by the configured fields
+        self.header_names = frozenset(
+            _FIELD_HEADERS[field].encode("latin-1")
+            for field in self.fields
+            if field in _FIELD_HEADERS
+        )
 
-    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        scope_headers = parse_headers(scope.get("headers", []))
+    def request_data(self, scope: Scope) -> Dict[str, Any]:
+        """
+        Extract the configured fields available before the request is processed,
+        the fields filled in from the response are set to None.
+        """
+        scope_headers: Dict[str, str] = {}
+        if self.header_names:
+            scope_headers = parse_headers(scope.get("headers", []), self.header_names)
 
         # base uvicorn.access log structure
         # values from scope, send.message or headers
-        data = {key: _FIELD_MAPPING[key](scope, scope_headers) for key in self.fields}
+        return {
+            key: getter(scope, scope_headers) for key, getter in self._request_fields
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.sampler is not None:
+            # The fields stay empty unless the request is kept
+            with logging_context({}) as data:
+                await self._sampled_call(scope, receive, send, data, self.sampler)
+            return
+        with logging_context(self.request_data(scope)) as data:
+            if not self._count_request and not self._response_fields:
+                # Nothing to count or to fill in from the response
+                await self.app(scope, receive, send)
+                return
+            await self._call(scope, receive, send, data)
+
+    async def _sampled_call(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        data: Dict[str, Any],
+        sampler: AccessLogSampler,
+    ) -> None:
+        """
+        Leave the decision to the sampler once the path_id and status are known,
+        the fields of the skipped requests are never extracted.
+        """
+        time_ref = time.perf_counter()
+        count_request = self._count_request
+        count_response = self._count_response
+        # Bytes of the request and response bodies
+        lengths = [0, 0]
+        kept = False
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                lengths[0] += len(message.get("body", b""))
+                if kept:
+                    data["request_length"] = lengths[0]
+            return message
 
         async def send_wrapper(message: Message) -> None:
+            nonlocal kept
+            if message["type"] == "http.response.start":
+                weight = sampler.sample(
+                    scope.get("state", {}).get("path_id"),
+                    message["status"],
+                    time.perf_counter() - time_ref,
+                )
+                if weight:
+                    kept = True
+                    data.update(self.request_data(scope))
+                    for key, getter in self._response_fields:
+                        data[key] = getter(scope, message)
+                    if count_request:
+                        data["request_length"] = lengths[0]
+                    data["sample_weight"] = weight
+            elif kept and count_response and message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if body:
+                    # Like for the requests not sampled
+                    lengths[1] += len(body)
+                    data["response_length"] = lengths[1]
+
+            await send(message)
+
+        await self.app(
+            scope, receive_wrapper if count_request else receive, send_wrapper
+        )
+
+    async def _call(
+        self, scope: Scope, receive: Receive, send: Send, data: Dict[str, Any]
+    ) -> None:
+        if self._count_request:
+            receive = count_request_body(receive, data)
+
+        response_fields = self._response_fields
+        count_response = self._count_response
+        sent = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal sent
             if message["type"] == "http.response.start":
                 # Fill in fields that require to be filled
                 # after the request is processed
-                if "status" in data:
-                    data["status"] = message["status"]
-                if "path_id" in data:
-                    data["path_id"] = scope.get("state", {}).get("path_id")
-                headers = Headers(scope=message)
-                if "response_length" in data:
-                    data["response_length"] = int(headers.get("content-length", 0))
+                for key, getter in response_fields:
+                    data[key] = getter(scope, message)
+            elif count_response and message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if body:
+                    # Streamed responses have no content-length, the length
+                    # of the body sent so far replaces it
+                    sent += len(body)
+                    data["response_length"] = sent
 
             await send(message)
 
-        logging_ctx_var.set(data)
-
         await self.app(scope, receive, send_wrapper)
+
+
+def count_request_body(receive: Receive, data: Dict[str, Any]) -> Receive:
+    """
+    Wrap `receive` to add the length of every request body chunk to
+    the "request_length" field, the chunks are not copied.
+    """
+
+    async def receive_wrapper() -> Message:
+        message = await receive()
+        if message["type"] == "http.request":
+            data["request_length"] += len(message.get("body", b""))
+        return message
+
+    return receive_wrapper
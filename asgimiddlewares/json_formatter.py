@@ -0,0 +1,125 @@
+"""Formatter writing the fields of ExtendedLoggingMiddleware as JSON lines"""
+
+import importlib
+import json
+import logging
+from json.encoder import encode_basestring
+from typing import Any, Callable, Iterable, Optional
+
+from .extended_logging import POSSIBLE_FIELDS
+from .utils import TraceContext
+
+__all__ = [
+    "JsonAccessLogFormatter",
+    "default_serializer",
+    "json_serializer",
+    "orjson_serializer",
+]
+
+# Fields of ExtendedLoggingMiddleware, the phases of RequestTimeMiddleware and
+# the weight of the sampled records
+DEFAULT_FIELDS = (*POSSIBLE_FIELDS, "phases", "sample_weight")
+
+_MISSING = object()
+
+# Encoders of the value types of the fields, anything else goes to the serializer
+_ENCODERS: dict[type, Callable[[Any], str]] = {
+    str: encode_basestring,
+    int: int.__repr__,
+    bool: lambda value: "true" if value else "false",
+    type(None): lambda value: "null",
+    TraceContext: encode_basestring,
+}
+
+
+# Serializes any value to JSON with the json module, unknown types as their string.
+# Non-ASCII characters are written as they are, like orjson does
+json_serializer: Callable[[Any], str] = json.JSONEncoder(
+    default=str, separators=(",", ":"), ensure_ascii=False
+).encode
+
+
+def orjson_serializer() -> Optional[Callable[[Any], str]]:
+    """
+    Return a function serializing any value to JSON with orjson, unknown types as
+    their string. None if orjson is not installed.
+    """
+    try:
+        orjson = importlib.import_module("orjson")
+    except ImportError:
+        return None
+
+    def orjson_dumps(value: Any) -> str:
+        return orjson.dumps(value, default=str).decode("utf-8")
+
+    return orjson_dumps
+
+
+def default_serializer() -> Callable[[Any], str]:
+    """Return the orjson serializer if orjson is installed, the json one otherwise."""
+    return orjson_serializer() or json_serializer
+
+
+class JsonAccessLogFormatter(logging.Formatter):
+    """
+    Format the records of AccessLogEmitter, whose message is the dictionary of
+    the fields, as single-line JSON objects.
+
+    The `"name":` prefixes of the fields are encoded once and the values of the
+    common types (strings, integers, booleans and None) are encoded directly,
+    only the other values (e.g. the phases of RequestTimeMiddleware) go through
+    a JSON serializer. With orjson installed, the configured fields of a record
+    are serialized by orjson at once in the same order, which is faster still.
+    Other records are written as their message with the fields attached by
+    LoggingContextFilter.
+    """
+
+    def __init__(
+        self,
+        fields: Iterable[str] = DEFAULT_FIELDS,
+        attribute: str = "request",
+        serializer: Optional[Callable[[Any], str]] = None,
+    ) -> None:
+        """
+        :param Iterable[str] fields: Fields written in this order, missing ones
+        are left out, so are the fields of the record not listed here. Defaults to
+        all possible fields of ExtendedLoggingMiddleware, "phases" and
+        "sample_weight".
+        :param str attribute: Attribute of the records holding the fields, see
+        LoggingContextFilter. Defaults to "request".
+        :param serializer: Serialize any other value to JSON, defaults to
+        default_serializer().
+        """
+        super().__init__()
+        self.fields = tuple(fields)
+        self.attribute = attribute
+        # Serializes the configured fields of the records at once
+        self._record_serializer = orjson_serializer() if serializer is None else None
+        self.serializer = serializer or self._record_serializer or json_serializer
+        self._prefixes = tuple(
+            (field, encode_basestring(field) + ":") for field in self.fields
+        )
+
+    def format(self, record: logging.LogRecord) -> str:
+        buffer = []
+        if isinstance(record.msg, dict):
+            fields = record.msg
+            if self._record_serializer is not None and not record.exc_info:
+                # In the configured order, like the fields encoded one by one
+                return self._record_serializer(
+                    {field: fields[field] for field in self.fields if field in fields}
+                )
+        else:
+            fields = getattr(record, self.attribute, None) or {}
+            buffer.append('"message":' + encode_basestring(record.getMessage()))
+        serializer = self.serializer
+        for field, prefix in self._prefixes:
+            value = fields.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            encoder = _ENCODERS.get(type(value))
+            buffer.append(prefix + (encoder(value) if encoder else serializer(value)))
+        if record.exc_info:
+            exception = self.formatException(record.exc_info)
+            buffer.append('"exc_info":' + encode_basestring(exception))
+        return "{" + ",".join(buffer) + "}"
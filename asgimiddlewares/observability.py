@@ -0,0 +1,225 @@
+"""Middleware fusing the observability middlewares into a single layer"""
+
+import time
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, Iterable, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+from .custom_header import CustomHeaderMiddleware, trace_id_header
+from .extended_logging import DEFAULT_SETTINGS, ExtendedLoggingMiddleware
+from .prometheus import PrometheusMiddleware
+from .static_headers import HeaderRule
+from .utils import logging_context, request_time_ctx_var
+
+
+def _scan_headers(raw_headers: Iterable[tuple[bytes, bytes]]) -> tuple[int, bool]:
+    """
+    Read everything needed from the response headers in a single pass.
+
+    :return: Value of the first content-length header (0 if missing) and whether
+    the trace_id header is present.
+    """
+    content_length: Optional[int] = None
+    has_trace_id = False
+    for name, value in raw_headers:
+        if name == b"content-length" and content_length is None:
+            content_length = int(value)
+        elif name == b"trace_id":
+            has_trace_id = True
+    return content_length or 0, has_trace_id
+
+
+class ObservabilityMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Do the job of CustomHeaderMiddleware, ExtendedLoggingMiddleware,
+    PrometheusMiddleware and RequestTimeMiddleware in a single layer.
+
+    The result is the same as the separate middlewares in the recommended stack,
+    but each request reads the clock, wraps `send` and scans the response headers
+    only once. Only HTTP requests are observed, other scopes are passed along.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        self,
+        app: ASGIApp,
+        request_time: bool = True,
+        fields: Optional[Iterable[str]] = DEFAULT_SETTINGS,
+        csp_disable: Optional[Iterable[str]] = ("/ui", "/v1/ui"),
+        prometheus: bool = False,
+        service_name: str = "",
+        port: int = 5001,
+        excluded_paths: Iterable[str] = ("",),
+        flush_interval: Optional[float] = None,
+        metrics_path: Optional[str] = None,
+        metrics_ttl: float = 5.0,
+        compact: bool = False,
+        size_metrics: bool = False,
+        phase_metrics: bool = False,
+        headers: Iterable[HeaderRule] = (),
+        cache_metrics: bool = False,
+    ) -> None:
+        """
+        To override the defaults, use functools.partial() with the required kwargs.
+
+        :param ASGIApp app: ASGI app or a middleware layer.
+        :param bool request_time: Store the request time in request_time_ctx_var
+        like RequestTimeMiddleware, defaults to True.
+        :param fields: Fields stored in logging_ctx_var like ExtendedLoggingMiddleware
+        does, None disables the logging fields. Defaults to all possible fields.
+        :param csp_disable: Paths that should not receive the CSP header, see
+        CustomHeaderMiddleware. None disables the custom headers altogether.
+        :param bool prometheus: Collect the metrics of PrometheusMiddleware,
+        defaults to False.
+        :param str service_name: See PrometheusMiddleware.
+        :param int port: See PrometheusMiddleware.
+        :param Iterable[str] excluded_paths: See PrometheusMiddleware.
+        :param float flush_interval: See PrometheusMiddleware.
+        :param str metrics_path: See PrometheusMiddleware.
+        :param float metrics_ttl: See PrometheusMiddleware.
+        :param bool compact: See PrometheusMiddleware.
+        :param bool size_metrics: See PrometheusMiddleware.
+        :param bool phase_metrics: See PrometheusMiddleware, requires
+        RequestTimeMiddleware(phases=True) after this middleware.
+        :param Iterable[HeaderRule] headers: See CustomHeaderMiddleware.
+        :param bool cache_metrics: See PrometheusMiddleware.
+        """
+        self.app = app
+        self.request_time = request_time
+        # The configuration is kept by the middlewares whose job is done here
+        self.logging = (
+            ExtendedLoggingMiddleware(app, fields) if fields is not None else None
+        )
+        self.headers = (
+            CustomHeaderMiddleware(app, csp_disable, headers)
+            if csp_disable is not None
+            else None
+        )
+        self.prometheus = (
+            PrometheusMiddleware(
+                app,
+                service_name,
+                port,
+                excluded_paths,
+                flush_interval,
+                metrics_path,
+                metrics_ttl,
+                compact,
+                size_metrics,
+                phase_metrics,
+                cache_metrics,
+            )
+            if prometheus
+            else None
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan" and self.prometheus is not None:
+            # Flushes the buffered metrics on shutdown
+            await self.prometheus.lifespan(scope, receive, send)
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        prometheus = self.prometheus
+        if prometheus is not None and prometheus.metrics is not None:
+            if scope["path"] == prometheus.metrics_path:
+                await prometheus.metrics(scope, receive, send)
+                return
+
+        time_ref = time.perf_counter()
+        context: ContextManager[Optional[Dict[str, Any]]] = (
+            logging_context(self.logging.request_data(scope))
+            if self.logging is not None
+            else nullcontext()
+        )
+        if prometheus is not None and prometheus.is_excluded(scope):
+            prometheus = None
+        with context as data:
+            await self._observe(scope, receive, send, data, prometheus, time_ref)
+
+    async def _observe(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        data: Optional[Dict[str, Any]],
+        prometheus: Optional[PrometheusMiddleware],
+        time_ref: float,
+    ) -> None:
+        """Observe the request with the fields of the logging context."""
+        count_request = data is not None and "request_length" in data
+        sizes = (
+            prometheus if prometheus is not None and prometheus.size_metrics else None
+        )
+        # Bytes of the request and response bodies
+        lengths = [0, 0]
+
+        async def wrapped_receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                lengths[0] += len(message.get("body", b""))
+                if data is not None and count_request:
+                    data["request_length"] = lengths[0]
+            return message
+
+        async def wrapped_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                self._response_start(scope, message, data, prometheus, time_ref)
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                lengths[1] += len(body)
+                if body and data is not None and "response_length" in data:
+                    # Like ExtendedLoggingMiddleware for streamed responses
+                    data["response_length"] = lengths[1]
+                if sizes is not None and not message.get("more_body", False):
+                    sizes.observe_sizes(scope, *lengths)
+            await send(message)
+
+        counting = count_request or sizes is not None
+        await self.app(scope, wrapped_receive if counting else receive, wrapped_send)
+        if prometheus is not None and prometheus.phase_metrics:
+            prometheus.observe_phases(scope)
+        if prometheus is not None and prometheus.cache_metrics:
+            prometheus.observe_cache(scope)
+
+    def _response_start(
+        self,
+        scope: Scope,
+        message: Message,
+        data: Optional[Dict[str, Any]],
+        prometheus: Optional[PrometheusMiddleware],
+        time_ref: float,
+    ) -> None:
+        """
+        Do the work of every middleware on the response head, in the order
+        the separate middlewares see it in the recommended stack.
+        """
+        elapsed = time.perf_counter() - time_ref
+        if self.request_time:
+            request_time_ctx_var.set(elapsed)
+        if prometheus is not None:
+            prometheus.observe(scope, message["status"], elapsed)
+
+        if data is None and self.headers is None:
+            return
+        raw_headers = message.get("headers", ())
+        content_length, has_trace_id = _scan_headers(raw_headers)
+
+        if data is not None:
+            if "status" in data:
+                data["status"] = message["status"]
+            if "path_id" in data:
+                data["path_id"] = scope.get("state", {}).get("path_id")
+            if "response_length" in data:
+                data["response_length"] = content_length
+
+        if self.headers is not None:
+            # The headers may be shared by the app, extend a copy of them
+            message["headers"] = raw_headers = list(raw_headers)
+            if not has_trace_id:
+                # Check if the header hasn't been filled in yet (Flask does this)
+                raw_headers.append(trace_id_header(scope))
+            raw_headers.extend(
+                self.headers.static_headers.for_path(scope.get("path", ""))
+            )
@@ -6,6 +6,8 @@ from typing import Optional
 from starlette.types import ASGIApp, Receive, Scope, Send
 from starlette.routing import Router, Mount, Match, Route
 
+from .routing import RouteMatch
+
 LOG = logging.getLogger(__name__)
 
 
@@ -30,27 +32,40 @@ class PathIdMiddleware:  # pylint: disable=too-few-public-methods
                 "after CustomRoutingMiddleware!"
             )
         if scope.get("path") and scope.get("type") == "http" and router:
-            for mount in router.routes:
-                if scope.get("state", {}).get("path_id"):
-                    break
-                if not isinstance(mount, Mount):
-                    continue
-                if not isinstance(mount.app, Router):
-                    continue
+            state = scope["state"]
+            if not state.get("path_id"):
+                if "route_match" in state:
+                    # CustomRoutingMiddleware already matched the route
+                    route_match: Optional[RouteMatch] = state["route_match"]
+                    state["path_id"] = route_match.path_id if route_match else ""
+                else:
+                    state["path_id"] = self._scan(scope, router)
+        await self.app(scope, receive, send)
 
-                match, child_scope = mount.matches(scope)
-                if match != Match.FULL:
+    @staticmethod
+    def _scan(scope: Scope, router: Router) -> str:
+        """
+        Match the request against all mounted routes, used when the scope
+        does not contain the route matched by CustomRoutingMiddleware.
+
+        :return: Template of the matched route or an empty string.
+        """
+        for mount in router.routes:
+            if not isinstance(mount, Mount):
+                continue
+            if not isinstance(mount.app, Router):
+                continue
+
+            match, child_scope = mount.matches(scope)
+            if match != Match.FULL:
+                continue
+            new_scope = {**scope, **child_scope}
+            for route in mount.app.routes:
+                if not isinstance(route, Route):
                     continue
-                new_scope = {**scope, **child_scope}
-                for route in mount.app.routes:
-                    if not isinstance(route, Route):
-                        continue
-                    match, _ = route.matches(new_scope)
-
-                    if match == Match.FULL:
-                        scope["state"]["path_id"] = mount.path + route.path_format
-                        break
-            if not scope.get("state", {}).get("path_id"):
-                # Not a part of application API, possibly swagger UI
-                scope["state"]["path_id"] = ''
-        await self.app(scope, receive, send)
+                match, _ = route.matches(new_scope)
+
+                if match == Match.FULL:
+                    return mount.path + route.path_format
+        # Not a part of application API, possibly swagger UI
+        return ""
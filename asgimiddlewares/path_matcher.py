@@ -0,0 +1,68 @@
+"""Matching of request paths against literal paths and route templates."""
+
+import re
+from typing import Iterable
+
+from starlette.convertors import CONVERTOR_TYPES
+
+__all__ = ["PathMatcher"]
+
+# {name} or {name:convertor} like in Starlette's route paths
+_PARAM = re.compile(r"{([^{}:]+)(?::([^{}]+))?}")
+
+
+def _template_pattern(template: str) -> str:
+    """Translate a route template to a regex with the regexes of its convertors."""
+    pattern = []
+    position = 0
+    for param in _PARAM.finditer(template):
+        convertor = CONVERTOR_TYPES.get(param.group(2) or "str")
+        if convertor is None:
+            raise ValueError(f"Unknown path convertor: '{param.group(2)}'!")
+        pattern.append(re.escape(template[position : param.start()]))
+        pattern.append(f"(?:{convertor.regex})")
+        position = param.end()
+    pattern.append(re.escape(template[position:]))
+    return "".join(pattern)
+
+
+class PathMatcher:  # pylint: disable=too-few-public-methods
+    """
+    Check whether a request path is one of the given paths, which are either
+    literal paths or route templates like `/v1/sample/id/{identifier}`.
+
+    Literal paths are looked up in a set, the templates are compiled into
+    a single regex once.
+    """
+
+    def __init__(self, paths: Iterable[str]) -> None:
+        """
+        :param Iterable[str] paths: Literal paths and route templates, the
+        parameters of the templates accept Starlette's convertors,
+        e.g. `{identifier:int}`.
+        """
+        self.literals: set[str] = set()
+        self.templates: set[str] = set()
+        for path in paths:
+            if _PARAM.search(path):
+                self.templates.add(path)
+            else:
+                self.literals.add(path)
+        self._regex = (
+            re.compile(
+                "|".join(f"(?:{_template_pattern(path)})" for path in self.templates)
+            )
+            if self.templates
+            else None
+        )
+
+    def matches(self, path: str) -> bool:
+        """
+        :param str path: Path of the request.
+        :return: True if the path is a literal path or matches a template.
+        """
+        if path in self.literals:
+            return True
+        if self._regex is None:
+            return False
+        return self._regex.fullmatch(path) is not None
@@ -0,0 +1,211 @@
+"""Profiling of the time every layer of a middleware stack adds to a request.
+
+Every entry of a middleware list is replaced by a ProfiledMiddleware, which builds
+the middleware around a probe timing its inner layer. The built middlewares are
+the same objects as without profiling, so Connexion still finds its own layers
+in the stack."""
+
+import functools
+import inspect
+import itertools
+import time
+from contextvars import ContextVar
+from typing import Any, NamedTuple, Optional
+
+from prometheus_client import Histogram
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+__all__ = ["LayerStats", "ProfiledMiddleware", "StackProfiler", "profile_middlewares"]
+
+# Time spent in the inner layers of every probe being awaited, outermost first.
+# _SKIPPED marks a request left out by sampling.
+_SKIPPED: list[float] = []
+_probes_ctx_var: ContextVar[Optional[list[float]]] = ContextVar(
+    "profiled_probes", default=None
+)
+
+
+class LayerStats(NamedTuple):
+    """Total time spent in a layer of the stack by the requests of a path_id."""
+
+    layer: str
+    path_id: Optional[str]
+    requests: int
+    # Seconds spent in the layer and in the layers after it
+    inclusive: float
+    # Seconds spent in the layer itself
+    exclusive: float
+
+
+class StackProfiler:
+    """Aggregate the time of every profiled layer by layer and path_id."""
+
+    def __init__(
+        self, sample_every: int = 1, metrics: bool = False, service_name: str = ""
+    ) -> None:
+        """
+        :param int sample_every: Profile every n-th request only, defaults to 1.
+        :param bool metrics: Also observe the times in the Prometheus histogram
+        `middleware_duration_seconds` by layer, url_rule (path_id) and kind
+        (inclusive or exclusive), defaults to False.
+        :param str service_name: Prefix of the metric, see PrometheusMiddleware.
+        """
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1!")
+        self.sample_every = sample_every
+        self._requests = itertools.count()
+        # (layer, path_id) -> [requests, inclusive, exclusive]
+        self._stats: dict[tuple[str, Optional[str]], list[Any]] = {}
+        self.histogram: Optional[Histogram] = None
+        if metrics:
+            if service_name:
+                service_name = f"{service_name}_"
+            self.histogram = Histogram(
+                f"{service_name}middleware_duration_seconds",
+                "Time spent in a middleware layer in seconds",
+                labelnames=("layer", "url_rule", "kind"),
+            )
+
+    def sampled(self) -> bool:
+        """Decide whether the next request is profiled."""
+        return next(self._requests) % self.sample_every == 0
+
+    def record(
+        self, layer: str, scope: Scope, inclusive: float, exclusive: float
+    ) -> None:
+        """Add the times of a layer spent on a request to the totals."""
+        path_id = scope.get("state", {}).get("path_id")
+        stats = self._stats.get((layer, path_id))
+        if stats is None:
+            stats = self._stats[(layer, path_id)] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += inclusive
+        stats[2] += exclusive
+        if self.histogram is not None:
+            self.histogram.labels(layer, path_id, "inclusive").observe(inclusive)
+            self.histogram.labels(layer, path_id, "exclusive").observe(exclusive)
+
+    def report(self) -> list[LayerStats]:
+        """Return the totals, the layers spending the most time first."""
+        rows = [
+            LayerStats(layer, path_id, *stats)
+            for (layer, path_id), stats in self._stats.items()
+        ]
+        return sorted(rows, key=lambda row: row.exclusive, reverse=True)
+
+    def format_report(self) -> str:
+        """Return the totals as a table with the mean times in milliseconds."""
+        lines = [
+            f"{'layer':<32} {'path_id':<40} {'requests':>9} "
+            f"{'inclusive ms':>13} {'exclusive ms':>13}"
+        ]
+        for row in self.report():
+            lines.append(
+                f"{row.layer:<32} {str(row.path_id):<40} {row.requests:>9} "
+                f"{row.inclusive * 1000 / row.requests:>13.3f} "
+                f"{row.exclusive * 1000 / row.requests:>13.3f}"
+            )
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        """Forget the totals."""
+        self._stats.clear()
+
+
+class _LayerProbe:  # pylint: disable=too-few-public-methods
+    """Time a layer of the stack, the inner layers are timed by their own probes."""
+
+    def __init__(self, app: ASGIApp, profiler: StackProfiler) -> None:
+        self.app = app
+        self.profiler = profiler
+        self.layer = type(app).__name__
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        probes = _probes_ctx_var.get()
+        token = None
+        if probes is None:
+            # Outermost probe of the request
+            probes = [] if self.profiler.sampled() else _SKIPPED
+            token = _probes_ctx_var.set(probes)
+        if probes is _SKIPPED:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if token is not None:
+                    _probes_ctx_var.reset(token)
+            return
+
+        probes.append(0.0)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            inclusive = time.perf_counter() - start
+            inner = probes.pop()
+            if probes:
+                probes[-1] += inclusive
+            self.profiler.record(self.layer, scope, inclusive, inclusive - inner)
+            if token is not None:
+                _probes_ctx_var.reset(token)
+
+
+class ProfiledMiddleware:
+    """
+    Entry of a middleware list building the middleware around a probe timing
+    its inner layer.
+
+    Compares equal to the wrapped middleware, so the positions of Connexion's
+    add_middleware() and replace_middleware() still find it.
+    """
+
+    def __init__(self, middleware: Any, profiler: StackProfiler) -> None:
+        """
+        :param middleware: Entry of the middleware list, a middleware class or
+        a functools.partial() of it.
+        :param StackProfiler profiler: Profiler recording the times.
+        """
+        self.middleware = middleware
+        self.profiler = profiler
+        # Connexion passes the lifespan to the middlewares accepting it
+        self.__signature__ = inspect.signature(middleware)
+
+    @property
+    def middleware_class(self) -> Any:
+        """The wrapped middleware without the options of functools.partial()."""
+        if isinstance(self.middleware, functools.partial):
+            return self.middleware.func
+        return self.middleware
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ProfiledMiddleware):
+            return self.middleware == other.middleware
+        return other in (self.middleware_class, self.middleware)
+
+    def __hash__(self) -> int:
+        return hash(self.middleware)
+
+    def __call__(self, app: ASGIApp, **kwargs: Any) -> Any:
+        return self.middleware(_LayerProbe(app, self.profiler), **kwargs)
+
+
+def profile_middlewares(
+    middleware_list: list[Any], profiler: Optional[StackProfiler] = None
+) -> StackProfiler:
+    """
+    Profile every entry of a middleware list, like replace_middleware() the list
+    is changed in place. The outermost entry is not timed, its inclusive time
+    is the whole request.
+
+    :param list middleware_list: Middlewares of the stack, outermost first.
+    :param StackProfiler profiler: Profiler recording the times, defaults to
+    a profiler of every request.
+    :return: The profiler.
+    """
+    profiler = profiler or StackProfiler()
+    for i, middleware in enumerate(middleware_list):
+        if not isinstance(middleware, ProfiledMiddleware):
+            middleware_list[i] = ProfiledMiddleware(middleware, profiler)
+    return profiler
@@ -4,13 +4,16 @@ which is by the end of the Middleware stack.
 
 It requires the environment variable PROMETHEUS_MULTIPROC_DIR."""
 
+import asyncio
 import os
+import threading
 import time
-from typing import Iterable, Any
+from typing import Iterable, Any, Optional
 
 import prometheus_client
 
 from prometheus_client import (
+    CONTENT_TYPE_LATEST,
     Counter,
     Histogram,
     disable_created_metrics,
@@ -18,10 +21,20 @@ from prometheus_client import (
     PLATFORM_COLLECTOR,
     GC_COLLECTOR,
     CollectorRegistry,
+    generate_latest,
     multiprocess,
     start_http_server,
 )
-from starlette.types import ASGIApp, Scope, Receive, Send
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Scope, Receive, Send
+
+from .compaction import (
+    compact_multiprocess_dir,
+    multiprocess_dir,
+    multiprocess_dir_lock,
+)
+from .path_matcher import PathMatcher
+from .utils import request_phases_ctx_var
 
 
 def _setup_prometheus(port: int) -> None:
@@ -31,19 +44,210 @@ def _setup_prometheus(port: int) -> None:
     start_http_server(port)
 
 
-__all__ = ["PrometheusMiddleware"]
+__all__ = ["PrometheusMiddleware", "MetricBuffer", "MetricsEndpoint"]
+
+# Buckets of the request and response size histograms in bytes
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000, float("inf"))
+
+
+class MetricsEndpoint:  # pylint: disable=too-few-public-methods
+    """
+    ASGI app serving the metrics of all workers, replaces the metrics server
+    started by every worker.
+
+    Merging the files of all workers in multiprocess mode is expensive, so the
+    output is rendered at most once per `ttl` seconds. Concurrent scrapes wait
+    for the same render and the cached output is sent in chunks.
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(
+        self,
+        ttl: float = 5.0,
+        registry: Optional[CollectorRegistry] = None,
+        compact: bool = False,
+    ) -> None:
+        """
+        :param float ttl: Seconds a rendered output is served for, defaults to 5.
+        :param CollectorRegistry registry: Registry to render, defaults to
+        the metrics of all workers in PROMETHEUS_MULTIPROC_DIR if set and to
+        the default registry otherwise.
+        :param bool compact: Compact the files of dead workers before rendering
+        the metrics of all workers (see compact_multiprocess_dir),
+        defaults to False.
+        """
+        self.ttl = ttl
+        self.compact = compact
+        # Directory of the multiprocess mode if its metrics are rendered
+        self.path: Optional[str] = None
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+            self.path = multiprocess_dir()
+            if self.path:
+                registry = CollectorRegistry()
+                multiprocess.MultiProcessCollector(registry, self.path)
+        self.registry = registry
+        self._output = b""
+        self._expires = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def render(self) -> bytes:
+        """Return the metrics output, render it again once it has expired."""
+        if time.monotonic() < self._expires:
+            return self._output
+        async with self._lock:
+            # Rendered by another scrape while waiting for the lock
+            if time.monotonic() >= self._expires:
+                self._output = await run_in_threadpool(self._render)
+                self._expires = time.monotonic() + self.ttl
+        return self._output
+
+    def _render(self) -> bytes:
+        """Render the metrics, compact the files of dead workers first if enabled."""
+        if not self.path:
+            return generate_latest(self.registry)
+        if self.compact:
+            compact_multiprocess_dir(self.path)
+        with multiprocess_dir_lock(self.path, exclusive=False):
+            return generate_latest(self.registry)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope.get("method") not in ("GET", "HEAD"):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 405,
+                    "headers": [(b"allow", b"GET, HEAD"), (b"content-length", b"0")],
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+        output = await self.render()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", CONTENT_TYPE_LATEST.encode("latin-1")),
+                    (b"content-length", str(len(output)).encode("latin-1")),
+                ],
+            }
+        )
+        if scope.get("method") == "HEAD":
+            output = b""
+        view = memoryview(output)
+        for start in range(0, len(output), self.CHUNK_SIZE):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": view[start : start + self.CHUNK_SIZE].tobytes(),
+                    "more_body": start + self.CHUNK_SIZE < len(output),
+                }
+            )
+        if not output:
+            await send({"type": "http.response.body", "body": b""})
+
+
+class MetricBuffer:
+    """
+    Collects the metric updates of a worker in memory and flushes them to
+    the metrics periodically from a background thread.
+
+    In multiprocess mode, every update of a metric writes to the mmap'd file
+    of the worker and an observation of a histogram touches several values.
+    With the buffer, a request only appends the observed value, the histograms
+    observe the values and the counters are incremented by their totals in the
+    background thread. Scrapes are behind by at most one flush interval.
+
+    The thread is started by the first update in every process, so the workers
+    forked from a preloaded application flush their own updates.
+    """
+
+    def __init__(self, interval: float) -> None:
+        """
+        :param float interval: Seconds between two flushes.
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (histogram child, counter child or None) -> observed values
+        self._pending: dict[tuple[Any, Any], list[float]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Process running the thread, None until the first update
+        self._pid: Optional[int] = None
+
+    def add(self, children: tuple[Any, Any], value: float) -> None:
+        """
+        Record a value observed by the histogram, counted by the counter unless
+        the counter is None.
+        """
+        if self._pid != os.getpid():
+            self._start()
+        with self._lock:
+            values = self._pending.get(children)
+            if values is None:
+                self._pending[children] = [value]
+            else:
+                values.append(value)
+
+    def flush(self) -> None:
+        """Apply the collected updates to the metrics."""
+        if self._pid != os.getpid():
+            # The updates copied from the parent process are flushed by the parent
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for (histogram, counter), values in pending.items():
+            for value in values:
+                histogram.observe(value)
+            if counter is not None:
+                counter.inc(len(values))
+
+    def close(self) -> None:
+        """Stop the background thread and flush the remaining updates."""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self.flush()
+
+    def _start(self) -> None:
+        """
+        Start the background thread in this process. A forked worker gets a copy
+        of the buffer without the thread, the updates and the lock of its parent.
+        """
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run, name="prometheus-flush", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Flush the updates periodically until the buffer is closed."""
+        while not self._stop.wait(self.interval):
+            self.flush()
 
 
 # pylint: disable=too-few-public-methods
-class PrometheusMiddleware:
+class PrometheusMiddleware:  # pylint: disable=too-many-instance-attributes
     """Connexion Middleware class for Prometheus metrics exposure."""
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
         self,
         app: ASGIApp,
         service_name: str = "",
         port: int = 5001,
         excluded_paths: Iterable[str] = ("",),
+        flush_interval: Optional[float] = None,
+        metrics_path: Optional[str] = None,
+        metrics_ttl: float = 5.0,
+        compact: bool = False,
+        size_metrics: bool = False,
+        phase_metrics: bool = False,
+        cache_metrics: bool = False,
     ):
         """
         This constructor is intended to be called inside a Connexion
@@ -60,8 +264,33 @@ class PrometheusMiddleware:
         If you wish to exclude an endpoint containing a variable,
         enclose all variables in {curly braces} like so:
         `excluded_paths=("/v1/sample/id/{identifier}",)`
+        :param float flush_interval: Aggregate the metrics in memory and flush
+        them every `flush_interval` seconds and at shutdown (see MetricBuffer),
+        defaults to None (every request updates the metrics directly).
+        :param str metrics_path: Serve the metrics at this path of the application
+        with a MetricsEndpoint instead of starting a metrics server at `port`,
+        defaults to None.
+        :param float metrics_ttl: Seconds the metrics served at `metrics_path`
+        are cached for, defaults to 5.
+        :param bool compact: Merge the metric files of dead workers in
+        PROMETHEUS_MULTIPROC_DIR into archive files at shutdown and before
+        the metrics at `metrics_path` are rendered, defaults to False. Requires
+        `metrics_path`, the metrics server at `port` reads the files without
+        waiting for a running compaction.
+        :param bool size_metrics: Observe the sizes of the request and response
+        bodies by path_id, defaults to False.
+        :param bool phase_metrics: Observe the phases of the requests measured by
+        RequestTimeMiddleware(phases=True) by path_id, defaults to False.
+        :param bool cache_metrics: Count the hits, misses and evictions of
+        ResponseCacheMiddleware by path_id, defaults to False.
         """
-        _setup_prometheus(port)
+        if compact and metrics_path is None:
+            raise ValueError("Compaction requires the metrics_path!")
+        self.metrics_path = metrics_path
+        self.compact = compact
+        self.metrics: Optional[MetricsEndpoint] = None
+        if metrics_path is None:
+            _setup_prometheus(port)
         if service_name:
             service_name = f"{service_name}_"
         self.counter = Counter(
@@ -74,7 +303,48 @@ class PrometheusMiddleware:
             "HTTP request duration in seconds",
             labelnames=("hostname", "status", "method", "url_rule"),
         )
+        self.size_metrics = size_metrics
+        if size_metrics:
+            self.request_size = Histogram(
+                f"{service_name}http_request_size_bytes",
+                "HTTP request body size in bytes",
+                labelnames=("hostname", "method", "url_rule"),
+                buckets=SIZE_BUCKETS,
+            )
+            self.response_size = Histogram(
+                f"{service_name}http_response_size_bytes",
+                "HTTP response body size in bytes",
+                labelnames=("hostname", "method", "url_rule"),
+                buckets=SIZE_BUCKETS,
+            )
+        self.phase_metrics = phase_metrics
+        if phase_metrics:
+            self.phase_histogram = Histogram(
+                f"{service_name}http_request_phase_duration_seconds",
+                "HTTP request phase duration in seconds",
+                labelnames=("hostname", "method", "url_rule", "phase"),
+            )
+        self.cache_metrics = cache_metrics
+        if cache_metrics:
+            self.cache_counter = Counter(
+                f"{service_name}http_response_cache_total",
+                "Requests of cached routes by the result of the cache lookup",
+                labelnames=("hostname", "url_rule", "result"),
+            )
+            self.cache_evictions = Counter(
+                f"{service_name}http_response_cache_evictions_total",
+                "Responses evicted from the response cache",
+                labelnames=("hostname", "reason"),
+            )
         self.hostname = os.environ.get("HOSTNAME", "localhost")
+        # Children of the metrics bound to their labels by (status, method, path_id),
+        # the hostname is the same for all of them
+        self._children: dict[tuple[int, str, Optional[str]], tuple[Any, Any]] = {}
+        # Children of the size histograms by (method, path_id)
+        self._size_children: dict[tuple[str, Optional[str]], tuple[Any, Any]] = {}
+        # Children of the phase histogram by (method, path_id, phase)
+        self._phase_children: dict[tuple[str, Optional[str], str], Any] = {}
+        self.buffer = MetricBuffer(flush_interval) if flush_interval else None
 
         self.app: ASGIApp = app
         # Disable measuring the UNIX time when a metric was created
@@ -83,6 +353,142 @@ class PrometheusMiddleware:
         for collector in (PROCESS_COLLECTOR, PLATFORM_COLLECTOR, GC_COLLECTOR):
             prometheus_client.REGISTRY.unregister(collector)
         self.excluded_paths = set(excluded_paths)
+        if metrics_path is not None:
+            self.metrics = MetricsEndpoint(metrics_ttl, compact=compact)
+            # Scrapes are not requests of the application
+            self.excluded_paths.add(metrics_path)
+        self._excluded = PathMatcher(self.excluded_paths)
+
+    def is_excluded(self, scope: Scope) -> bool:
+        """
+        Check whether the request is excluded from the metrics.
+        :param Scope scope: Mapping passed along with the ASGI request.
+        :return: True if no metrics are to be collected for the request.
+        """
+        if "path" not in scope:
+            return True
+        # The path_id is not known yet, PathIdMiddleware comes after this middleware
+        return self._excluded.matches(scope["path"])
+
+    def observe(self, scope: Scope, status: int, duration: float) -> None:
+        """
+        Update the metrics once the response of a request has started.
+        :param Scope scope: Mapping passed along with the ASGI request.
+        :param int status: HTTP status code of the response.
+        :param float duration: Time elapsed since the request started in seconds.
+        """
+        method = scope["method"]
+        # get path_id prepared by the PathIdMiddleware
+        path_id = scope.get("state", {}).get("path_id")
+        key = (status, method, path_id)
+        children = self._children.get(key)
+        if children is None:
+            # Binding the labels takes a lock, so it is only done once per key
+            status_code = str(status)
+            children = (
+                self.histogram.labels(self.hostname, status_code, method, path_id),
+                self.counter.labels(self.hostname, status_code, method),
+            )
+            self._children[key] = children
+        if self.buffer is not None:
+            self.buffer.add(children, duration)
+            return
+        histogram, counter = children
+        histogram.observe(duration)
+        counter.inc(1)
+
+    def observe_sizes(
+        self, scope: Scope, request_length: int, response_length: int
+    ) -> None:
+        """
+        Update the size histograms once the response has been sent.
+        :param Scope scope: Mapping passed along with the ASGI request.
+        :param int request_length: Bytes of the request body.
+        :param int response_length: Bytes of the response body.
+        """
+        method = scope["method"]
+        path_id = scope.get("state", {}).get("path_id")
+        key = (method, path_id)
+        children = self._size_children.get(key)
+        if children is None:
+            children = (
+                self.request_size.labels(self.hostname, method, path_id),
+                self.response_size.labels(self.hostname, method, path_id),
+            )
+            self._size_children[key] = children
+        if self.buffer is not None:
+            self.buffer.add((children[0], None), request_length)
+            self.buffer.add((children[1], None), response_length)
+            return
+        children[0].observe(request_length)
+        children[1].observe(response_length)
+
+    def observe_phases(self, scope: Scope) -> None:
+        """
+        Update the phase histogram with the phases measured by RequestTimeMiddleware
+        once the inner app has returned.
+        :param Scope scope: Mapping passed along with the ASGI request.
+        """
+        phases = request_phases_ctx_var.get()
+        if phases is None:
+            return
+        method = scope["method"]
+        path_id = scope.get("state", {}).get("path_id")
+        for phase, duration in phases.as_dict().items():
+            if duration is None:
+                continue
+            key = (method, path_id, phase)
+            child = self._phase_children.get(key)
+            if child is None:
+                child = self._phase_children[key] = self.phase_histogram.labels(
+                    self.hostname, method, path_id, phase
+                )
+            if self.buffer is not None:
+                self.buffer.add((child, None), duration)
+            else:
+                child.observe(duration)
+
+    def observe_cache(self, scope: Scope) -> None:
+        """
+        Count the result of the cache lookup and the evictions stored in the state
+        by ResponseCacheMiddleware once the inner app has returned.
+        :param Scope scope: Mapping passed along with the ASGI request.
+        """
+        state = scope.get("state") or {}
+        result = state.get("response_cache")
+        if result is not None:
+            self.cache_counter.labels(self.hostname, state.get("path_id"), result).inc()
+        for reason in state.get("response_cache_evictions", ()):
+            self.cache_evictions.labels(self.hostname, reason).inc()
+
+    def shutdown(self) -> None:
+        """Flush the buffered metrics and compact the files of dead workers."""
+        if self.buffer is not None:
+            self.buffer.close()
+        if self.compact and multiprocess_dir():
+            compact_multiprocess_dir()
+
+    async def lifespan(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Pass the lifespan scope along, flush the buffered metrics and compact
+        the files of dead workers on shutdown.
+        :param Scope scope: Mapping passed along with the ASGI lifespan.
+        :param Receive receive: Callable object for lifespan events.
+        :param Send send: Callable object for lifespan events.
+        """
+        if self.buffer is None and not self.compact:
+            await self.app(scope, receive, send)
+            return
+
+        async def lifespan_send(message: Message) -> None:
+            if message["type"] in (
+                "lifespan.shutdown.complete",
+                "lifespan.shutdown.failed",
+            ):
+                await run_in_threadpool(self.shutdown)
+            await send(message)
+
+        await self.app(scope, receive, lifespan_send)
 
     async def _timed_call(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
@@ -92,8 +498,16 @@ class PrometheusMiddleware:
         :param Send send: Callable object for response manipulation.
         :return: None
         """
-        method = scope["method"]
         time_ref = time.perf_counter()
+        size_metrics = self.size_metrics
+        # Bytes of the request and response bodies
+        lengths = [0, 0]
+
+        async def wrapped_receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                lengths[0] += len(message.get("body", b""))
+            return message
 
         async def wrapped_send(response: Any) -> None:
             """
@@ -103,16 +517,20 @@ class PrometheusMiddleware:
             """
             # Measure time upon receiving the response head
             if response["type"] == "http.response.start":
-                status_code = str(response["status"])
-                # get path_id prepared by the PathIdMiddleware
-                path_id = scope.get("state", {}).get("path_id")
-                self.histogram.labels(
-                    self.hostname, status_code, method, path_id
-                ).observe(time.perf_counter() - time_ref)
-                self.counter.labels(self.hostname, status_code, method).inc(1)
+                self.observe(scope, response["status"], time.perf_counter() - time_ref)
+            elif size_metrics and response["type"] == "http.response.body":
+                lengths[1] += len(response.get("body", b""))
+                if not response.get("more_body", False):
+                    self.observe_sizes(scope, lengths[0], lengths[1])
             await send(response)
 
-        await self.app(scope, receive, wrapped_send)
+        await self.app(
+            scope, wrapped_receive if size_metrics else receive, wrapped_send
+        )
+        if self.phase_metrics:
+            self.observe_phases(scope)
+        if self.cache_metrics:
+            self.observe_cache(scope)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
@@ -121,8 +539,13 @@ class PrometheusMiddleware:
         :param Receive receive: Callable object for request manipulation.
         :param Send send: Callable object for response manipulation.
         """
-        if "path" in scope:
-            if scope["path"] not in self.excluded_paths:
-                await self._timed_call(scope, receive, send)
-                return
+        if scope.get("type") == "lifespan":
+            await self.lifespan(scope, receive, send)
+            return
+        if self.metrics is not None and scope.get("path") == self.metrics_path:
+            await self.metrics(scope, receive, send)
+            return
+        if not self.is_excluded(scope):
+            await self._timed_call(scope, receive, send)
+            return
         await self.app(scope, receive, send)
@@ -1,19 +1,38 @@
 """Middleware for handling request time calculation"""
 
 import time
+from typing import Optional
 
 from starlette.types import ASGIApp, Receive, Scope, Send, Message
 
-from .utils import request_time_ctx_var
+from .utils import (
+    RequestPhases,
+    logging_ctx_var,
+    request_phases_ctx_var,
+    request_time_ctx_var,
+)
 
 
 class RequestTimeMiddleware:  # pylint: disable=too-few-public-methods
     """Measure request time and store it in context variable"""
 
-    def __init__(self, app: ASGIApp) -> None:
+    def __init__(self, app: ASGIApp, phases: bool = False) -> None:
+        """
+        To measure the phases, use functools.partial() with the keyword argument.
+
+        :param ASGIApp app: ASGI app or a middleware layer.
+        :param bool phases: Also measure the phases of the request (see
+        RequestPhases), stored in request_phases_ctx_var and, once the response
+        is sent, in the "phases" logging field. Defaults to False.
+        """
         self.app = app
+        self.phases = phases
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.phases:
+            await self._timed_phases(scope, receive, send)
+            return
+
         time_ref: float = time.perf_counter()
 
         async def wrapped_send(message: Message) -> None:
@@ -24,3 +43,43 @@ class RequestTimeMiddleware:  # pylint: disable=too-few-public-methods
             await send(message)
 
         await self.app(scope, receive, wrapped_send)
+
+    async def _timed_phases(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Measure the request time and the phases of the request."""
+        time_ref = time.perf_counter()
+        phases = RequestPhases()
+        request_phases_ctx_var.set(phases)
+        body_start: Optional[float] = None
+
+        async def wrapped_receive() -> Message:
+            nonlocal body_start
+            message = await receive()
+            if message["type"] == "http.request":
+                now = time.perf_counter()
+                if body_start is None:
+                    body_start = now
+                if not message.get("more_body", False):
+                    phases.body_read = now - body_start
+            return message
+
+        async def wrapped_send(message: Message) -> None:
+            start = time.perf_counter()
+            if message["type"] == "http.response.start":
+                phases.first_byte = start - time_ref
+                request_time_ctx_var.set(phases.first_byte)
+
+            await send(message)
+
+            end = time.perf_counter()
+            phases.send_wait += end - start
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                phases.complete = end - time_ref
+
+        await self.app(scope, wrapped_receive, wrapped_send)
+        # Fields of ExtendedLoggingMiddleware if it is in the stack and logs
+        # the request
+        data = logging_ctx_var.get(None)
+        if data:
+            data["phases"] = phases.as_dict()
@@ -0,0 +1,335 @@
+"""Middleware caching the responses of GET requests in memory by path_id"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Mapping, NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+__all__ = ["CacheRule", "ResponseCache", "ResponseCacheMiddleware"]
+
+# Directives of the Cache-Control response header forbidding a shared cache
+_UNCACHEABLE = ("no-store", "no-cache", "private")
+
+# Request headers identifying the user, see ResponseCacheMiddleware
+_CREDENTIALS = (b"authorization", b"cookie")
+
+
+class CacheRule(NamedTuple):
+    """Caching of the responses of a route, see ResponseCacheMiddleware."""
+
+    # Seconds a response is served from the cache
+    ttl: float = 60.0
+    # Seconds an expired response is still served to the requests arriving while
+    # another request of the same key refreshes it
+    stale: float = 0.0
+    # Cached statuses of the responses
+    statuses: tuple[int, ...] = (200,)
+
+
+class CachedResponse(NamedTuple):
+    """Response stored in the ResponseCache."""
+
+    status: int
+    headers: tuple[tuple[bytes, bytes], ...]
+    body: bytes
+    # Names of the request headers in the Vary header of the response
+    vary: tuple[bytes, ...]
+    # Bytes of the body and the headers
+    size: int
+    # time.monotonic() of the response, when it expires and when it is dropped
+    stored: float
+    expires: float
+    stale_until: float
+
+
+class ResponseCache:
+    """Bounded LRU cache of responses by their key, holding at most `max_bytes`."""
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        :param int max_bytes: Maximal bytes of the cached bodies and headers, the
+        least recently used responses are evicted when the cache is full.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """Return the cached response or None, expired ones included."""
+        response = self._data.get(key)
+        if response is not None:
+            self._data.move_to_end(key)
+        return response
+
+    def put(self, key: Hashable, response: CachedResponse) -> int:
+        """
+        Store a response, evicting the least recently used ones if needed.
+
+        :return: Number of the evicted responses.
+        """
+        self.pop(key)
+        self._data[key] = response
+        self.size += response.size
+        evicted = 0
+        while self.size > self.max_bytes:
+            _, lru = self._data.popitem(last=False)
+            self.size -= lru.size
+            evicted += 1
+        return evicted
+
+    def pop(self, key: Hashable) -> None:
+        """Drop the cached response of the key if there is one."""
+        response = self._data.pop(key, None)
+        if response is not None:
+            self.size -= response.size
+
+
+def normalized_query(query_string: bytes) -> tuple[tuple[str, str], ...]:
+    """
+    Decode the query parameters and sort them by name, so the order of different
+    parameters and their percent-encoding do not matter. The values of a repeated
+    parameter keep their order.
+    """
+    if not query_string:
+        return ()
+    params = parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+    return tuple(sorted(params, key=lambda param: param[0]))
+
+
+def response_vary(
+    raw_headers: Iterable[tuple[bytes, bytes]],
+) -> Optional[tuple[bytes, ...]]:
+    """
+    Check the response headers, whether the response may be cached.
+
+    :return: Names of the request headers in the Vary header of the response,
+    None if the response must not be cached.
+    """
+    vary: list[bytes] = []
+    for name, value in raw_headers:
+        if name == b"set-cookie":
+            return None
+        if name == b"cache-control":
+            directives = value.decode("latin-1").lower()
+            if any(directive in directives for directive in _UNCACHEABLE):
+                return None
+        elif name == b"vary":
+            vary.extend(field.strip().lower() for field in value.split(b","))
+    if b"*" in vary:
+        return None
+    return tuple(sorted(set(vary)))
+
+
+def credential_headers(raw_headers: Iterable[tuple[bytes, bytes]]) -> set[bytes]:
+    """Return the names of the request headers carrying credentials."""
+    return {name for name, _ in raw_headers if name in _CREDENTIALS}
+
+
+def vary_values(
+    raw_headers: Iterable[tuple[bytes, bytes]], names: tuple[bytes, ...]
+) -> tuple[bytes, ...]:
+    """Return the values of the request headers named by the Vary of the route."""
+    if not names:
+        return ()
+    values: dict[bytes, list[bytes]] = {}
+    for name, value in raw_headers:
+        if name in names:
+            values.setdefault(name, []).append(value)
+    return tuple(b",".join(values.get(name, ())) for name in names)
+
+
+class ResponseCacheMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Cache the responses of GET requests of the configured routes in memory.
+
+    The key of a response is the path_id set by PathIdMiddleware, the path, the
+    normalized query and the values of the request headers named by the Vary header
+    of the route. A cached response is replayed without calling the app until its
+    rule's ttl expires. Responses setting cookies, with a Cache-Control forbidding a
+    shared cache or too large are not cached. The cache is bounded by a byte budget,
+    the least recently used responses are evicted first.
+
+    The cache is shared by all users, so a request sending an Authorization or
+    Cookie header is served from the cache, and its response is cached, only if the
+    Vary of the route names these headers.
+
+    Only one request of a key calls the app at a time. The requests of the same
+    key arriving meanwhile wait for its response, or get the expired response if
+    it is still within the `stale` seconds of its rule.
+
+    The result of every request is stored in scope["state"]["response_cache"] as
+    "hit", "miss", "stale" or "coalesced" and the reasons of the evictions in
+    scope["state"]["response_cache_evictions"], for PrometheusMiddleware.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Mapping[str, CacheRule],
+        max_bytes: int = 64 * 1024 * 1024,
+        max_response_bytes: int = 1024 * 1024,
+    ) -> None:
+        """
+        To configure it, use functools.partial() with the required kwargs.
+
+        :param ASGIApp app: ASGI app or a middleware layer.
+        :param Mapping[str, CacheRule] routes: Rules of the cached routes by their
+        templates (path_id), the responses of other routes are never cached.
+        :param int max_bytes: Maximal bytes of the cached bodies and headers,
+        defaults to 64 MiB.
+        :param int max_response_bytes: Larger responses are not cached, defaults
+        to 1 MiB.
+        """
+        self.app = app
+        self.routes = dict(routes)
+        self.max_response_bytes = max_response_bytes
+        self.cache = ResponseCache(max_bytes)
+        # Request headers named by the Vary of the latest response of every route
+        self._vary: dict[str, tuple[bytes, ...]] = {}
+        # Responses being computed by key, None if not cacheable
+        self._pending: dict[Hashable, asyncio.Future[Optional[CachedResponse]]] = {}
+
+    async def __call__(  # pylint: disable=too-many-return-statements
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+        state = scope.get("state") or {}
+        path_id: str = state.get("path_id") or ""
+        rule = self.routes.get(path_id)
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        headers = scope.get("headers", ())
+        query = normalized_query(scope.get("query_string", b""))
+        vary = self._vary.get(path_id, ())
+        if not credential_headers(headers).issubset(vary):
+            # The cached responses may belong to other users
+            state["response_cache"] = "miss"
+            response = await self._recorded_call(scope, receive, send, rule)
+            if response is not None:
+                self._store(scope, path_id, query, response)
+            return None
+        key = (path_id, scope["path"], query, vary, vary_values(headers, vary))
+        now = time.monotonic()
+        cached = self.cache.get(key)
+        if cached is not None:
+            if now < cached.expires:
+                state["response_cache"] = "hit"
+                return await self._replay(cached, now, send)
+            if now >= cached.stale_until:
+                self.cache.pop(key)
+                self._evicted(state, "expired")
+                cached = None
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            if cached is not None:
+                state["response_cache"] = "stale"
+                return await self._replay(cached, now, send)
+            # The waiting request may be cancelled, the pending response may not
+            cached = await asyncio.shield(pending)
+            # The response may vary by other request headers than expected
+            if cached is not None and cached.vary == vary:
+                state["response_cache"] = "coalesced"
+                return await self._replay(cached, time.monotonic(), send)
+            state["response_cache"] = "miss"
+            return await self.app(scope, receive, send)
+
+        state["response_cache"] = "miss"
+        pending = self._pending[key] = asyncio.get_running_loop().create_future()
+        response = None
+        try:
+            response = await self._recorded_call(scope, receive, send, rule)
+            if response is not None:
+                self._store(scope, path_id, query, response)
+        finally:
+            del self._pending[key]
+            pending.set_result(response)
+
+    def _store(
+        self,
+        scope: Scope,
+        path_id: str,
+        query: tuple[tuple[str, str], ...],
+        response: CachedResponse,
+    ) -> None:
+        """Cache the response by the request headers named by its Vary."""
+        self._vary[path_id] = response.vary
+        raw_headers = scope.get("headers", ())
+        if not credential_headers(raw_headers).issubset(response.vary):
+            # The response may be of this user only
+            return
+        headers = vary_values(raw_headers, response.vary)
+        key = (path_id, scope["path"], query, response.vary, headers)
+        evicted = self.cache.put(key, response)
+        for _ in range(evicted):
+            self._evicted(scope["state"], "size")
+
+    @staticmethod
+    def _evicted(state: dict[str, Any], reason: str) -> None:
+        """Record the reason of an eviction for PrometheusMiddleware."""
+        state.setdefault("response_cache_evictions", []).append(reason)
+
+    @staticmethod
+    async def _replay(response: CachedResponse, now: float, send: Send) -> None:
+        """Send the cached response with its age in seconds."""
+        headers = list(response.headers)
+        headers.append((b"age", str(int(now - response.stored)).encode("latin-1")))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status,
+                "headers": headers,
+            }
+        )
+        await send({"type": "http.response.body", "body": response.body})
+
+    async def _recorded_call(
+        self, scope: Scope, receive: Receive, send: Send, rule: CacheRule
+    ) -> Optional[CachedResponse]:
+        """Call the app and record its response if it may be cached."""
+        start: dict[str, Any] = {}
+        body: list[bytes] = []
+        recorded: list[CachedResponse] = []
+        size = 0
+
+        async def recording_send(message: Message) -> None:
+            nonlocal size
+            if message["type"] == "http.response.start":
+                headers = tuple(message.get("headers", ()))
+                vary = response_vary(headers)
+                if message["status"] in rule.statuses and vary is not None:
+                    start.update(status=message["status"], headers=headers, vary=vary)
+                    size = sum(len(name) + len(value) for name, value in headers)
+            elif message["type"] == "http.response.body" and start:
+                body.append(message.get("body", b""))
+                size += len(body[-1])
+                if size > self.max_response_bytes:
+                    # Not cached, the body recorded so far is dropped
+                    start.clear()
+                    body.clear()
+                elif not message.get("more_body", False):
+                    now = time.monotonic()
+                    recorded.append(
+                        CachedResponse(
+                            start["status"],
+                            start["headers"],
+                            b"".join(body),
+                            start["vary"],
+                            size,
+                            now,
+                            now + rule.ttl,
+                            now + rule.ttl + rule.stale,
+                        )
+                    )
+            await send(message)
+
+        await self.app(scope, receive, recording_send)
+        return recorded[0] if recorded else None
@@ -0,0 +1,294 @@
+"""Compiled route index for Starlette routers.
+
+Starlette's Router tries the regex of every route in order until one of them
+matches. RouteIndex compiles the routes into a segment-based radix tree once, so
+a lookup walks the path segments instead of running one regex per route.
+"""
+
+from bisect import bisect_right
+from typing import (
+    Any,
+    Container,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Sequence,
+    cast,
+)
+
+from starlette._utils import get_route_path
+from starlette.convertors import StringConvertor
+from starlette.datastructures import URL
+from starlette.responses import RedirectResponse
+from starlette.routing import BaseRoute, Match, Route, Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+__all__ = ["RouteIndex", "RouteLookup", "IndexedRouter"]
+
+# (position of the route in the router, route, (segment index, parameter name)...)
+_Entry = tuple[int, Route, tuple[tuple[int, str], ...]]
+
+
+class _Node:  # pylint: disable=too-few-public-methods
+    """Single path segment of the radix tree."""
+
+    __slots__ = ("literals", "param", "entries")
+
+    def __init__(self) -> None:
+        self.literals: dict[str, "_Node"] = {}
+        self.param: Optional["_Node"] = None
+        self.entries: list[_Entry] = []
+
+
+def _param_slots(route: Route) -> Optional[tuple[tuple[int, str], ...]]:
+    """
+    Split the route template into segments and find its parameters.
+
+    :return: (segment index, parameter name) pairs for every parameter or None,
+    if the route cannot be resolved segment by segment and needs its regex.
+    """
+    slots = []
+    for index, segment in enumerate(route.path_format[1:].split("/")):
+        if "{" not in segment and "}" not in segment:
+            continue
+        name = segment[1:-1]
+        convertor = route.param_convertors.get(name)
+        if (
+            segment != f"{{{name}}}"
+            or not isinstance(convertor, StringConvertor)
+            or convertor.regex != StringConvertor.regex
+        ):
+            # Partial segments ("/{name}.json") and typed parameters
+            # (int, float, uuid, path) keep their regex.
+            return None
+        slots.append((index, name))
+    return tuple(slots)
+
+
+class RouteLookup(NamedTuple):
+    """Result of RouteIndex.lookup()."""
+
+    match: Match
+    route: Optional[BaseRoute]
+    child_scope: Scope
+    # Index of the chained router the route belongs to, None if nothing matched
+    layer: Optional[int]
+
+
+_NO_MATCH = RouteLookup(Match.NONE, None, {}, None)
+
+
+class RouteIndex:
+    """
+    Radix tree over the routes of a router and of the routers chained to it.
+
+    The position of a route in the router decides its priority, the same way
+    Starlette's linear scan does. A lookup returns the first route that fully
+    matches the request or, if there is none, the first partial match (wrong
+    method), exactly like iterating over the routes in order.
+
+    Routes of chained routers (APIs sharing a base path) are added as further
+    layers. A layer is only used if no route of the previous layers matched, like
+    when the request is passed to the default app of a router.
+    """
+
+    def __init__(self, routes: Iterable[BaseRoute]) -> None:
+        self.root = _Node()
+        # Routes whose convertors need the regex, ordered by position
+        self.regex_routes: list[tuple[int, BaseRoute]] = []
+        # Position of the first route of every layer
+        self.layers: list[int] = []
+        self._size = 0
+        self.add_layer(routes)
+
+    def add_layer(self, routes: Iterable[BaseRoute]) -> None:
+        """Add routes of a chained router, they have lower priority than all others."""
+        self.layers.append(self._size)
+        for position, route in enumerate(routes, start=self._size):
+            self._size += 1
+            if isinstance(route, Route):
+                slots = _param_slots(route)
+                if slots is not None:
+                    self._insert(position, route, slots)
+                    continue
+            self.regex_routes.append((position, route))
+
+    def _insert(
+        self, position: int, route: Route, slots: tuple[tuple[int, str], ...]
+    ) -> None:
+        """Add a route to the tree, parameters share a single child per node."""
+        node = self.root
+        for segment in route.path_format[1:].split("/"):
+            if segment.startswith("{"):
+                if node.param is None:
+                    node.param = _Node()
+                node = node.param
+            else:
+                node = node.literals.setdefault(segment, _Node())
+        node.entries.append((position, route, slots))
+
+    def _candidates(self, segments: Sequence[str]) -> list[_Entry]:
+        """Collect all routes whose template matches the path segments."""
+        found: list[_Entry] = []
+        depth = len(segments)
+        stack = [(self.root, 0)]
+        while stack:
+            node, index = stack.pop()
+            if index == depth:
+                found.extend(node.entries)
+                continue
+            segment = segments[index]
+            literal = node.literals.get(segment)
+            if literal is not None:
+                stack.append((literal, index + 1))
+            if node.param is not None and segment:
+                stack.append((node.param, index + 1))
+        return found
+
+    def _matches(self, scope: Scope) -> Iterator[tuple[int, Match, BaseRoute, Any]]:
+        """
+        Yield all routes matching the request ordered by their position, the tree
+        routes are merged with the regex routes evaluated on the way.
+        """
+        route_path = get_route_path(scope)
+        candidates: list[_Entry] = []
+        segments: list[str] = []
+        if route_path.startswith("/"):
+            segments = route_path[1:].split("/")
+            candidates = sorted(self._candidates(segments), key=lambda entry: entry[0])
+        method = scope["method"]
+
+        regex_routes = iter(self.regex_routes)
+        regex = next(regex_routes, None)
+        for position, route, slots in candidates:
+            while regex is not None and regex[0] < position:
+                match, child_scope = regex[1].matches(scope)
+                if match != Match.NONE:
+                    yield regex[0], match, regex[1], child_scope
+                regex = next(regex_routes, None)
+            if not route.methods or method in route.methods:
+                yield position, Match.FULL, route, (segments, slots)
+            else:
+                yield position, Match.PARTIAL, route, (segments, slots)
+        while regex is not None:
+            match, child_scope = regex[1].matches(scope)
+            if match != Match.NONE:
+                yield regex[0], match, regex[1], child_scope
+            regex = next(regex_routes, None)
+
+    def lookup(
+        self, scope: Scope, layers: Optional[Container[int]] = None
+    ) -> RouteLookup:
+        """
+        Find the route handling the request.
+
+        :param Scope scope: Mapping passed along with the ASGI request.
+        :param Container[int] layers: Only look at the routes of these layers, all
+            layers if None.
+        :return: The match type, the matched route, its child scope and its layer.
+        """
+        partial: Optional[RouteLookup] = None
+        layer = None
+        for position, match, route, child_scope in self._matches(scope):
+            route_layer = bisect_right(self.layers, position) - 1
+            if layers is not None and route_layer not in layers:
+                continue
+            if layer is None:
+                # The first layer with a matching route handles the request
+                layer = route_layer
+            elif route_layer != layer:
+                break
+            if match == Match.FULL:
+                return RouteLookup(
+                    match, route, self._child_scope(scope, route, child_scope), layer
+                )
+            if partial is None:
+                partial = RouteLookup(
+                    match, route, self._child_scope(scope, route, child_scope), layer
+                )
+        return partial or _NO_MATCH
+
+    @staticmethod
+    def _child_scope(scope: Scope, route: BaseRoute, matched: Any) -> Scope:
+        """Build the same child scope as Route.matches() does for tree routes."""
+        if isinstance(matched, dict):
+            # Already built by the regex route
+            return matched
+        # Only instances of Route are put in the tree
+        tree_route = cast(Route, route)
+        segments, slots = matched
+        path_params: dict[str, Any] = dict(scope.get("path_params", {}))
+        for index, name in slots:
+            convertor = tree_route.param_convertors[name]
+            path_params[name] = convertor.convert(segments[index])
+        return {"endpoint": tree_route.endpoint, "path_params": path_params}
+
+
+class IndexedRouter(Router):
+    """
+    Router that resolves HTTP requests through a RouteIndex.
+
+    Lifespan and websocket scopes, as well as any behaviour not related to route
+    matching, are left to Starlette's Router.
+    """
+
+    def __init__(
+        self, routes: Sequence[BaseRoute], default: Optional[ASGIApp] = None
+    ) -> None:
+        super().__init__(routes=routes, default=default)
+        self.index = RouteIndex(self.routes)
+        # This router followed by the routers chained to it
+        self.chained: list[Router] = [self]
+
+    def chain(self, router: Router) -> None:
+        """
+        Chain a router registered with the same base path, its routes are merged
+        into the index with a lower priority than all current routes.
+
+        The router also becomes the default app of the last chained router, so
+        scopes not resolved by the index are passed along the chain as before.
+        """
+        self.index.add_layer(router.routes)
+        self.chained[-1].default = router
+        self.chained.append(router)
+
+    async def app(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await super().app(scope, receive, send)
+            return
+
+        if "router" not in scope:
+            scope["router"] = self
+
+        _, route, child_scope, layer = self.index.lookup(scope)
+
+        # Like passing the request along the chain, a router redirecting to the
+        # path with or without the trailing slash takes precedence over the routers
+        # chained after it. Only the layers before the matched one are checked.
+        redirecting = [
+            index
+            for index, router in enumerate(self.chained[:layer])
+            if router.redirect_slashes
+        ]
+        route_path = get_route_path(scope)
+        if redirecting and route_path != "/":
+            redirect_scope = dict(scope)
+            if route_path.endswith("/"):
+                redirect_scope["path"] = redirect_scope["path"].rstrip("/")
+            else:
+                redirect_scope["path"] = redirect_scope["path"] + "/"
+
+            if self.index.lookup(redirect_scope, redirecting)[1] is not None:
+                response = RedirectResponse(url=str(URL(scope=redirect_scope)))
+                await response(scope, receive, send)
+                return
+
+        if route is not None:
+            scope["route"] = route
+            scope.update(child_scope)
+            await route.handle(scope, receive, send)
+            return
+
+        # No chained router matched either, skip straight to the last default app
+        await self.chained[-1].default(scope, receive, send)
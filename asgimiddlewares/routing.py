@@ -6,7 +6,37 @@ import starlette
 from connexion.middleware.routing import RoutingAPI, RoutingMiddleware
 from connexion.spec import Specification
 from starlette.routing import Route
-from starlette.types import Receive, Scope, Send
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .route_index import IndexedRouter
+
+
+class RouteMatch:  # pylint: disable=too-few-public-methods
+    """
+    Route matched by CustomRoutingMiddleware.
+
+    It is stored in scope["state"]["route_match"], so the following middlewares
+    do not need to match the request against the routes again.
+    """
+
+    __slots__ = ("mount_path", "route", "path_id")
+
+    def __init__(self, mount_path: str, route: Route) -> None:
+        self.mount_path = mount_path
+        self.route = route
+        self.path_id = mount_path + route.path_format
+
+
+class _RouteMatchRecorder:  # pylint: disable=too-few-public-methods
+    """Store the RouteMatch of a route in the scope before calling its operation."""
+
+    def __init__(self, app: ASGIApp, route_match: RouteMatch) -> None:
+        self.app = app
+        self.route_match = route_match
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scope["state"]["route_match"] = self.route_match
+        await self.app(scope, receive, send)
 
 
 class CustomRoutingMiddleware(  # pragma: no cover
@@ -17,6 +47,19 @@ class CustomRoutingMiddleware(  # pragma: no cover
     instead of connexion RoutingAPI.
     """
 
+    def __init__(self, app: ASGIApp, route_index: bool = False) -> None:
+        """
+        To enable the compiled route index, use functools.partial() with the
+        required kwargs.
+
+        :param ASGIApp app: ASGI app or a middleware layer.
+        :param bool route_index: Resolve routes of every added API through
+        a compiled radix tree (see IndexedRouter) instead of trying the regex
+        of each route one by one. Defaults to False.
+        """
+        super().__init__(app)
+        self.route_index = route_index
+
     def add_api(
         self,
         specification: Specification,
@@ -67,6 +110,18 @@ class CustomRoutingMiddleware(  # pragma: no cover
 
         api.router.routes.sort(key=sorting_func, reverse=True)
 
+        # Same path as the Mount created below
+        mount_path = api.base_path.rstrip("/")
+        for route in api.router.routes:
+            if isinstance(route, Route):
+                route.app = _RouteMatchRecorder(
+                    route.app, RouteMatch(mount_path, route)
+                )
+
+        if self.route_index:
+            # The index keeps the order of the sorted routes as their priority
+            api.router = IndexedRouter(api.router.routes, default=api.router.default)
+
         # If an API with the same base_path was already registered, chain the new API
         # as its default. This way, if no matching route is found on the first API,
         # the request is forwarded to the new API.
@@ -75,10 +130,20 @@ class CustomRoutingMiddleware(  # pragma: no cover
                 isinstance(route, starlette.routing.Mount)
                 and route.path == api.base_path
             ):
+                if isinstance(route.app, IndexedRouter):
+                    # Merge the routes into the index of the first API, so a miss
+                    # does not scan the routes of every chained API one by one.
+                    # APIs chained before are part of the same index already.
+                    route.app.chain(api.router)
+                    break
                 route.app.default = api.router  # type: ignore
 
         self.router.mount(api.base_path, app=api.router)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send):
         scope["router"] = self.router
+        if scope["type"] == "http":
+            # The state is shared with the scope copy passed to the next middlewares,
+            # None means that no route matched (yet).
+            scope.setdefault("state", {})["route_match"] = None
         return await super().__call__(scope, receive, send)
@@ -0,0 +1,73 @@
+"""Sampling of the access log records by route and status"""
+
+import time
+from typing import Optional
+
+__all__ = ["AccessLogSampler"]
+
+
+class AccessLogSampler:  # pylint: disable=too-few-public-methods
+    """
+    Decide which requests get an access log record, see ExtendedLoggingMiddleware.
+
+    Errors and slow requests are always kept. The records of the other requests
+    are capped per path_id and status by a token bucket, so the health and polling
+    endpoints cannot flood the logs. Every kept record stands for the requests of
+    its route skipped since the previous kept one, its weight is their number
+    plus one, so the sum of the weights is the number of requests.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: Optional[float] = None,
+        slow: Optional[float] = 1.0,
+        error_status: int = 500,
+    ) -> None:
+        """
+        :param float rate: Records per second kept for every path_id and status,
+        defaults to 10.
+        :param float burst: Records kept at once after a quiet period, at least 1,
+        defaults to the rate.
+        :param float slow: Requests whose response starts after this many seconds
+        are always kept, None disables it. Defaults to 1 second.
+        :param int error_status: Requests with this status or higher are always
+        kept, defaults to 500.
+        """
+        burst = rate if burst is None else burst
+        if rate <= 0:
+            raise ValueError("The rate must be positive!")
+        if burst < 1:
+            raise ValueError("The burst must be at least 1!")
+        self.rate = rate
+        self.burst = burst
+        self.slow = slow
+        self.error_status = error_status
+        # (path_id, status) -> [tokens, time of the last refill, skipped requests]
+        self._buckets: dict[tuple[Optional[str], int], list[float]] = {}
+
+    def sample(self, path_id: Optional[str], status: int, elapsed: float) -> int:
+        """
+        :param str path_id: Route of the request.
+        :param int status: Status of the response.
+        :param float elapsed: Seconds until the response started.
+        :return: Weight of the record, 0 if the request is not logged.
+        """
+        if status >= self.error_status or (
+            self.slow is not None and elapsed >= self.slow
+        ):
+            return 1
+        now = time.monotonic()
+        bucket = self._buckets.get((path_id, status))
+        if bucket is None:
+            bucket = self._buckets[(path_id, status)] = [self.burst, now, 0]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return 0
+        bucket[0] = tokens - 1
+        weight = int(bucket[2]) + 1
+        bucket[2] = 0
+        return weight
@@ -0,0 +1,108 @@
+"""Static response headers added by the prefix of the request path."""
+
+from typing import Iterable, NamedTuple, Optional
+
+__all__ = ["HeaderRule", "StaticHeaders"]
+
+RawHeaders = tuple[tuple[bytes, bytes], ...]
+
+
+class HeaderRule(NamedTuple):
+    """
+    Header added to the responses of the paths selected by their prefixes.
+
+    A path starts with a prefix if it is the prefix or continues it in any way,
+    '/v1/ui' selects also path '/v1/ui/#'.
+    """
+
+    name: str
+    value: str
+    # Add the header only to the paths starting with one of these, None for all paths
+    include: Optional[tuple[str, ...]] = None
+    # Never add the header to the paths starting with one of these
+    exclude: tuple[str, ...] = ()
+
+
+class _Node:  # pylint: disable=too-few-public-methods
+    """Node of the prefix trie, one character of the prefixes deeper than its parent."""
+
+    __slots__ = ("children", "headers")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        # Headers of the paths whose longest matching prefix ends here, None if no
+        # prefix ends here
+        self.headers: Optional[RawHeaders] = None
+
+
+class StaticHeaders:  # pylint: disable=too-few-public-methods
+    """
+    Compile header rules into the encoded headers of every path prefix.
+
+    The prefixes of all rules form a trie. The prefixes matching a path are the
+    ones ending on its way down the trie, all of them are known once the deepest
+    one is found. Every node ending a prefix therefore holds the final headers
+    of its paths, so a response costs a walk down the trie at most as deep as
+    the longest prefix, no matter how many rules there are.
+    """
+
+    def __init__(self, rules: Iterable[HeaderRule]) -> None:
+        """
+        :param Iterable[HeaderRule] rules: Header rules, the headers are added in
+        this order.
+        """
+        self.rules = tuple(rules)
+        self._encoded = [
+            (rule.name.lower().encode("latin-1"), rule.value.encode("latin-1"))
+            for rule in self.rules
+        ]
+        # Headers of the paths matching no prefix
+        self._default = self._headers(set())
+        self._root = _Node()
+        for rule in self.rules:
+            for prefix in (*(rule.include or ()), *rule.exclude):
+                self._insert(prefix)
+        self._compile(self._root, "", set())
+        if self._root.headers is not None:
+            # The empty prefix matches every path
+            self._default = self._root.headers
+
+    def _insert(self, prefix: str) -> None:
+        node = self._root
+        for char in prefix:
+            node = node.children.setdefault(char, _Node())
+        # Marks the end of a prefix, the headers are compiled later
+        node.headers = ()
+
+    def _compile(self, node: _Node, prefix: str, matched: set[str]) -> None:
+        """Set the headers of every node ending a prefix, given the matched ones."""
+        if node.headers is not None:
+            matched = matched | {prefix}
+            node.headers = self._headers(matched)
+        for char, child in node.children.items():
+            self._compile(child, prefix + char, matched)
+
+    def _headers(self, matched: set[str]) -> RawHeaders:
+        """Return the headers of the paths starting with exactly these prefixes."""
+        return tuple(
+            header
+            for rule, header in zip(self.rules, self._encoded)
+            if (rule.include is None or not matched.isdisjoint(rule.include))
+            and matched.isdisjoint(rule.exclude)
+        )
+
+    def for_path(self, path: str) -> RawHeaders:
+        """
+        :param str path: Path of the request.
+        :return: Encoded headers of the path, ready for the raw response headers.
+        """
+        headers = self._default
+        children = self._root.children
+        for char in path:
+            node = children.get(char)
+            if node is None:
+                break
+            if node.headers is not None:
+                headers = node.headers
+            children = node.children
+        return headers
@@ -1,18 +1,152 @@
 """Utilities for middleware placement and context handling."""
 
-from typing import Any, Optional
-from contextvars import ContextVar
+import logging
+from typing import Any, ContextManager, Optional
+from contextvars import ContextVar, Token
 
 from opentelemetry.trace import Span, INVALID_SPAN
 from starlette.types import Scope
 
 logging_ctx_var: ContextVar[dict[str, Any]] = ContextVar("extended_logs", default={})
+# Fields of the outermost logging context of the request, None outside of one
+_open_logging_ctx_var: ContextVar[Optional[dict[str, Any]]] = ContextVar(
+    "open_extended_logs", default=None
+)
 
 request_time_ctx_var: ContextVar[Optional[float]] = ContextVar(
     "request_time", default=None
 )
 
 
+class _LoggingContext:
+    """Context manager of logging_context(), a class is cheaper than a generator."""
+
+    __slots__ = ("data", "tokens")
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        self.data = data
+        self.tokens: Optional[tuple[Token[Any], Token[Any]]] = None
+
+    def __enter__(self) -> dict[str, Any]:
+        outer = _open_logging_ctx_var.get()
+        if outer is not None:
+            outer.update(self.data)
+            return outer
+        self.tokens = (
+            logging_ctx_var.set(self.data),
+            _open_logging_ctx_var.set(self.data),
+        )
+        return self.data
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self.tokens is not None:
+            token, open_token = self.tokens
+            _open_logging_ctx_var.reset(open_token)
+            logging_ctx_var.reset(token)
+
+
+def logging_context(data: dict[str, Any]) -> ContextManager[dict[str, Any]]:
+    """
+    Make the logging fields of a request available in logging_ctx_var for the
+    duration of the block, the previous value is restored afterwards.
+
+    Contexts opened inside another one add their fields to the dictionary of the
+    outermost context, so the fields outlive the inner block for the outer layers,
+    e.g. AccessLogMiddleware in front of ExtendedLoggingMiddleware.
+
+    :param dict data: Logging fields of the request.
+    :return: Context manager of the dictionary holding the fields, update this one.
+    """
+    return _LoggingContext(data)
+
+
+class LoggingContextFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    Attach the logging fields of the current request to every log record as
+    the `request` attribute (or another one). The record refers to the dictionary
+    in logging_ctx_var, it is not copied, so read the fields before the request
+    ends.
+
+    Add the filter to the handlers, to the loggers or use it as is.
+    """
+
+    def __init__(self, attribute: str = "request", level: int = logging.NOTSET) -> None:
+        """
+        :param str attribute: Name of the attribute of the record holding the fields,
+        defaults to "request".
+        :param int level: Attach the fields only to the records of this level and
+        above, e.g. logging.INFO leaves the DEBUG records alone. Defaults to all
+        records.
+        """
+        super().__init__()
+        self.attribute = attribute
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.level:
+            setattr(record, self.attribute, logging_ctx_var.get())
+        return True
+
+
+class RequestPhases:  # pylint: disable=too-few-public-methods
+    """
+    Durations of the phases of a request in seconds, measured by
+    RequestTimeMiddleware. A phase not reached (yet) is None.
+
+    body_read: From the first to the last chunk of the request body.
+    first_byte: From the request to the start of the response.
+    complete: From the request to the last chunk of the response body.
+    send_wait: Total time spent awaiting `send`, long for slow clients.
+    """
+
+    __slots__ = ("body_read", "first_byte", "complete", "send_wait")
+
+    def __init__(self) -> None:
+        self.body_read: Optional[float] = None
+        self.first_byte: Optional[float] = None
+        self.complete: Optional[float] = None
+        self.send_wait = 0.0
+
+    def as_dict(self) -> dict[str, Optional[float]]:
+        """Return the durations by the names of the phases."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+request_phases_ctx_var: ContextVar[Optional[RequestPhases]] = ContextVar(
+    "request_phases", default=None
+)
+
+
+class TraceContext(str):
+    """
+    Trace context of a request, the string of the trace_id in the W3C form,
+    32 lowercase hex digits, which keeps the integer IDs of the span as well.
+    It is a str, so it is serialized like the trace_id string was. The string is
+    therefore formatted when the context is created, not lazily: json.dumps() and
+    the other consumers of a str read its characters directly.
+
+    See https://www.w3.org/TR/trace-context/#trace-id
+    """
+
+    trace_id: int
+    span_id: int
+
+    def __new__(cls, trace_id: int, span_id: int = 0) -> "TraceContext":
+        context = super().__new__(cls, format(trace_id, "032x"))
+        context.trace_id = trace_id
+        context.span_id = span_id
+        return context
+
+    def __getnewargs__(self) -> tuple[int, int]:  # type: ignore[override]
+        # Copied and pickled from the integer IDs, not from the string
+        return self.trace_id, self.span_id
+
+    @property
+    def span_id_hex(self) -> str:
+        """The span_id in the W3C form, 16 lowercase hex digits."""
+        return format(self.span_id, "016x")
+
+
 def replace_middleware(
     middleware_list: list[Any], original: Any, replacement: Any
 ) -> None:
@@ -28,15 +162,18 @@ def replace_middleware(
 
 
 def server_request_hook(span: Span, scope: Scope) -> None:
-    """Request hook to store trace_id to the scope"""
+    """
+    Request hook to store trace_id to the scope, as a TraceContext keeping the
+    integer IDs of the span
+    """
     # We need to check even unrecorded spans.
     # Unrecorded spans can be set by traceparent header
     # with unsampled flag, see https://www.w3.org/TR/trace-context/#traceparent-header
     # but trace_id is also used for debugging purposes
     if span and span != INVALID_SPAN:
-        trace_id = None
+        trace_id: Optional[TraceContext] = None
         span_context = span.get_span_context()
         if span_context.trace_id != 0:
             # trace_id 0 means invalid span
-            trace_id = str(hex(span_context.trace_id))
+            trace_id = TraceContext(span_context.trace_id, span_context.span_id)
         scope["state"]["trace_id"] = trace_id
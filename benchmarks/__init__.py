@@ -0,0 +1 @@
+"""Micro-benchmarks of the middlewares, run them with `python -m benchmarks.<module>`."""
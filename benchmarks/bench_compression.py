@@ -0,0 +1,86 @@
+"""Measure the throughput and the ratio of the CompressionMiddleware."""
+
+import json
+from typing import Any
+
+from starlette.types import Message, Receive, Scope, Send
+
+from asgimiddlewares import CompressionMiddleware
+
+from .utils import measure, empty_receive, run
+
+# A JSON list response of almost 1 MiB
+ITEMS = [
+    {
+        "id": i,
+        "name": f"certification project {i}",
+        "status": "active" if i % 3 else "archived",
+        "owner": {"id": i % 97, "email": f"owner{i % 97}@example.com"},
+        "tags": ["api", "v1", f"team-{i % 11}"],
+        "created": f"2024-01-{i % 28 + 1:02d}T12:00:00Z",
+    }
+    for i in range(4600)
+]
+BODY = json.dumps(ITEMS).encode()
+# The same response streamed item by item, like a newline-delimited JSON response
+LINES = [json.dumps(item).encode() + b"\n" for item in ITEMS]
+SCOPE = {
+    "type": "http",
+    "path": "/v1/projects",
+    "headers": [(b"accept-encoding", b"gzip, deflate")],
+}
+
+
+async def respond(_scope: Scope, _receive: Receive, send: Send) -> None:
+    """Send the whole body at once."""
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": BODY, "more_body": False})
+
+
+async def stream(_scope: Scope, _receive: Receive, send: Send) -> None:
+    """Send the body line by line."""
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    for line in LINES:
+        await send({"type": "http.response.body", "body": line, "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class CountingSend:  # pylint: disable=too-few-public-methods
+    """ASGI send callable counting the bytes of the response body."""
+
+    def __init__(self) -> None:
+        self.length = 0
+
+    async def __call__(self, message: Message) -> None:
+        self.length += len(message.get("body", b""))
+
+
+def main() -> None:
+    """Run the benchmark for the compression levels, chunk sizes and both bodies."""
+    cases: dict[str, dict[str, Any]] = {
+        "level 1": {"level": 1},
+        "level 6 (default)": {},
+        "level 9": {"level": 9},
+        "level 6, chunk_size 16 KiB": {"chunk_size": 16 * 1024},
+        "level 6, chunk_size 1 MiB": {"chunk_size": 1024 * 1024},
+    }
+    print(f"CompressionMiddleware, {len(BODY) / 2**20:.2f} MiB JSON body")
+    for body_name, app in (("at once", respond), ("streamed by line", stream)):
+        for name, kwargs in cases.items():
+            middleware = CompressionMiddleware(app, **kwargs)
+            counting_send = CountingSend()
+            run(middleware(dict(SCOPE), empty_receive, counting_send))
+
+            def dispatch(middleware: CompressionMiddleware = middleware) -> None:
+                run(middleware(dict(SCOPE), empty_receive, CountingSend()))
+
+            nanoseconds = measure(dispatch, number=5, repeat=3)
+            print(
+                f"  {body_name + ', ' + name:<48}"
+                f" {len(BODY) / nanoseconds * 1e9 / 2**20:>8,.1f} MiB/s"
+                f" {len(BODY) / counting_send.length:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Compare the ExtendedLoggingMiddleware with the default and with a minimal field set."""
+
+from asgimiddlewares import AccessLogSampler, ExtendedLoggingMiddleware
+
+from .bench_observability import response_app
+from .utils import measure, noop_send, empty_receive, report, run
+
+
+def main() -> None:
+    """Run the benchmark for the field sets and with a sampler."""
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/v1/foo/spam",
+        "http_version": "1.1",
+        "query_string": b"limit=10",
+        "client": ("127.0.0.1", 12345),
+        "headers": [
+            (b"host", b"localhost"),
+            (b"user-agent", b"curl/8.0"),
+            (b"accept", b"application/json"),
+            (b"x-forwarded-for", b"10.0.0.1"),
+        ],
+        "state": {"trace_id": "0x123", "path_id": "/v1/foo/{bar}"},
+    }
+    results = {}
+    for name, middleware in (
+        ("default fields", ExtendedLoggingMiddleware(response_app)),
+        ("method, path", ExtendedLoggingMiddleware(response_app, ("method", "path"))),
+        (
+            "method, path_id, status",
+            ExtendedLoggingMiddleware(response_app, ("method", "path_id", "status")),
+        ),
+        (
+            # Nearly every request is skipped
+            "default fields, sampled",
+            ExtendedLoggingMiddleware(
+                response_app, sampler=AccessLogSampler(rate=0.01, burst=1)
+            ),
+        ),
+    ):
+
+        def dispatch(middleware: ExtendedLoggingMiddleware = middleware) -> None:
+            run(middleware(dict(scope), empty_receive, noop_send))
+
+        results[name] = measure(dispatch)
+    report("ExtendedLoggingMiddleware", results)
+
+
+if __name__ == "__main__":
+    main()
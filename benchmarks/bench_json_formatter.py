@@ -0,0 +1,71 @@
+"""Compare the JsonAccessLogFormatter with json.dumps() of the access log records."""
+
+import json
+import logging
+
+from asgimiddlewares import JsonAccessLogFormatter, TraceContext
+from asgimiddlewares.json_formatter import json_serializer
+
+from .utils import measure, report
+
+# Fields of a typical request with the default settings
+FIELDS = {
+    "method": "GET",
+    "path": "/v1/foo/spam",
+    "path_id": "/v1/foo/{bar}",
+    "protocol": "HTTP/1.1",
+    "query": "limit=10",
+    "referer": None,
+    "remote_address": "127.0.0.1",
+    "request_length": 0,
+    "response_length": 1234,
+    "status": 200,
+    "username": "-",
+    "user_agent": "curl/8.0",
+    "trace_id": TraceContext(0x5D66F33F56B69EAD5D79F7A928FDE097),
+    "True-Client-IP": None,
+    "X-Akamai-RH-Edge-Id": None,
+    "X-Forwarded-For": "10.0.0.1",
+    "X-Forwarded-Proto": "https",
+    "X-Forwarded-Port": "443",
+    "X-Forwarded-Host": None,
+}
+
+
+class JsonDumpsFormatter(logging.Formatter):
+    """The generic way, json.dumps() of the fields in the message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, default=str)
+
+
+def main() -> None:
+    """Run the benchmark with and without the phases of RequestTimeMiddleware."""
+    phases = {"body_read": 0.0001, "first_byte": 0.012, "complete": 0.013}
+    for title, fields in (
+        ("default fields", FIELDS),
+        ("default fields and phases", {**FIELDS, "phases": phases}),
+    ):
+        record = logging.LogRecord(
+            "bench", logging.INFO, __file__, 1, fields, None, None
+        )
+        results = {}
+        for name, formatter in (
+            ("json.dumps()", JsonDumpsFormatter()),
+            (
+                "JsonAccessLogFormatter, json module",
+                JsonAccessLogFormatter(serializer=json_serializer),
+            ),
+            (
+                "JsonAccessLogFormatter, orjson if installed",
+                JsonAccessLogFormatter(),
+            ),
+        ):
+            results[name] = measure(
+                lambda formatter=formatter: formatter.format(record)  # type: ignore
+            )
+        report(f"Access log record as JSON, {title}", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare the separate observability middlewares with the ObservabilityMiddleware."""
+
+from unittest.mock import patch
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from asgimiddlewares import (
+    CustomHeaderMiddleware,
+    ExtendedLoggingMiddleware,
+    ObservabilityMiddleware,
+    PrometheusMiddleware,
+    RequestTimeMiddleware,
+)
+
+from .utils import measure, noop_send, empty_receive, report, run
+
+
+async def response_app(_scope: Scope, _receive: Receive, send: Send) -> None:
+    """Send a small JSON response."""
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", b"2"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def main() -> None:
+    """Run the benchmark on the recommended stack and on the fused middleware."""
+    # Neither the metrics server nor the host collectors are needed here and the
+    # collectors can only be unregistered once.
+    with (
+        patch("asgimiddlewares.prometheus._setup_prometheus"),
+        patch("prometheus_client.REGISTRY.unregister"),
+    ):
+        stack = CustomHeaderMiddleware(
+            ExtendedLoggingMiddleware(
+                PrometheusMiddleware(
+                    RequestTimeMiddleware(response_app), service_name="stack"
+                )
+            )
+        )
+        fused = ObservabilityMiddleware(
+            response_app, prometheus=True, service_name="fused"
+        )
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/v1/foo/spam",
+        "http_version": "1.1",
+        "query_string": b"",
+        "client": ("127.0.0.1", 12345),
+        "headers": [
+            (b"host", b"localhost"),
+            (b"user-agent", b"curl/8.0"),
+            (b"accept", b"application/json"),
+        ],
+        "state": {"trace_id": "0x123", "path_id": "/v1/foo/{bar}"},
+    }
+    results = {}
+    for name, middleware in (("separate middlewares", stack), ("fused", fused)):
+
+        def dispatch(middleware: ASGIApp = middleware) -> None:
+            run(middleware(dict(scope), empty_receive, noop_send))
+
+        results[name] = measure(dispatch)
+    report("Observability, all jobs enabled", results)
+
+
+if __name__ == "__main__":
+    main()
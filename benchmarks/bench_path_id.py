@@ -0,0 +1,52 @@
+"""Compare the PathIdMiddleware route scan with the match recorded by routing."""
+
+from starlette.routing import Mount, Router
+
+from asgimiddlewares import PathIdMiddleware
+from asgimiddlewares.routing import RouteMatch
+
+from .bench_routing import build_routes
+from .utils import measure, noop_app, noop_send, empty_receive, report, run
+
+
+def main() -> None:
+    """Run the benchmark for specs of different sizes."""
+    middleware = PathIdMiddleware(noop_app)
+    for operations in (10, 100, 1000):
+        routes = build_routes(operations)
+        router = Router([Mount("/v1", app=Router(routes))])
+        results = {}
+        for route in (routes[0], routes[-1]):
+            path = "/v1" + route.path_format.replace("{id}", "1").replace(
+                "{sub_id}", "2"
+            )
+            route_match = RouteMatch("/v1", route)
+
+            def scan(path: str = path) -> None:
+                scope = {
+                    "type": "http",
+                    "method": "GET",
+                    "path": path,
+                    "router": router,
+                    "state": {},
+                }
+                run(middleware(scope, empty_receive, noop_send))
+
+            def recorded(path: str = path, route_match: RouteMatch = route_match):
+                scope = {
+                    "type": "http",
+                    "method": "GET",
+                    "path": path,
+                    "router": router,
+                    "state": {"route_match": route_match},
+                }
+                run(middleware(scope, empty_receive, noop_send))
+
+            number = max(100, 100_000 // operations)
+            results[f"scan: {path}"] = measure(scan, number=number)
+            results[f"route_match: {path}"] = measure(recorded, number=number)
+        report(f"PathIdMiddleware, {operations} routes", results)
+
+
+if __name__ == "__main__":
+    main()
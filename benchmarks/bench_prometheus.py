@@ -0,0 +1,52 @@
+"""
+Compare binding the metric labels on every response with the cached children,
+and updating the metrics directly with buffering the updates.
+"""
+
+from unittest.mock import patch
+
+from asgimiddlewares import PrometheusMiddleware
+
+from .utils import measure, noop_app, report
+
+
+def main() -> None:
+    """Run the benchmark on the in-process metrics of prometheus_client."""
+    # Neither the metrics server nor the host collectors are needed here
+    with (
+        patch("asgimiddlewares.prometheus._setup_prometheus"),
+        patch("prometheus_client.REGISTRY.unregister"),
+    ):
+        middleware = PrometheusMiddleware(noop_app, service_name="bench")
+        buffered = PrometheusMiddleware(
+            noop_app, service_name="bench_buffered", flush_interval=3600
+        )
+    scope = {"method": "GET", "path": "/v1/foo/1", "state": {"path_id": "/v1/foo/{x}"}}
+
+    def labels() -> None:
+        # What every response did before the children were cached
+        status_code = str(200)
+        path_id = scope["state"]["path_id"]
+        middleware.histogram.labels(
+            middleware.hostname, status_code, scope["method"], path_id
+        ).observe(0.01)
+        middleware.counter.labels(middleware.hostname, status_code, "GET").inc(1)
+
+    def observe() -> None:
+        middleware.observe(scope, 200, 0.01)
+
+    def observe_buffered() -> None:
+        buffered.observe(scope, 200, 0.01)
+
+    report(
+        "PrometheusMiddleware, metrics update per response",
+        {
+            "labels() per response": measure(labels),
+            "cached children": measure(observe),
+            "buffered": measure(observe_buffered),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
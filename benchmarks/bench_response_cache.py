@@ -0,0 +1,63 @@
+"""Compare a response replayed by the ResponseCacheMiddleware with calling the app."""
+
+import asyncio
+import json
+
+from starlette.types import Receive, Scope, Send
+
+from asgimiddlewares import CacheRule, ResponseCacheMiddleware
+
+from .utils import measure, noop_send, empty_receive, report, run
+
+PATH_ID = "/v1/projects"
+ITEMS = [{"id": i, "name": f"project {i}", "tags": ["a", "b"]} for i in range(100)]
+
+
+async def json_app(_scope: Scope, _receive: Receive, send: Send) -> None:
+    """Serialize a list of 100 items like a Connexion operation would."""
+    body = json.dumps(ITEMS).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def main() -> None:
+    """Run the benchmark for a cached and a not cached route."""
+    middleware = ResponseCacheMiddleware(json_app, {PATH_ID: CacheRule(ttl=3600)})
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": PATH_ID,
+        "query_string": b"offset=0&limit=100",
+        "headers": [(b"host", b"localhost"), (b"accept", b"application/json")],
+    }
+
+    def dispatch(app: ResponseCacheMiddleware, path_id: str) -> None:
+        run(app({**scope, "state": {"path_id": path_id}}, empty_receive, noop_send))
+
+    # A miss lets other requests of its key wait for it, so it needs an event loop
+    asyncio.run(
+        middleware({**scope, "state": {"path_id": PATH_ID}}, empty_receive, noop_send)
+    )
+    report(
+        "ResponseCacheMiddleware, JSON list of 100 items",
+        {
+            "no middleware": measure(
+                lambda: run(json_app(scope, empty_receive, noop_send))
+            ),
+            "not cached route": measure(lambda: dispatch(middleware, "/v1/other")),
+            "hit": measure(lambda: dispatch(middleware, PATH_ID)),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare the sorted linear scan of Starlette's Router with the IndexedRouter."""
+
+from starlette.routing import Route, Router
+
+from asgimiddlewares.route_index import IndexedRouter
+
+from .utils import measure, noop_app, noop_send, empty_receive, report, run
+
+
+def build_routes(operations: int, prefix: str = "resource") -> list[Route]:
+    """
+    Build routes shaped like a typical OpenAPI spec and sort them the same way
+    CustomRoutingMiddleware.add_api does.
+    """
+    routes = []
+    for i in range(operations // 3 + 1):
+        routes.append(Route(f"/{prefix}{i}", noop_app, methods=["GET"]))
+        routes.append(Route(f"/{prefix}{i}/{{id}}", noop_app, methods=["GET"]))
+        routes.append(
+            Route(f"/{prefix}{i}/{{id}}/sub/{{sub_id}}", noop_app, methods=["GET"])
+        )
+    routes = routes[:operations]
+
+    def sorting_func(route: Route) -> int:
+        if not route.param_convertors:
+            return len(routes) + 1
+        return len(route.path_regex.pattern)
+
+    routes.sort(key=sorting_func, reverse=True)
+    return routes
+
+
+def main() -> None:
+    """Run the benchmark for specs of different sizes."""
+    for operations in (10, 100, 1000):
+        routes = build_routes(operations)
+        paths = {
+            "first route": "/resource0/1/sub/2",
+            "last route": f"/resource{(operations - 1) // 3}/1",
+            "miss": "/unknown/1/2",
+        }
+        results = {}
+        for router in (
+            Router(routes, default=noop_app),
+            IndexedRouter(routes, noop_app),
+        ):
+            for case, path in paths.items():
+
+                def dispatch(router: Router = router, path: str = path) -> None:
+                    scope = {"type": "http", "method": "GET", "path": path}
+                    run(router.app(scope, empty_receive, noop_send))
+
+                results[f"{type(router).__name__}: {path}"] = measure(
+                    dispatch, number=max(100, 100_000 // operations)
+                )
+        report(f"Routing, {operations} routes", results)
+
+    for specs in (1, 4, 16):
+        # Specs sharing a base path, CustomRoutingMiddleware.add_api chains them
+        layers = [build_routes(100, prefix=f"spec{i}_") for i in range(specs)]
+        paths = {"last spec": f"/spec{specs - 1}_0/1", "miss": "/unknown/1/2"}
+        results = {}
+        for router_class in (Router, IndexedRouter):
+            routers = [router_class(routes, default=noop_app) for routes in layers]
+            first = routers[0]
+            for previous, router in zip(routers, routers[1:]):
+                if isinstance(first, IndexedRouter):
+                    first.chain(router)
+                else:
+                    previous.default = router
+            for case, path in paths.items():
+
+                def chained(router: Router = first, path: str = path) -> None:
+                    scope = {"type": "http", "method": "GET", "path": path}
+                    run(router.app(scope, empty_receive, noop_send))
+
+                results[f"{router_class.__name__}: {case}"] = measure(
+                    chained, number=max(100, 10_000 // specs)
+                )
+        report(f"Routing, {specs} chained specs of 100 routes", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Measure the overhead of every middleware on its own and of the recommended stack.
+
+Synthetic ASGI scopes are driven through each middleware in front of a no-op app,
+with small and large request header sets and with a streamed request and response
+body. The routing middleware is measured with specs of 10, 100 and 1000 routes.
+Every case reports ns/request and the peak of the memory allocated per request.
+
+Save the results of the main branch and compare a change against them, the run
+fails if a case gets slower than the threshold allows:
+
+    python -m benchmarks.bench_suite --save baseline.json
+    python -m benchmarks.bench_suite --baseline baseline.json --threshold 0.2
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import sys
+from typing import Any, Callable, Optional
+from unittest.mock import patch
+
+from connexion.spec import Specification
+from starlette.routing import Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from asgimiddlewares import (
+    CustomExceptionMiddleware,
+    CustomHeaderMiddleware,
+    CustomRoutingMiddleware,
+    ExtendedLoggingMiddleware,
+    HeaderRule,
+    ObservabilityMiddleware,
+    PathIdMiddleware,
+    PrometheusMiddleware,
+    RequestTimeMiddleware,
+)
+from asgimiddlewares.routing import RouteMatch
+
+from .bench_routing import build_routes
+from .utils import measure, measure_peak_memory, noop_send, empty_receive, run
+
+SMALL_HEADERS = [
+    (b"host", b"localhost"),
+    (b"user-agent", b"curl/8.0"),
+    (b"accept", b"application/json"),
+]
+LARGE_HEADERS = SMALL_HEADERS + [
+    (b"cookie", b"; ".join(b"cookie%d=%s" % (i, b"x" * 64) for i in range(64))),
+    (b"authorization", b"Bearer " + b"t" * 2048),
+    *[(b"x-custom-%d" % i, b"value-%d" % i) for i in range(40)],
+]
+STREAMED_CHUNKS = 16
+CHUNK = b"x" * 4096
+
+_ROUTE = build_routes(3)[0]
+
+
+async def respond(_scope: Scope, receive: Receive, send: Send) -> None:
+    """Read the whole request body and send a response in one or more chunks."""
+    chunks = 1
+    message = await receive()
+    while message.get("more_body", False):
+        chunks = STREAMED_CHUNKS
+        message = await receive()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    for i in range(chunks):
+        await send(
+            {"type": "http.response.body", "body": CHUNK, "more_body": i < chunks - 1}
+        )
+
+
+def streamed_receive() -> Receive:
+    """Return a receive callable streaming the request body in chunks."""
+    remaining = STREAMED_CHUNKS
+
+    async def receive() -> Message:
+        nonlocal remaining
+        remaining -= 1
+        return {"type": "http.request", "body": CHUNK, "more_body": remaining > 0}
+
+    return receive
+
+
+def http_scope(path: str, headers: list[tuple[bytes, bytes]]) -> Scope:
+    """Build the scope of a GET request."""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 12345),
+        "root_path": "",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"limit=10",
+        "headers": headers,
+    }
+
+
+def build_specification(operations: int) -> Specification:
+    """Build an OpenAPI spec with the same routes as bench_routing.build_routes()."""
+    paths: dict[str, Any] = {}
+    for route in build_routes(operations):
+        parameters = [
+            {"name": name, "in": "path", "required": True, "schema": {"type": "string"}}
+            for name in route.param_convertors
+        ]
+        paths[route.path_format] = {
+            "get": {
+                "operationId": "os.getcwd",
+                "parameters": parameters,
+                "responses": {"200": {"description": "ok"}},
+            }
+        }
+    return Specification.load(
+        {"openapi": "3.0.0", "info": {"title": "bench", "version": "1"}, "paths": paths}
+    )
+
+
+def routing(app: ASGIApp, operations: int = 100, route_index: bool = False) -> ASGIApp:
+    """Build a CustomRoutingMiddleware serving a spec of `operations` routes."""
+    middleware = CustomRoutingMiddleware(app, route_index=route_index)
+    middleware.add_api(build_specification(operations), base_path="/v1")
+    return middleware
+
+
+_metric_names = itertools.count()
+
+
+def prometheus(app: ASGIApp, **kwargs: Any) -> ASGIApp:
+    """Build a PrometheusMiddleware, the metrics of every instance are separate."""
+    # Neither the metrics server nor the host collectors are needed here and the
+    # collectors can only be unregistered once.
+    with (
+        patch("asgimiddlewares.prometheus._setup_prometheus"),
+        patch("prometheus_client.REGISTRY.unregister"),
+    ):
+        return PrometheusMiddleware(
+            app, service_name=f"bench{next(_metric_names)}", **kwargs
+        )
+
+
+def observability(app: ASGIApp) -> ASGIApp:
+    """Build an ObservabilityMiddleware doing all its jobs."""
+    with (
+        patch("asgimiddlewares.prometheus._setup_prometheus"),
+        patch("prometheus_client.REGISTRY.unregister"),
+    ):
+        return ObservabilityMiddleware(
+            app, prometheus=True, service_name=f"bench{next(_metric_names)}"
+        )
+
+
+def many_headers(app: ASGIApp, rules: int = 100) -> ASGIApp:
+    """Build a CustomHeaderMiddleware with `rules` static headers by path prefix."""
+    headers = [
+        HeaderRule(f"x-header-{i}", f"value-{i}", include=(f"/v1/resource{i}",))
+        for i in range(rules)
+    ]
+    return CustomHeaderMiddleware(app, headers=headers)
+
+
+def readme_stack(app: ASGIApp) -> ASGIApp:
+    """Build the stack recommended by the README, Connexion's own layers aside."""
+    inner = CustomExceptionMiddleware(routing(PathIdMiddleware(app)))
+    return CustomHeaderMiddleware(
+        ExtendedLoggingMiddleware(prometheus(RequestTimeMiddleware(inner)))
+    )
+
+
+def fused_stack(app: ASGIApp) -> ASGIApp:
+    """Build the stack recommended by the README with the ObservabilityMiddleware."""
+    return observability(CustomExceptionMiddleware(routing(PathIdMiddleware(app))))
+
+
+# Middlewares driven with every workload, built around the app responding
+MIDDLEWARES: dict[str, Callable[[ASGIApp], ASGIApp]] = {
+    "no middleware": lambda app: app,
+    "CustomExceptionMiddleware": CustomExceptionMiddleware,
+    "CustomHeaderMiddleware": CustomHeaderMiddleware,
+    "CustomHeaderMiddleware, 100 rules": many_headers,
+    "ExtendedLoggingMiddleware": ExtendedLoggingMiddleware,
+    "ObservabilityMiddleware": observability,
+    "PathIdMiddleware": PathIdMiddleware,
+    "PrometheusMiddleware": prometheus,
+    "RequestTimeMiddleware": RequestTimeMiddleware,
+    "README stack": readme_stack,
+    "README stack, fused": fused_stack,
+}
+
+WORKLOADS: dict[str, tuple[list[tuple[bytes, bytes]], Callable[[], Receive]]] = {
+    "small headers": (SMALL_HEADERS, lambda: empty_receive),
+    "large headers": (LARGE_HEADERS, lambda: empty_receive),
+    "streamed body": (SMALL_HEADERS, streamed_receive),
+}
+
+
+def request(
+    app: ASGIApp,
+    path: str,
+    headers: list[tuple[bytes, bytes]],
+    receive: Callable[[], Receive],
+) -> Callable[[], None]:
+    """Return a function sending a single request to the app."""
+    router = Router()
+
+    def dispatch() -> None:
+        scope = http_scope(path, headers)
+        # What the routing middleware provides to PathIdMiddleware on its own
+        scope["router"] = router
+        scope["state"] = {"route_match": RouteMatch("/v1", _ROUTE)}
+        run(app(scope, receive(), noop_send))
+
+    return dispatch
+
+
+def middleware_case(
+    factory: Callable[[ASGIApp], ASGIApp],
+    headers: list[tuple[bytes, bytes]],
+    receive: Callable[[], Receive],
+) -> Callable[[], None]:
+    """Build a middleware case, the request matches the first route of the spec."""
+    return request(factory(respond), "/v1/resource0/1", headers, receive)
+
+
+def routing_case(operations: int, route_index: bool) -> Callable[[], None]:
+    """Build a routing case, the request matches the last route of the spec."""
+    path = f"/v1/resource{(operations - 1) // 3}/1"
+    app = routing(respond, operations, route_index)
+    return request(app, path, SMALL_HEADERS, lambda: empty_receive)
+
+
+def build_cases() -> dict[str, Callable[[], Callable[[], None]]]:
+    """
+    Return the builder of the function sending a request for every case, so
+    only the selected cases are built.
+    """
+    cases = {}
+    for name, factory in MIDDLEWARES.items():
+        for workload, (headers, receive) in WORKLOADS.items():
+            cases[f"{name}: {workload}"] = functools.partial(
+                middleware_case, factory, headers, receive
+            )
+    for operations in (10, 100, 1000):
+        for route_index in (False, True):
+            router = "IndexedRouter" if route_index else "Router"
+            cases[f"CustomRoutingMiddleware, {operations} routes, {router}"] = (
+                functools.partial(routing_case, operations, route_index)
+            )
+    return cases
+
+
+def compare(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    """Return the cases slower than the baseline by more than the threshold."""
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        allowed = baseline[case]["ns"] * (1 + threshold)
+        if result["ns"] > allowed:
+            regressions.append(
+                f"{case}: {result['ns']:,.0f} ns, baseline "
+                f"{baseline[case]['ns']:,.0f} ns (+{threshold:.0%} allowed)"
+            )
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Run the suite, return a non-zero exit code if a case regressed."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-k", "--filter", default="", help="Run matching cases only.")
+    parser.add_argument("--number", type=int, default=2000, help="Requests per run.")
+    parser.add_argument("--save", help="Store the results in a JSON file.")
+    parser.add_argument("--baseline", help="Compare the results with a JSON file.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown against the baseline, defaults to 0.2 (20 %%).",
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'case':<64} {'ns/request':>12} {'peak B/request':>15}")
+    for case, build in build_cases().items():
+        if args.filter not in case:
+            continue
+        dispatch = build()
+        results[case] = {
+            "ns": measure(dispatch, number=args.number),
+            "peak_bytes": measure_peak_memory(dispatch),
+        }
+        result = results[case]
+        print(f"{case:<64} {result['ns']:>12,.0f} {result['peak_bytes']:>15,.0f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print("Regressions:", *regressions, sep="\n  ")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
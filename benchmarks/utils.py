@@ -0,0 +1,82 @@
+"""Helpers shared by the benchmarks."""
+
+import time
+import tracemalloc
+from typing import Any, Callable, Coroutine
+
+from starlette.types import Message, Receive, Scope, Send
+
+
+def run(coroutine: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Drive a coroutine that never suspends to completion without an event loop,
+    so the event loop overhead does not hide the cost of the middleware itself.
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("Benchmarked coroutine suspended")
+
+
+class NoopApp:  # pylint: disable=too-few-public-methods
+    """
+    ASGI app doing nothing. It is a class, so Starlette routes treat it as an ASGI
+    app and not as a request/response endpoint, like Connexion operations.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        pass
+
+
+noop_app = NoopApp()
+
+
+async def noop_send(_message: Message) -> None:
+    """ASGI send callable doing nothing."""
+
+
+async def empty_receive() -> Message:
+    """ASGI receive callable returning an empty request body."""
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+def measure(func: Callable[[], Any], number: int = 10_000, repeat: int = 5) -> float:
+    """Return the best time of `repeat` runs in nanoseconds per call of `func`."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter_ns() - start) / number)
+    return best
+
+
+def measure_peak_memory(func: Callable[[], Any], number: int = 100) -> float:
+    """
+    Return the average peak of memory allocated by one call of `func` in bytes,
+    short-lived objects freed before the call returns are included. CPython does
+    not count the allocations themselves outside of debug builds, tracemalloc
+    only keeps the blocks still alive.
+    """
+    func()  # Warm up caches, so only the per-call allocations are counted
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(number):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / number
+
+
+def report(title: str, results: dict[str, float]) -> None:
+    """Print the results of a benchmark, slowest case first."""
+    print(title)
+    for name, nanoseconds in sorted(
+        results.items(), key=lambda result: result[1], reverse=True
+    ):
+        print(f"  {name:<48} {nanoseconds:>12,.0f} ns")
@@ -0,0 +1,283 @@
+import logging
+import threading
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from asgimiddlewares import AccessLogEmitter, AccessLogMiddleware
+from asgimiddlewares.utils import logging_ctx_var
+
+
+class ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+@pytest.fixture
+def handler() -> ListHandler:
+    return ListHandler()
+
+
+@pytest.fixture
+def logger(handler: ListHandler) -> logging.Logger:
+    logger = logging.getLogger("tests.access")
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+class BlockedLogger:
+    """Logger blocking the writing thread until it is released."""
+
+    def __init__(self) -> None:
+        self.release = threading.Event()
+        self.records: list[Any] = []
+
+    def log(self, level: int, record: Any) -> None:
+        self.release.wait()
+        self.records.append(record)
+
+
+def test_access_log_emitter(logger: logging.Logger, handler: ListHandler):
+    emitter = AccessLogEmitter(logger, batch_size=2)
+    for i in range(5):
+        emitter.emit({"path": f"/{i}"})
+
+    emitter.close()
+
+    assert [record.msg for record in handler.records] == [
+        {"path": f"/{i}"} for i in range(5)
+    ]
+    assert all(record.levelno == logging.INFO for record in handler.records)
+    assert emitter.written == 5
+    assert emitter.dropped == 0
+    assert emitter.depth == 0
+    # Closing again does nothing
+    emitter.close()
+
+
+def test_access_log_emitter_drop():
+    logger = BlockedLogger()
+    emitter = AccessLogEmitter(logger, maxsize=2)  # type: ignore
+    for i in range(6):
+        emitter.emit({"path": f"/{i}"})
+
+    # The first record may have been taken by the blocked thread already
+    assert emitter.depth == 2
+    assert emitter.dropped in (3, 4)
+    logger.release.set()
+    emitter.close()
+    assert emitter.written + emitter.dropped == 6
+
+
+def test_access_log_emitter_sample():
+    logger = BlockedLogger()
+    emitter = AccessLogEmitter(logger, maxsize=100, overflow="sample", sample_every=3)
+    # Wait until the writing thread holds the first record
+    emitter.emit({"path": "/first"})
+    while emitter.depth:
+        pass
+    for i in range(50 + 30):
+        emitter.emit({"path": f"/{i}"})
+
+    # Half of the queue is filled, then only every third record is kept
+    assert emitter.depth == 60
+    assert emitter.dropped == 20
+    logger.release.set()
+    emitter.close()
+    assert emitter.written == 61
+
+
+def test_access_log_emitter_block():
+    logger = BlockedLogger()
+    emitter = AccessLogEmitter(logger, maxsize=1, overflow="block")  # type: ignore
+    emitter.emit({"path": "/first"})
+    while emitter.depth:
+        pass
+    emitter.emit({"path": "/queued"})
+
+    blocked = threading.Thread(target=emitter.emit, args=({"path": "/blocked"},))
+    blocked.start()
+    blocked.join(0.05)
+    assert blocked.is_alive()
+
+    logger.release.set()
+    blocked.join()
+    emitter.close()
+    assert emitter.written == 3
+    assert emitter.dropped == 0
+
+
+@pytest.mark.parametrize("overflow", ["drop", "sample"])
+def test_access_log_emitter_concurrent_counts(overflow: str):
+    logger = BlockedLogger()
+    emitter = AccessLogEmitter(logger, maxsize=10, overflow=overflow)  # type: ignore
+    records = [{"path": f"/{i}"} for i in range(500)]
+
+    def emit_all() -> None:
+        for record in records:
+            emitter.emit(record)
+
+    threads = [threading.Thread(target=emit_all) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.release.set()
+    emitter.close()
+
+    # No count is lost by the threads updating them at once
+    assert emitter.written + emitter.dropped == 8 * 500
+    assert emitter.written == len(logger.records)
+
+
+@pytest.mark.parametrize("overflow", ["drop", "block", "sample"])
+def test_access_log_emitter_closed(overflow: str):
+    logger = BlockedLogger()
+    emitter = AccessLogEmitter(logger, maxsize=1, overflow=overflow)  # type: ignore
+    logger.release.set()
+    emitter.close()
+
+    emitter.emit({"path": "/late"})
+
+    assert emitter.dropped == 1
+    assert emitter.written == 0
+
+
+def test_access_log_emitter_block_closed():
+    logger = BlockedLogger()
+    emitter = AccessLogEmitter(logger, maxsize=1, overflow="block")  # type: ignore
+    emitter.emit({"path": "/first"})
+    while emitter.depth:
+        pass
+    emitter.emit({"path": "/queued"})
+    blocked = threading.Thread(target=emitter.emit, args=({"path": "/blocked"},))
+    blocked.start()
+
+    # Closing stops the waiting, the record is dropped
+    closing = threading.Thread(target=emitter.close)
+    closing.start()
+    blocked.join()
+    assert emitter.dropped == 1
+    logger.release.set()
+    closing.join()
+    assert emitter.written == 2
+
+
+@pytest.mark.parametrize(
+    ["kwargs", "message"],
+    [
+        ({"overflow": "ignore"}, "Unknown overflow policy: 'ignore'!"),
+        ({"maxsize": 0}, "The queue size must be positive!"),
+    ],
+)
+def test_access_log_emitter_invalid(kwargs: dict[str, Any], message: str):
+    with pytest.raises(ValueError, match=message):
+        AccessLogEmitter(**kwargs)
+
+
+def test_access_log_emitter_default_logger():
+    emitter = AccessLogEmitter()
+    assert emitter.logger is logging.getLogger("asgimiddlewares.access")
+    emitter.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("raises", [False, True])
+async def test_access_log_middleware(raises: bool):
+    record = {"path": "/v1/ping", "status": 200}
+
+    async def app(scope: Any, receive: Any, send: Any) -> None:
+        logging_ctx_var.set(record)
+        if raises:
+            raise RuntimeError("boom")
+
+    emitter = MagicMock()
+    middleware = AccessLogMiddleware(app, emitter)
+
+    try:
+        await middleware({"type": "http"}, AsyncMock(), AsyncMock())
+    except RuntimeError:
+        assert raises
+
+    emitter.emit.assert_called_once_with(record)
+
+
+@pytest.mark.asyncio
+async def test_access_log_middleware_block():
+    record = {"path": "/v1/ping", "status": 200}
+    loop_thread = threading.get_ident()
+    emitted_from: list[int] = []
+
+    async def app(scope: Any, receive: Any, send: Any) -> None:
+        logging_ctx_var.set(record)
+
+    emitter = MagicMock(overflow="block")
+    emitter.emit.side_effect = lambda _: emitted_from.append(threading.get_ident())
+    middleware = AccessLogMiddleware(app, emitter)
+
+    await middleware({"type": "http"}, AsyncMock(), AsyncMock())
+
+    emitter.emit.assert_called_once_with(record)
+    # The blocking emit() does not run on the event loop
+    assert emitted_from != [loop_thread]
+
+
+@pytest.mark.asyncio
+async def test_access_log_middleware_without_fields():
+    emitter = MagicMock()
+    middleware = AccessLogMiddleware(AsyncMock(), emitter)
+    logging_ctx_var.set({})
+
+    await middleware({"type": "http"}, AsyncMock(), AsyncMock())
+
+    emitter.emit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_access_log_middleware_websocket():
+    mock_app = AsyncMock()
+    emitter = MagicMock()
+    middleware = AccessLogMiddleware(mock_app, emitter)
+    scope = {"type": "websocket"}
+    send = AsyncMock()
+
+    await middleware(scope, AsyncMock(), send)
+
+    mock_app.assert_awaited_once_with(scope, mock_app.call_args.args[1], send)
+    emitter.emit.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ["message_type", "closed"],
+    [
+        ("lifespan.startup.complete", False),
+        ("lifespan.shutdown.complete", True),
+        ("lifespan.shutdown.failed", True),
+    ],
+)
+async def test_access_log_middleware_lifespan(message_type: str, closed: bool):
+    mock_app = AsyncMock()
+    emitter = MagicMock()
+    middleware = AccessLogMiddleware(mock_app, emitter)
+    send = AsyncMock()
+
+    await middleware({"type": "lifespan"}, AsyncMock(), send)
+    _, __, lifespan_send = mock_app.call_args.args
+    await lifespan_send({"type": message_type})
+
+    assert emitter.close.called == closed
+    send.assert_awaited_once_with({"type": message_type})
+
+
+def test_access_log_middleware_default_emitter():
+    middleware = AccessLogMiddleware(AsyncMock())
+    assert isinstance(middleware.emitter, AccessLogEmitter)
+    middleware.emitter.close()
@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+
+from asgimiddlewares import compact_multiprocess_dir
+from asgimiddlewares.compaction import is_alive, multiprocess_dir_lock
+
+LIVE_PID = 1
+
+
+def write_worker(path: Path, pid: int, requests: int) -> None:
+    """Write the files a worker leaves behind after serving the requests."""
+    counter = MmapedDict(str(path / f"counter_{pid}.db"))
+    counter.write_value(
+        mmap_key("req_total", "req_total", ["method"], ["GET"], "Requests"),
+        requests,
+        0,
+    )
+    counter.close()
+    histogram = MmapedDict(str(path / f"histogram_{pid}.db"))
+    for name, labelnames, labelvalues, value in (
+        ("req_seconds_bucket", ["le"], ["0.1"], requests),
+        ("req_seconds_bucket", ["le"], ["+Inf"], requests),
+        ("req_seconds_count", [], [], requests),
+        ("req_seconds_sum", [], [], requests * 0.5),
+    ):
+        histogram.write_value(
+            mmap_key("req_seconds", name, labelnames, labelvalues, "Duration"),
+            value,
+            0,
+        )
+    histogram.close()
+
+
+def collect(path: Path) -> list[bytes]:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, str(path))
+    # The order of the metrics follows the order of the files
+    return sorted(generate_latest(registry).splitlines())
+
+
+def test_compact_multiprocess_dir_bounds_the_files(tmp_path: Path):
+    reference = tmp_path / "reference"
+    compacted = tmp_path / "compacted"
+    reference.mkdir()
+    compacted.mkdir()
+    write_worker(reference, LIVE_PID, 1)
+    write_worker(compacted, LIVE_PID, 1)
+
+    # Every recycled worker leaves its files behind
+    for pid in range(100, 120):
+        write_worker(reference, pid, pid)
+        write_worker(compacted, pid, pid)
+
+        deleted = compact_multiprocess_dir(
+            str(compacted), alive=lambda pid: pid == LIVE_PID
+        )
+
+        assert deleted == 2
+        assert sorted(os.listdir(compacted)) == [
+            ".compaction.lock",
+            f"counter_{LIVE_PID}.db",
+            "counter_archive.db",
+            f"histogram_{LIVE_PID}.db",
+            "histogram_archive.db",
+        ]
+        assert collect(compacted) == collect(reference)
+    assert b'req_total{method="GET"} 2191.0' in collect(compacted)
+
+
+def test_compact_multiprocess_dir_keeps_other_files(tmp_path: Path):
+    write_worker(tmp_path, LIVE_PID, 1)
+    (tmp_path / "gauge_all_100.db").touch()
+    (tmp_path / "counter_foo.db").touch()
+
+    assert compact_multiprocess_dir(str(tmp_path), alive=lambda pid: False) == 2
+
+    assert sorted(os.listdir(tmp_path)) == [
+        ".compaction.lock",
+        "counter_archive.db",
+        "counter_foo.db",
+        "gauge_all_100.db",
+        "histogram_archive.db",
+    ]
+
+
+def test_compact_multiprocess_dir_from_environment(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    write_worker(tmp_path, LIVE_PID, 1)
+
+    with patch("asgimiddlewares.compaction.is_alive", return_value=True):
+        assert compact_multiprocess_dir() == 0
+
+    assert "counter_archive.db" not in os.listdir(tmp_path)
+
+
+def test_compact_multiprocess_dir_disabled(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    monkeypatch.delenv("prometheus_multiproc_dir", raising=False)
+
+    with pytest.raises(ValueError, match="PROMETHEUS_MULTIPROC_DIR is not set!"):
+        compact_multiprocess_dir()
+
+
+def test_is_alive():
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+
+    assert is_alive(os.getpid())
+    assert not is_alive(process.pid)
+    with patch("asgimiddlewares.compaction.os.kill", side_effect=PermissionError):
+        assert is_alive(process.pid)
+
+
+def test_multiprocess_dir_lock(tmp_path: Path):
+    with multiprocess_dir_lock(str(tmp_path), exclusive=False):
+        with multiprocess_dir_lock(str(tmp_path), exclusive=False):
+            pass
+    with multiprocess_dir_lock(str(tmp_path)):
+        pass
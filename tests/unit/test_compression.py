@@ -0,0 +1,290 @@
+import json
+import random
+import zlib
+from typing import Any, Optional
+
+import pytest
+
+from connexion import AsyncApp
+from connexion.middleware import ConnexionMiddleware
+from connexion.middleware.exceptions import ExceptionMiddleware
+from starlette.types import Message, Receive, Scope, Send
+
+from asgimiddlewares import (
+    CompressionMiddleware,
+    CustomExceptionMiddleware,
+    CustomHeaderMiddleware,
+    CustomMiddlewarePosition,
+    replace_middleware,
+)
+from asgimiddlewares.compression import accepted_encoding, compressed_headers
+
+
+def items() -> list[dict[str, Any]]:
+    return [{"id": i, "name": f"item {i}"} for i in range(200)]
+
+
+BODY = json.dumps(items()).encode()
+
+
+def app_sending(*messages: Message) -> Any:
+    async def app(_scope: Scope, _receive: Receive, send: Send) -> None:
+        for message in messages:
+            await send(message)
+
+    return app
+
+
+def start(*headers: tuple[bytes, bytes]) -> Message:
+    return {"type": "http.response.start", "status": 200, "headers": list(headers)}
+
+
+def body(data: bytes, more_body: bool = False) -> Message:
+    return {"type": "http.response.body", "body": data, "more_body": more_body}
+
+
+def http_scope(accept_encoding: Optional[bytes] = b"gzip", path: str = "/v1/items"):
+    headers = [(b"host", b"localhost")]
+    if accept_encoding is not None:
+        headers.append((b"accept-encoding", accept_encoding))
+    return {"type": "http", "path": path, "headers": headers}
+
+
+async def call(middleware: CompressionMiddleware, scope: Scope) -> list[Message]:
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await middleware(scope, None, send)  # type: ignore
+    return sent
+
+
+def decompressed(messages: list[Message], wbits: int = 31) -> bytes:
+    assert all(message["more_body"] for message in messages[1:-1])
+    assert not messages[-1]["more_body"]
+    return zlib.decompress(b"".join(message["body"] for message in messages[1:]), wbits)
+
+
+@pytest.mark.parametrize(
+    ["accept_encoding", "expected"],
+    [
+        pytest.param(b"gzip", "gzip", id="gzip"),
+        pytest.param(b"deflate", "deflate", id="deflate"),
+        pytest.param(b"gzip, deflate, br", "gzip", id="gzip preferred"),
+        pytest.param(b"gzip;q=0.5, deflate", "deflate", id="higher quality"),
+        pytest.param(b"GZIP ; Q=0.8", "gzip", id="case insensitive"),
+        pytest.param(b"gzip;q=0", None, id="refused"),
+        pytest.param(b"gzip;q=x", None, id="invalid quality"),
+        pytest.param(b"*", "gzip", id="wildcard"),
+        pytest.param(b"*;q=0, deflate", "deflate", id="wildcard refused"),
+        pytest.param(b"br, identity", None, id="neither"),
+        pytest.param(b"", None, id="empty"),
+    ],
+)
+def test_accepted_encoding(accept_encoding: bytes, expected: Optional[str]) -> None:
+    assert accepted_encoding(accept_encoding) == expected
+
+
+def test_compressed_headers() -> None:
+    headers = compressed_headers(
+        [
+            (b"content-type", b"application/json"),
+            (b"content-length", b"1234"),
+            (b"etag", b'"abc"'),
+            (b"vary", b"Authorization"),
+        ],
+        "gzip",
+    )
+
+    assert headers == [
+        (b"content-encoding", b"gzip"),
+        (b"content-type", b"application/json"),
+        (b"etag", b'W/"abc"'),
+        (b"vary", b"Authorization, accept-encoding"),
+    ]
+    assert compressed_headers([(b"etag", b'W/"abc"')], "deflate") == [
+        (b"content-encoding", b"deflate"),
+        (b"etag", b'W/"abc"'),
+        (b"vary", b"accept-encoding"),
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ["accept_encoding", "wbits"],
+    [pytest.param(b"gzip", 31, id="gzip"), pytest.param(b"deflate", 15, id="deflate")],
+)
+async def test_compression_middleware_body(accept_encoding: bytes, wbits: int) -> None:
+    middleware = CompressionMiddleware(
+        app_sending(
+            start(
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(BODY)).encode()),
+            ),
+            body(BODY),
+        )
+    )
+
+    sent = await call(middleware, http_scope(accept_encoding))
+
+    assert sent[0]["headers"] == [
+        (b"content-encoding", accept_encoding),
+        (b"content-type", b"application/json"),
+        (b"vary", b"accept-encoding"),
+    ]
+    assert len(sent) == 2
+    assert len(sent[1]["body"]) < len(BODY)
+    assert decompressed(sent, wbits) == BODY
+
+
+@pytest.mark.asyncio
+async def test_compression_middleware_streamed() -> None:
+    chunks = [json.dumps(item).encode() + b"\n" for item in items()]
+    middleware = CompressionMiddleware(
+        app_sending(
+            start(),
+            *(body(chunk, more_body=True) for chunk in chunks),
+            body(b""),
+        ),
+        minimum_size=len(BODY),
+    )
+
+    sent = await call(middleware, http_scope())
+
+    # The chunks are compressed though the first one is short, the length of
+    # a streamed body is not known
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+    # zlib holds the small chunks, they are not sent one by one
+    assert len(sent) < len(chunks)
+    assert decompressed(sent) == b"".join(chunks)
+
+
+@pytest.mark.asyncio
+async def test_compression_middleware_chunk_size() -> None:
+    # Random bytes do not compress, the compressed body is as long as the data
+    data = random.Random(0).randbytes(256 * 1024)
+    middleware = CompressionMiddleware(
+        app_sending(start(), body(data)), level=1, chunk_size=16 * 1024
+    )
+
+    sent = await call(middleware, http_scope())
+
+    assert len(sent) > 8
+    assert all(len(message["body"]) < 2 * 16 * 1024 for message in sent[1:])
+    assert decompressed(sent) == data
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ["scope", "messages"],
+    [
+        pytest.param(http_scope(None), [start(), body(BODY)], id="no Accept-Encoding"),
+        pytest.param(
+            http_scope(b"br"), [start(), body(BODY)], id="unsupported encoding"
+        ),
+        pytest.param(
+            http_scope(path="/v1/ui/index.html"),
+            [start(), body(BODY)],
+            id="excluded path",
+        ),
+        pytest.param(
+            http_scope(),
+            [start((b"content-type", b"image/png")), body(BODY)],
+            id="compressed content type",
+        ),
+        pytest.param(
+            http_scope(),
+            [
+                start((b"content-type", b"Text/Event-Stream")),
+                body(BODY, True),
+                body(b""),
+            ],
+            id="event stream",
+        ),
+        pytest.param(
+            http_scope(),
+            [start((b"content-encoding", b"br")), body(BODY)],
+            id="encoded already",
+        ),
+        pytest.param(
+            http_scope(),
+            [start((b"content-length", b"10")), body(b"0123456789")],
+            id="short Content-Length",
+        ),
+        pytest.param(http_scope(), [start(), body(b"short")], id="short body"),
+        pytest.param(
+            http_scope(),
+            [start((b"content-length", str(len(BODY)).encode())), body(b"")],
+            id="HEAD request",
+        ),
+        pytest.param(
+            http_scope(),
+            [start(), {"type": "http.response.pathsend", "path": "/tmp/x"}],
+            id="path send",
+        ),
+    ],
+)
+async def test_compression_middleware_skipped(
+    scope: Scope, messages: list[Message]
+) -> None:
+    middleware = CompressionMiddleware(
+        app_sending(*messages), excluded_paths=("/ui", "/v1/ui"), minimum_size=100
+    )
+
+    assert await call(middleware, scope) == messages
+
+
+@pytest.mark.asyncio
+async def test_compression_middleware_not_http() -> None:
+    messages = [{"type": "websocket.accept"}]
+    middleware = CompressionMiddleware(app_sending(*messages))
+
+    assert await call(middleware, {"type": "websocket", "headers": []}) == messages
+
+
+@pytest.mark.parametrize(
+    ["kwargs", "message"],
+    [
+        pytest.param({"level": 0}, "The level must be between 1 and 9!", id="level"),
+        pytest.param(
+            {"chunk_size": 0}, "The chunk_size must be positive!", id="chunk_size"
+        ),
+    ],
+)
+def test_compression_middleware_invalid(kwargs: dict[str, Any], message: str) -> None:
+    with pytest.raises(ValueError, match=message):
+        CompressionMiddleware(app_sending(), **kwargs)
+
+
+def test_compression_middleware_connexion_stack() -> None:
+    middleware_stack = list(ConnexionMiddleware.default_middlewares)
+    replace_middleware(middleware_stack, ExceptionMiddleware, CustomExceptionMiddleware)
+    app = AsyncApp(__name__, middlewares=middleware_stack)
+    app.add_middleware(
+        CompressionMiddleware, position=CustomMiddlewarePosition.BEFORE_CUSTOM_EXCEPTION
+    )
+    app.add_middleware(
+        CustomHeaderMiddleware, position=CustomMiddlewarePosition.BEFORE_COMPRESSION
+    )
+    app.add_api(
+        {
+            "openapi": "3.0.0",
+            "info": {"title": "compressed", "version": "1"},
+            "paths": {
+                "/items": {
+                    "get": {
+                        "operationId": "tests.unit.test_compression.items",
+                        "responses": {"200": {"description": "ok"}},
+                    }
+                }
+            },
+        }
+    )
+
+    response = app.test_client().get("/items", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-security-policy" in response.headers
+    assert response.json() == items()
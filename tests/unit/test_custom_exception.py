@@ -1,7 +1,17 @@
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
 from connexion.lifecycle import ConnexionResponse, ConnexionRequest
-from unittest.mock import MagicMock, AsyncMock, patch
+from prometheus_client import CollectorRegistry, Counter
+from unittest.mock import MagicMock, AsyncMock, call, patch
 
-from asgimiddlewares.custom_exception import CustomExceptionMiddleware
+from asgimiddlewares import TraceContext, logging_ctx_var
+from asgimiddlewares.custom_exception import (
+    CustomExceptionMiddleware,
+    exception_fingerprint,
+)
 
 
 @patch("asgimiddlewares.custom_exception.LOG")
@@ -17,3 +27,148 @@ def test_custom_exception_middleware(mock_log: MagicMock) -> None:
     assert isinstance(response, ConnexionResponse)
     assert response.status_code == 500
     assert mock_log.error.called
+
+
+@patch("asgimiddlewares.custom_exception.LOG")
+def test_custom_exception_middleware_trace_id(_mock_log: MagicMock) -> None:
+    request = ConnexionRequest({"type": "http"})
+    token = logging_ctx_var.set({"trace_id": TraceContext(0xABC)})
+    try:
+        response = CustomExceptionMiddleware(AsyncMock()).common_error_handler(
+            request, Exception()
+        )
+    finally:
+        logging_ctx_var.reset(token)
+
+    assert json.loads(response.body)["trace_id"] == "0" * 29 + "abc"
+
+
+@patch("asgimiddlewares.custom_exception.LOG")
+def test_custom_exception_middleware_trace_id_of_skipped_request(
+    _mock_log: MagicMock,
+) -> None:
+    request = ConnexionRequest({"type": "http", "state": {"trace_id": "0xabc"}})
+    token = logging_ctx_var.set({})
+    try:
+        response = CustomExceptionMiddleware(AsyncMock()).common_error_handler(
+            request, Exception()
+        )
+    finally:
+        logging_ctx_var.reset(token)
+
+    assert json.loads(response.body)["trace_id"] == "0xabc"
+
+
+def raise_error(message: str) -> None:
+    raise ValueError(message)
+
+
+def caught(message: str = "boom") -> Exception:
+    try:
+        raise_error(message)
+    except ValueError as exc:
+        return exc
+    raise AssertionError("Not raised")
+
+
+def test_exception_fingerprint() -> None:
+    first, second = caught("foo"), caught("bar")
+    try:
+        raise ValueError("foo")
+    except ValueError as exc:
+        elsewhere = exc
+
+    assert exception_fingerprint(first) == exception_fingerprint(second)
+    assert exception_fingerprint(first) != exception_fingerprint(elsewhere)
+    assert exception_fingerprint(first) != exception_fingerprint(TypeError("foo"))
+    assert len(exception_fingerprint(ValueError())) == 16
+
+
+@patch("asgimiddlewares.custom_exception.LOG")
+def test_custom_exception_middleware_suppresses_tracebacks(mock_log: MagicMock):
+    registry = CollectorRegistry()
+    with patch(
+        "asgimiddlewares.custom_exception.Counter",
+        functools.partial(Counter, registry=registry),
+    ):
+        middleware = CustomExceptionMiddleware(
+            AsyncMock(), interval=10, metrics=True, service_name="foo"
+        )
+    request = ConnexionRequest({"type": "http"})
+    errors = [caught() for _ in range(4)]
+    fingerprint = exception_fingerprint(errors[0])
+
+    for now, exc in zip((0, 5, 9, 10), errors):
+        with patch("asgimiddlewares.custom_exception.time.monotonic", return_value=now):
+            middleware.common_error_handler(request, exc)
+
+    fields = {
+        "message": "Unhandled exception occurred",
+        "unhandled_exception": True,
+        "fingerprint": fingerprint,
+    }
+    compact = {**fields, "exception": "ValueError('boom')"}
+    assert mock_log.error.call_args_list == [
+        call({**fields, "suppressed": 0}, exc_info=errors[0]),
+        call({**compact, "suppressed": 1}),
+        call({**compact, "suppressed": 2}),
+        call({**fields, "suppressed": 2}, exc_info=errors[3]),
+    ]
+    assert (
+        registry.get_sample_value(
+            "foo_unhandled_exceptions_total",
+            {"exception": "ValueError", "fingerprint": fingerprint},
+        )
+        == 4
+    )
+
+
+@pytest.mark.parametrize("interval", [0, 60])
+@patch("asgimiddlewares.custom_exception.LOG")
+def test_custom_exception_middleware_distinct_errors(
+    mock_log: MagicMock, interval: float
+):
+    middleware = CustomExceptionMiddleware(AsyncMock(), interval=interval)
+    request = ConnexionRequest({"type": "http"})
+
+    middleware.common_error_handler(request, caught())
+    middleware.common_error_handler(request, TypeError())
+    middleware.common_error_handler(request, caught())
+
+    tracebacks = [c for c in mock_log.error.call_args_list if "exc_info" in c.kwargs]
+    assert len(tracebacks) == (3 if interval == 0 else 2)
+    assert middleware.counter is None
+
+
+@patch("asgimiddlewares.custom_exception.LOG")
+def test_custom_exception_middleware_concurrent_errors(mock_log: MagicMock):
+    middleware = CustomExceptionMiddleware(AsyncMock(), interval=60)
+    exc = caught()
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: middleware.log_exception(exc), range(200)))
+
+    tracebacks = [c for c in mock_log.error.call_args_list if "exc_info" in c.kwargs]
+    assert len(tracebacks) == 1
+    # Every suppressed occurrence is counted once
+    assert sorted(c.args[0]["suppressed"] for c in mock_log.error.call_args_list) == [
+        0,
+        *range(1, 200),
+    ]
+
+
+@patch("asgimiddlewares.custom_exception.LOG")
+def test_custom_exception_middleware_max_fingerprints(mock_log: MagicMock):
+    middleware = CustomExceptionMiddleware(AsyncMock(), max_fingerprints=2)
+    request = ConnexionRequest({"type": "http"})
+    first, second, third = caught(), TypeError(), KeyError()
+
+    for exc in (first, second, first, third, first, second):
+        middleware.common_error_handler(request, exc)
+
+    # The second one is forgotten by the third one and logs its traceback again
+    tracebacks = [
+        c.kwargs["exc_info"] for c in mock_log.error.call_args_list if c.kwargs
+    ]
+    assert tracebacks == [first, second, third, second]
+    assert len(middleware._tracebacks) == 2
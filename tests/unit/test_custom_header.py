@@ -4,7 +4,8 @@ import pytest
 
 from unittest.mock import AsyncMock
 
-from asgimiddlewares import CustomHeaderMiddleware
+from asgimiddlewares import CustomHeaderMiddleware, HeaderRule, TraceContext
+from asgimiddlewares.custom_header import trace_id_header
 
 
 @pytest.mark.asyncio
@@ -111,3 +112,58 @@ async def test_custom_header_middleware_websocket() -> None:
 
     await middleware(scope, AsyncMock(), AsyncMock())
     mock_app.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_custom_header_middleware_static_headers() -> None:
+    mock_app = AsyncMock()
+    middleware = CustomHeaderMiddleware(
+        mock_app,
+        csp_disable=(),
+        headers=[
+            HeaderRule("X-Frame-Options", "DENY"),
+            HeaderRule(
+                "Cache-Control", "no-store", include=("/v1/",), exclude=("/v1/ui",)
+            ),
+        ],
+    )
+    scope = {"type": "http", "path": "/v1/foo", "state": {}}
+    app_headers = [(b"trace_id", b"123456")]
+
+    await middleware(scope, AsyncMock(), mock_send := AsyncMock())
+    _, __, send_with_extra_headers_call = mock_app.call_args.args
+    await send_with_extra_headers_call(
+        {"type": "http.response.start", "status": 200, "headers": app_headers}
+    )
+
+    mock_send.assert_awaited_once_with(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"trace_id", b"123456"),
+                (
+                    b"content-security-policy",
+                    b"default-src 'none'; frame-ancestors 'none'",
+                ),
+                (b"x-frame-options", b"DENY"),
+                (b"cache-control", b"no-store"),
+            ],
+        }
+    )
+    # The headers of the app are left alone
+    assert app_headers == [(b"trace_id", b"123456")]
+
+
+@pytest.mark.parametrize(
+    ["state", "expected"],
+    [
+        pytest.param(
+            {"trace_id": TraceContext(0xABC)}, b"0" * 29 + b"abc", id="TraceContext"
+        ),
+        pytest.param({"trace_id": None}, b"-", id="Invalid trace"),
+        pytest.param({}, b"-", id="No trace"),
+    ],
+)
+def test_trace_id_header(state: dict[str, Any], expected: bytes) -> None:
+    assert trace_id_header({"state": state}) == (b"trace_id", expected)
@@ -1,15 +1,23 @@
 import pytest
 
-from typing import Any, Dict
+from typing import Any, Dict, Iterator
 from unittest.mock import MagicMock, AsyncMock, patch
 
-from asgimiddlewares.utils import logging_ctx_var
+from asgimiddlewares.sampling import AccessLogSampler
+from asgimiddlewares.utils import logging_context, logging_ctx_var
 from asgimiddlewares.extended_logging import (
     parse_headers,
     ExtendedLoggingMiddleware,
 )
 
 
+@pytest.fixture
+def log_fields() -> Iterator[Dict[str, Any]]:
+    """Fields of the requests, read after the request like an outer layer does."""
+    with logging_context({}) as data:
+        yield data
+
+
 def test_parse_headers_empty() -> None:
     headers = []
     result = parse_headers(headers)
@@ -30,6 +38,52 @@ def test_parse_headers_multiple_headers() -> None:
     }
 
 
+def test_parse_headers_selected_names() -> None:
+    headers = [
+        (b"user-agent", b"curl/7.76.1"),
+        (b"cookie", b"\xff not utf-8"),
+        (b"referer", b"john_doe"),
+    ]
+    result = parse_headers(headers, frozenset((b"user-agent", b"referer")))
+    assert result == {"user-agent": "curl/7.76.1", "referer": "john_doe"}
+
+
+@pytest.mark.parametrize(
+    ("fields", "header_names"),
+    [
+        (("method", "path"), frozenset()),
+        (("path", "user_agent"), frozenset((b"user-agent",))),
+        (
+            ("X-Akamai-RH-Edge-Id", "referer"),
+            frozenset((b"x-rh-edge-request-id", b"referer")),
+        ),
+    ],
+)
+def test_extended_logging_middleware_header_names(
+    fields: tuple[str, ...], header_names: frozenset[bytes]
+) -> None:
+    middleware = ExtendedLoggingMiddleware(MagicMock(), fields)
+    assert middleware.header_names == header_names
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_skips_other_headers(
+    log_fields: Dict[str, Any],
+) -> None:
+    mock_app = AsyncMock()
+    middleware = ExtendedLoggingMiddleware(mock_app, ("user_agent", "referer"))
+    scope = {
+        "headers": [
+            (b"cookie", b"\xff not utf-8"),
+            (b"user-agent", b"curl/7.76.1"),
+        ],
+    }
+
+    await middleware(scope, AsyncMock(), AsyncMock())
+
+    assert log_fields == {"user_agent": "curl/7.76.1", "referer": None}
+
+
 @pytest.mark.parametrize(
     ("scope", "message"),
     [
@@ -125,18 +179,16 @@ def test_parse_headers_multiple_headers() -> None:
         ),
     ],
 )
-@patch("asgimiddlewares.extended_logging.Headers")
 @pytest.mark.asyncio
 async def test_extended_logging_middleware(
-    mock_headers: MagicMock,
     scope: Dict[str, Any],
     message: Dict[str, Any],
     expected: Dict[str, Any],
     tracked_fields: list[str],
     headers: Dict[str, Any],
+    log_fields: Dict[str, Any],
 ) -> None:
     mock_app = AsyncMock()
-    mock_headers.return_value = headers
     if tracked_fields is not None:
         middleware = ExtendedLoggingMiddleware(mock_app, tracked_fields)
     else:
@@ -147,11 +199,188 @@ async def test_extended_logging_middleware(
     mock_app.assert_called_once()
 
     _, __, send = mock_app.call_args.args
-    await send(message)
+    await send(
+        {
+            **message,
+            "headers": [(name.encode(), value) for name, value in headers.items()],
+        }
+    )
+
+    assert log_fields == expected
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_request_fields_only(
+    log_fields: Dict[str, Any],
+) -> None:
+    mock_app = AsyncMock()
+    middleware = ExtendedLoggingMiddleware(mock_app, ("method", "path"))
+    scope = {"method": "GET", "path": "/v1/ping"}
+    send = AsyncMock()
+
+    await middleware(scope, AsyncMock(), send)
 
-    assert logging_ctx_var.get() == expected
+    # No field is filled in from the response, so send is not wrapped
+    assert mock_app.call_args.args[2] is send
+    assert log_fields == {"method": "GET", "path": "/v1/ping"}
 
 
 def test_extended_logging_middleware_invalid_field():
     with pytest.raises(ValueError, match="Unknown field to log: 'foo'!"):
         ExtendedLoggingMiddleware(MagicMock(), ("foo", "boar"))
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_counts_streamed_bodies(
+    log_fields: Dict[str, Any],
+) -> None:
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        while (await receive()).get("more_body", False):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in (b"abc", b"", b"defg"):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+
+    receive = AsyncMock(
+        side_effect=[
+            {"type": "http.request", "body": b"12345", "more_body": True},
+            {"type": "http.request", "body": b"67", "more_body": False},
+        ]
+    )
+    middleware = ExtendedLoggingMiddleware(app, ("request_length", "response_length"))
+
+    await middleware({"type": "http"}, receive, AsyncMock())
+
+    assert log_fields == {"request_length": 7, "response_length": 7}
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_keeps_content_length_of_empty_body(
+    log_fields: Dict[str, Any],
+) -> None:
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        # HEAD response
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-length", b"42")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = ExtendedLoggingMiddleware(app, ("response_length",))
+
+    await middleware({"type": "http"}, AsyncMock(), AsyncMock())
+
+    assert log_fields == {"response_length": 42}
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_resets_the_context() -> None:
+    seen = []
+
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        seen.append(logging_ctx_var.get())
+
+    middleware = ExtendedLoggingMiddleware(app, ("method",))
+    before = logging_ctx_var.get()
+
+    await middleware({"method": "GET"}, AsyncMock(), AsyncMock())
+
+    assert seen == [{"method": "GET"}]
+    assert logging_ctx_var.get() is before
+
+
+def sampled_app(status: int) -> Any:
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        scope["state"]["path_id"] = "/v1/ping"
+        while (await receive()).get("more_body", False):
+            pass
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        for chunk in (b"abc", b"", b"defg"):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+
+    return app
+
+
+def request_body() -> AsyncMock:
+    return AsyncMock(
+        side_effect=[
+            {"type": "http.request", "body": b"12345", "more_body": True},
+            {"type": "http.request", "body": b"67", "more_body": False},
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_sampler() -> None:
+    sampler = AccessLogSampler(rate=1)
+    middleware = ExtendedLoggingMiddleware(
+        sampled_app(200),
+        ("method", "path_id", "status", "request_length", "response_length"),
+        sampler=sampler,
+    )
+    records = []
+
+    with patch.object(
+        middleware, "request_data", wraps=middleware.request_data
+    ) as request_data:
+        for status in (200, 200, 200):
+            with logging_context({}) as data:
+                await middleware(
+                    {"type": "http", "method": "GET", "state": {}},
+                    request_body(),
+                    AsyncMock(),
+                )
+            records.append(data)
+
+    assert records == [
+        {
+            "method": "GET",
+            "path_id": "/v1/ping",
+            "status": 200,
+            "request_length": 7,
+            "response_length": 7,
+            "sample_weight": 1,
+        },
+        {},
+        {},
+    ]
+    # The fields of the skipped requests are not extracted
+    request_data.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_sampler_keeps_errors(
+    log_fields: Dict[str, Any],
+) -> None:
+    sampler = AccessLogSampler(rate=1, burst=1)
+    sampler.sample("/v1/ping", 500, 0)
+    middleware = ExtendedLoggingMiddleware(
+        sampled_app(500), ("status", "response_length"), sampler=sampler
+    )
+
+    await middleware({"type": "http", "state": {}}, request_body(), AsyncMock())
+
+    assert log_fields == {"status": 500, "response_length": 7, "sample_weight": 1}
+
+
+@pytest.mark.asyncio
+async def test_extended_logging_middleware_sampler_body_after_response(
+    log_fields: Dict[str, Any],
+) -> None:
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        while (await receive()).get("more_body", False):
+            pass
+
+    middleware = ExtendedLoggingMiddleware(
+        app, ("request_length",), sampler=AccessLogSampler()
+    )
+
+    await middleware({"type": "http"}, request_body(), AsyncMock())
+
+    assert log_fields == {"request_length": 7, "sample_weight": 1}
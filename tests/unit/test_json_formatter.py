@@ -0,0 +1,114 @@
+import json
+import logging
+import sys
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+
+from asgimiddlewares import JsonAccessLogFormatter, TraceContext
+from asgimiddlewares.json_formatter import (
+    default_serializer,
+    json_serializer,
+    orjson_serializer,
+)
+
+FIELDS = {
+    "method": "GET",
+    "path": "/v1/café/\"quoted\"\n",
+    "path_id": None,
+    "request_length": 0,
+    "response_length": 42,
+    "status": 200,
+    "trace_id": TraceContext(0xABC),
+    "phases": {"first_byte": 0.5, "complete": None},
+    "not configured": "left out",
+}
+
+
+def make_record(msg: Any, **kwargs: Any) -> logging.LogRecord:
+    record = logging.LogRecord("foo", logging.INFO, __file__, 1, msg, None, None)
+    record.__dict__.update(kwargs)
+    return record
+
+
+@pytest.mark.parametrize(
+    "serializer",
+    [None, default_serializer(), json.dumps],
+    ids=["orjson records", "default", "json"],
+)
+def test_json_access_log_formatter(serializer: Any):
+    formatter = JsonAccessLogFormatter(
+        ("method", "path", "path_id", "status", "trace_id", "phases", "missing"),
+        serializer=serializer,
+    )
+
+    line = formatter.format(make_record(FIELDS))
+
+    assert "\n" not in line
+    assert json.loads(line) == {
+        "method": "GET",
+        "path": "/v1/café/\"quoted\"\n",
+        "path_id": None,
+        "status": 200,
+        "trace_id": "0" * 29 + "abc",
+        "phases": {"first_byte": 0.5, "complete": None},
+    }
+
+
+def test_json_access_log_formatter_matches_json_dumps():
+    fields = {key: value for key, value in FIELDS.items() if key != "not configured"}
+    formatter = JsonAccessLogFormatter(fields, serializer=json_serializer)
+    record_formatter = JsonAccessLogFormatter(fields)
+
+    line = formatter.format(make_record(fields))
+
+    assert line == json.dumps(
+        fields, default=str, separators=(",", ":"), ensure_ascii=False
+    )
+    # Serialized by orjson at once, to the same line
+    assert record_formatter.format(make_record(fields)) == line
+
+
+def test_json_access_log_formatter_record_serializer_order():
+    fields = ("status", "trace_id", "method", "phases", "path", "missing")
+    formatter = JsonAccessLogFormatter(fields, serializer=json_serializer)
+    record_formatter = JsonAccessLogFormatter(fields)
+
+    line = formatter.format(make_record(FIELDS))
+
+    assert list(json.loads(line)) == ["status", "trace_id", "method", "phases", "path"]
+    # Serialized by orjson at once, to the same line
+    assert record_formatter.format(make_record(FIELDS)) == line
+    assert "café" in line
+
+
+def test_json_access_log_formatter_other_records():
+    formatter = JsonAccessLogFormatter(("method", "status"))
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        exc_info = sys.exc_info()
+
+    with_fields = formatter.format(
+        make_record("%s failed", args=("foo",), request={"status": True})
+    )
+    without_fields = formatter.format(make_record("message", exc_info=exc_info))
+
+    assert json.loads(with_fields) == {"message": "foo failed", "status": True}
+    assert json.loads(without_fields)["message"] == "message"
+    assert "RuntimeError: boom" in json.loads(without_fields)["exc_info"]
+
+
+def test_default_serializer():
+    value = {"a": [1, 0.5], "b": TraceContext(1)}
+
+    assert json.loads(default_serializer()(value)) == {
+        "a": [1, 0.5],
+        "b": "0" * 31 + "1",
+    }
+    with patch("importlib.import_module", side_effect=ImportError):
+        assert orjson_serializer() is None
+        assert default_serializer() is json_serializer
+        assert JsonAccessLogFormatter().serializer is json_serializer
+    assert json_serializer(value) == '{"a":[1,0.5],"b":"' + "0" * 31 + '1"}'
@@ -0,0 +1,267 @@
+from typing import Any, Iterator, Optional
+from unittest.mock import AsyncMock, MagicMock, call, patch
+
+import pytest
+
+from asgimiddlewares import (
+    CustomHeaderMiddleware,
+    ExtendedLoggingMiddleware,
+    HeaderRule,
+    ObservabilityMiddleware,
+    PrometheusMiddleware,
+    RequestTimeMiddleware,
+)
+from asgimiddlewares.extended_logging import POSSIBLE_FIELDS
+from asgimiddlewares.utils import logging_context, request_time_ctx_var
+
+
+@pytest.fixture
+def prometheus() -> Iterator[tuple[MagicMock, MagicMock]]:
+    with (
+        patch("asgimiddlewares.prometheus._setup_prometheus"),
+        patch("asgimiddlewares.prometheus.disable_created_metrics"),
+        patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister"),
+        patch("asgimiddlewares.prometheus.Counter") as counter,
+        patch("asgimiddlewares.prometheus.Histogram") as histogram,
+    ):
+        yield counter.return_value, histogram.return_value
+
+
+def response_app(headers: list[tuple[bytes, bytes]]) -> AsyncMock:
+    async def app(scope: dict[str, Any], receive: Any, send: Any) -> None:
+        await send(
+            {"type": "http.response.start", "status": 201, "headers": list(headers)}
+        )
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    return AsyncMock(side_effect=app)
+
+
+def http_scope(path: str) -> dict[str, Any]:
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "http_version": "1.1",
+        "query_string": b"a=1",
+        "client": ("a.b.c.d", 12345),
+        "headers": [(b"user-agent", b"curl/7.76.1"), (b"referer", b"john_doe")],
+        "state": {"trace_id": "0x123", "path_id": "/v1/foo/{bar}"},
+    }
+
+
+async def observe(
+    middleware: Any, path: str
+) -> tuple[list[dict[str, Any]], dict[str, Any], Optional[float]]:
+    request_time_ctx_var.set(None)
+    send = AsyncMock()
+    # Like an outer layer reading the fields after the request
+    with logging_context({}) as data:
+        await middleware(http_scope(path), AsyncMock(), send)
+    messages = [call.args[0] for call in send.call_args_list]
+    return messages, data, request_time_ctx_var.get()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/v1/foo/spam", "/v1/ui/index.html", "/v1/ping"])
+@pytest.mark.parametrize(
+    "headers",
+    [
+        [],
+        [(b"content-length", b"2"), (b"trace_id", b"0xabc")],
+        [(b"content-length", b"0"), (b"content-length", b"2")],
+    ],
+)
+async def test_observability_middleware_matches_stack(
+    prometheus: tuple[MagicMock, MagicMock],
+    path: str,
+    headers: list[tuple[bytes, bytes]],
+):
+    counter, histogram = prometheus
+    kwargs = {"service_name": "foo", "excluded_paths": ("/v1/ping",)}
+    csp_disable = ("/v1/ui",)
+    static_headers = (HeaderRule("X-Frame-Options", "DENY", include=("/v1/foo",)),)
+
+    stack = CustomHeaderMiddleware(
+        ExtendedLoggingMiddleware(
+            PrometheusMiddleware(RequestTimeMiddleware(response_app(headers)), **kwargs)
+        ),
+        csp_disable=csp_disable,
+        headers=static_headers,
+    )
+    expected = await observe(stack, path)
+    expected_metrics = (counter.labels.call_args_list, histogram.labels.call_args_list)
+    counter.reset_mock()
+    histogram.reset_mock()
+
+    fused = ObservabilityMiddleware(
+        response_app(headers),
+        csp_disable=csp_disable,
+        prometheus=True,
+        headers=static_headers,
+        **kwargs,
+    )
+    result = await observe(fused, path)
+
+    assert result[:2] == expected[:2]
+    assert isinstance(result[2], float)
+    assert (
+        counter.labels.call_args_list,
+        histogram.labels.call_args_list,
+    ) == expected_metrics
+    assert counter.labels.return_value.inc.call_count == (path != "/v1/ping")
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_disabled_jobs():
+    fused = ObservabilityMiddleware(
+        response_app([(b"content-length", b"2")]),
+        request_time=False,
+        fields=None,
+        csp_disable=None,
+    )
+
+    messages, data, request_time = await observe(fused, "/v1/foo/spam")
+
+    assert messages[0]["headers"] == [(b"content-length", b"2")]
+    assert data == {}
+    assert request_time is None
+    assert fused.logging is None
+    assert fused.headers is None
+    assert fused.prometheus is None
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_selected_fields():
+    fused = ObservabilityMiddleware(response_app([]), fields=("path", "status"))
+
+    _, data, _ = await observe(fused, "/v1/foo/spam")
+
+    assert data == {"path": "/v1/foo/spam", "status": 201}
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_websocket():
+    mock_app = AsyncMock()
+    fused = ObservabilityMiddleware(mock_app)
+    scope = {"type": "websocket", "path": "/ws"}
+    send = AsyncMock()
+
+    await fused(scope, AsyncMock(), send)
+
+    mock_app.assert_awaited_once_with(scope, mock_app.call_args.args[1], send)
+
+
+def test_observability_middleware_invalid_field():
+    with pytest.raises(ValueError, match="Unknown field to log: 'foo'!"):
+        ObservabilityMiddleware(AsyncMock(), fields=("foo",))
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_lifespan(
+    prometheus: tuple[MagicMock, MagicMock],
+):
+    mock_app = AsyncMock()
+    fused = ObservabilityMiddleware(mock_app, prometheus=True, flush_interval=3600)
+    scope = {"type": "lifespan"}
+
+    with patch.object(fused.prometheus, "lifespan") as lifespan:
+        await fused(scope, AsyncMock(), AsyncMock())
+
+    lifespan.assert_awaited_once()
+    mock_app.assert_not_called()
+    assert fused.prometheus is not None and fused.prometheus.buffer is not None
+    fused.prometheus.buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_metrics_path(
+    prometheus: tuple[MagicMock, MagicMock],
+):
+    mock_app = AsyncMock()
+    fused = ObservabilityMiddleware(mock_app, prometheus=True, metrics_path="/metrics")
+    assert fused.prometheus is not None and fused.prometheus.metrics is not None
+
+    with patch.object(fused.prometheus, "metrics", AsyncMock()) as metrics:
+        await observe(fused, "/metrics")
+        await observe(fused, "/v1/foo/spam")
+
+    metrics.assert_awaited_once()
+    mock_app.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_streamed_bodies_match_stack(
+    prometheus: tuple[MagicMock, MagicMock],
+):
+    _, histogram = prometheus
+
+    async def app(scope: dict[str, Any], receive: Any, send: Any) -> None:
+        while (await receive()).get("more_body", False):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in (b"abc", b"", b"defg"):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    def receive() -> AsyncMock:
+        return AsyncMock(
+            side_effect=[
+                {"type": "http.request", "body": b"12345", "more_body": True},
+                {"type": "http.request", "body": b"67"},
+            ]
+        )
+
+    stack = ExtendedLoggingMiddleware(
+        PrometheusMiddleware(app, size_metrics=True), POSSIBLE_FIELDS
+    )
+    with logging_context({}) as data:
+        await stack(http_scope("/v1/foo/spam"), receive(), AsyncMock())
+    # The first call observes the duration
+    expected = (data, histogram.labels.return_value.mock_calls[1:])
+    histogram.reset_mock()
+
+    fused = ObservabilityMiddleware(
+        app, fields=POSSIBLE_FIELDS, prometheus=True, size_metrics=True
+    )
+    with logging_context({}) as data:
+        await fused(http_scope("/v1/foo/spam"), receive(), AsyncMock())
+
+    assert (data, histogram.labels.return_value.mock_calls[1:]) == expected
+    assert expected[0]["request_length"] == 7
+    assert expected[0]["response_length"] == 7
+    assert expected[1] == [call.observe(7), call.observe(7)]
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_phase_metrics(
+    prometheus: tuple[MagicMock, MagicMock],
+):
+    fused = ObservabilityMiddleware(
+        RequestTimeMiddleware(response_app([]), phases=True),
+        request_time=False,
+        prometheus=True,
+        phase_metrics=True,
+    )
+    assert fused.prometheus is not None
+
+    with patch.object(fused.prometheus, "observe_phases") as observe_phases:
+        _, data, _ = await observe(fused, "/v1/foo/spam")
+
+    observe_phases.assert_called_once()
+    assert set(data["phases"]) == {"body_read", "first_byte", "complete", "send_wait"}
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_cache_metrics(
+    prometheus: tuple[MagicMock, MagicMock],
+):
+    fused = ObservabilityMiddleware(
+        response_app([]), prometheus=True, cache_metrics=True
+    )
+    assert fused.prometheus is not None
+
+    with patch.object(fused.prometheus, "observe_cache") as observe_cache:
+        await observe(fused, "/v1/foo/spam")
+
+    observe_cache.assert_called_once()
@@ -5,6 +5,7 @@ from unittest.mock import AsyncMock, MagicMock
 from starlette.routing import Route, Mount, WebSocket, Router
 
 from asgimiddlewares import PathIdMiddleware
+from asgimiddlewares.routing import RouteMatch
 
 
 @pytest.mark.asyncio
@@ -56,3 +57,37 @@ async def test_middleware_exception():
     middleware = PathIdMiddleware(AsyncMock())
     with pytest.raises(KeyError):
         await middleware(mock_scope, AsyncMock(), AsyncMock())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ["state", "expected"],
+    [
+        pytest.param(
+            {"route_match": RouteMatch("/v1", Route("/foo/{foo}", AsyncMock()))},
+            "/v1/foo/{foo}",
+            id="matched by routing",
+        ),
+        pytest.param({"route_match": None}, "", id="not matched by routing"),
+        pytest.param(
+            {"route_match": None, "path_id": "/v1/filled"},
+            "/v1/filled",
+            id="already filled",
+        ),
+    ],
+)
+async def test_path_id_middleware_route_match(state: dict, expected: str):
+    mock_router = MagicMock(spec=Router)
+    mock_scope = {
+        "router": mock_router,
+        "path": "/v1/foo/bar",
+        "type": "http",
+        "state": state,
+        "method": "GET",
+    }
+
+    await PathIdMiddleware(AsyncMock())(mock_scope, AsyncMock(), AsyncMock())
+
+    assert mock_scope["state"]["path_id"] == expected
+    # The routes were not matched again
+    assert not mock_router.mock_calls
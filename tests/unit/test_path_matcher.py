@@ -0,0 +1,46 @@
+import pytest
+
+from asgimiddlewares.path_matcher import PathMatcher
+
+
+@pytest.mark.parametrize(
+    ["path", "expected"],
+    [
+        ("", True),
+        ("/v1/ping", True),
+        ("/v1/ping/", False),
+        ("/v1/sample/id/123", True),
+        ("/v1/sample/id/", False),
+        ("/v1/sample/id/123/other", False),
+        ("/v1/sample/id/123/other/456", True),
+        ("/v1/sample/id/123/other/abc", False),
+        ("/v1/files/a/b/c.txt", True),
+        ("/v1/files", False),
+        ("/v1.ping", False),
+    ],
+)
+def test_path_matcher(path: str, expected: bool):
+    matcher = PathMatcher(
+        (
+            "",
+            "/v1/ping",
+            "/v1/sample/id/{identifier}",
+            "/v1/sample/id/{a}/other/{b:int}",
+            "/v1/files/{name:path}",
+        )
+    )
+
+    assert matcher.matches(path) is expected
+
+
+def test_path_matcher_literals_only():
+    matcher = PathMatcher(["/v1/ping"])
+
+    assert matcher.templates == set()
+    assert matcher.matches("/v1/ping")
+    assert not matcher.matches("/v1/pong")
+
+
+def test_path_matcher_unknown_convertor():
+    with pytest.raises(ValueError, match="Unknown path convertor: 'foo'!"):
+        PathMatcher(["/v1/{name:foo}"])
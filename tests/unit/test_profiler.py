@@ -0,0 +1,215 @@
+import functools
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from connexion import AsyncApp
+from connexion.middleware import ConnexionMiddleware, MiddlewarePosition
+from connexion.middleware.exceptions import ExceptionMiddleware
+from connexion.middleware.lifespan import LifespanMiddleware
+from connexion.middleware.routing import RoutingMiddleware
+from connexion.utils import inspect_function_arguments
+from prometheus_client import CollectorRegistry, Histogram
+
+from asgimiddlewares import (
+    CustomExceptionMiddleware,
+    CustomHeaderMiddleware,
+    CustomMiddlewarePosition,
+    CustomRoutingMiddleware,
+    PathIdMiddleware,
+    replace_middleware,
+)
+from asgimiddlewares.profiler import (
+    LayerStats,
+    ProfiledMiddleware,
+    StackProfiler,
+    profile_middlewares,
+)
+
+
+class Layer:
+    def __init__(self, app: Any, name: str = "") -> None:
+        self.app = app
+        self.name = name
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        scope["state"]["path_id"] = "/v1/foo/{bar}"
+        await self.app(scope, receive, send)
+
+
+class OuterLayer(Layer):
+    pass
+
+
+def ping() -> str:
+    return "pong"
+
+
+def build(middlewares: list[Any], app: Any) -> Any:
+    """Build the stack like Connexion does."""
+    for middleware in reversed(middlewares):
+        app = middleware(app)
+    return app
+
+
+def http_scope() -> dict[str, Any]:
+    return {"type": "http", "method": "GET", "path": "/v1/foo/1", "state": {}}
+
+
+@pytest.mark.asyncio
+async def test_stack_profiler_inclusive_and_exclusive_times():
+    middlewares: list[Any] = [OuterLayer, Layer]
+    profiler = profile_middlewares(middlewares)
+    stack = build(middlewares, AsyncMock())
+
+    # Layer starts at 0, the app runs from 1 to 3 and Layer returns at 6
+    with patch("asgimiddlewares.profiler.time.perf_counter", side_effect=[0, 1, 3, 6]):
+        await stack(http_scope(), AsyncMock(), AsyncMock())
+
+    assert isinstance(stack, OuterLayer)
+    assert profiler.report() == [
+        LayerStats("Layer", "/v1/foo/{bar}", 1, 6, 4),
+        LayerStats("AsyncMock", "/v1/foo/{bar}", 1, 2, 2),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stack_profiler_records_failed_requests():
+    app = AsyncMock(side_effect=RuntimeError)
+    profiler = StackProfiler()
+    stack = build([ProfiledMiddleware(Layer, profiler)], app)
+
+    with pytest.raises(RuntimeError):
+        await stack(http_scope(), AsyncMock(), AsyncMock())
+
+    assert [row.requests for row in profiler.report()] == [1]
+
+
+@pytest.mark.asyncio
+async def test_stack_profiler_sampling():
+    profiler = StackProfiler(sample_every=3)
+    middlewares: list[Any] = [OuterLayer, Layer]
+    profile_middlewares(middlewares, profiler)
+    stack = build(middlewares, AsyncMock())
+
+    for _ in range(7):
+        await stack(http_scope(), AsyncMock(), AsyncMock())
+
+    assert [row.requests for row in profiler.report()] == [3, 3]
+    profiler.reset()
+    assert profiler.report() == []
+
+
+@pytest.mark.asyncio
+async def test_stack_profiler_other_scopes():
+    app = AsyncMock()
+    profiler = StackProfiler()
+    stack = build([ProfiledMiddleware(OuterLayer, profiler)], app)
+    scope = {"type": "lifespan"}
+
+    await stack.app(scope, AsyncMock(), AsyncMock())
+
+    app.assert_awaited_once()
+    assert profiler.report() == []
+
+
+@pytest.mark.asyncio
+async def test_stack_profiler_metrics():
+    registry = CollectorRegistry()
+    with patch(
+        "asgimiddlewares.profiler.Histogram",
+        functools.partial(Histogram, registry=registry),
+    ):
+        profiler = StackProfiler(metrics=True, service_name="foo")
+    stack = build([ProfiledMiddleware(Layer, profiler)], AsyncMock())
+
+    await stack(http_scope(), AsyncMock(), AsyncMock())
+
+    labels = {"layer": "AsyncMock", "url_rule": "/v1/foo/{bar}"}
+    for kind in ("inclusive", "exclusive"):
+        assert (
+            registry.get_sample_value(
+                "foo_middleware_duration_seconds_count", {**labels, "kind": kind}
+            )
+            == 1
+        )
+
+
+def test_stack_profiler_format_report():
+    profiler = StackProfiler()
+    profiler.record("Layer", http_scope(), 0.004, 0.001)
+    profiler.record("Layer", http_scope(), 0.002, 0.001)
+
+    lines = profiler.format_report().splitlines()
+
+    assert lines[0].split() == ["layer", "path_id", "requests", "inclusive", "ms"] + [
+        "exclusive",
+        "ms",
+    ]
+    assert lines[1].split() == ["Layer", "None", "2", "3.000", "1.000"]
+
+
+def test_stack_profiler_invalid_sampling():
+    with pytest.raises(ValueError, match="sample_every must be at least 1!"):
+        StackProfiler(sample_every=0)
+
+
+def test_profiled_middleware_compares_equal_to_the_entry():
+    profiler = StackProfiler()
+    configured = functools.partial(Layer, name="foo")
+    middlewares: list[Any] = [OuterLayer, configured, LifespanMiddleware]
+    profile_middlewares(middlewares, profiler)
+    profile_middlewares(middlewares, profiler)
+
+    assert middlewares == [OuterLayer, Layer, LifespanMiddleware]
+    assert middlewares[1] == configured
+    assert middlewares[1] == ProfiledMiddleware(configured, StackProfiler())
+    assert middlewares[1] != OuterLayer
+    assert hash(middlewares[1]) == hash(configured)
+    assert all(isinstance(entry, ProfiledMiddleware) for entry in middlewares)
+    assert middlewares[1].middleware_class is Layer
+    # Connexion passes the lifespan to the middlewares accepting it
+    assert "lifespan" in inspect_function_arguments(middlewares[2])[0]
+    assert "lifespan" not in inspect_function_arguments(middlewares[0])[0]
+    replace_middleware(middlewares, OuterLayer, Layer)
+    assert middlewares[0] is Layer
+
+
+def test_profile_middlewares_connexion_stack():
+    middleware_stack = list(ConnexionMiddleware.default_middlewares)
+    replace_middleware(middleware_stack, ExceptionMiddleware, CustomExceptionMiddleware)
+    replace_middleware(middleware_stack, RoutingMiddleware, CustomRoutingMiddleware)
+    app = AsyncApp(__name__, middlewares=middleware_stack)
+    app.add_middleware(PathIdMiddleware, position=MiddlewarePosition.BEFORE_SECURITY)
+    profiler = profile_middlewares(app.middleware.middlewares)
+    # The positions still work once the stack is profiled
+    app.add_middleware(
+        CustomHeaderMiddleware,
+        position=CustomMiddlewarePosition.BEFORE_CUSTOM_EXCEPTION,
+    )
+    profile_middlewares(app.middleware.middlewares, profiler)
+    app.add_api(
+        {
+            "openapi": "3.0.0",
+            "info": {"title": "profiled", "version": "1"},
+            "paths": {
+                "/ping": {
+                    "get": {
+                        "operationId": "tests.unit.test_profiler.ping",
+                        "responses": {"200": {"description": "ok"}},
+                    }
+                }
+            },
+        }
+    )
+
+    response = app.test_client().get("/ping")
+
+    assert response.status_code == 200
+    layers = {row.layer for row in profiler.report() if row.path_id == "/ping"}
+    assert {
+        "CustomExceptionMiddleware",
+        "CustomRoutingMiddleware",
+        "PathIdMiddleware",
+        "LifespanMiddleware",
+    } <= layers
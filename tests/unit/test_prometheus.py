@@ -1,10 +1,18 @@
+import asyncio
+import functools
+from contextvars import Context
 from typing import Iterable, Dict, Any, Optional
-from unittest.mock import patch, MagicMock, AsyncMock
+from unittest.mock import call, patch, MagicMock, AsyncMock
 
 import pytest
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
 
+from asgimiddlewares import RequestTimeMiddleware
+from asgimiddlewares.utils import RequestPhases, request_phases_ctx_var
 from asgimiddlewares.prometheus import (
     _setup_prometheus,
+    MetricBuffer,
+    MetricsEndpoint,
     PrometheusMiddleware,
 )
 
@@ -53,6 +61,29 @@ def test_setup_prometheus(
             },
             "/v1/sample/id/<identifierA>/other/<identifierB>",
         ),
+        (
+            ["/v1/sample/id/{identifier}"],
+            {"path": "/v1/sample/id/123", "method": "GET"},
+            None,
+        ),
+        (
+            ["/v1/sample/id/{identifier}"],
+            {
+                "path": "/v1/sample/id/123",
+                "method": "GET",
+                "state": {"path_id": "/v1/sample/id/{identifier}"},
+            },
+            None,
+        ),
+        (
+            ["/v1/sample/id/{identifier}"],
+            {
+                "path": "/v1/sample/id/123/other",
+                "method": "GET",
+                "state": {"path_id": "/v1/sample/id/{identifier}/other"},
+            },
+            "/v1/sample/id/{identifier}/other",
+        ),
     ],
 )
 @patch(
@@ -120,3 +151,513 @@ async def test_prometheus_middleware(
 
         middleware.counter.labels.return_value.inc.assert_not_called()
         middleware.histogram.labels.return_value.observe.assert_not_called()
+
+
+@patch("asgimiddlewares.prometheus.Counter")
+@patch("asgimiddlewares.prometheus.Histogram")
+@patch("asgimiddlewares.prometheus.disable_created_metrics", MagicMock())
+@patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister", MagicMock())
+@patch("asgimiddlewares.prometheus._setup_prometheus", MagicMock())
+def test_prometheus_middleware_label_cache(
+    mock_histogram_constructor: MagicMock, mock_counter_constructor: MagicMock
+) -> None:
+    middleware = PrometheusMiddleware(AsyncMock())
+    middleware.hostname = "Marvin"
+    histogram = mock_histogram_constructor.return_value
+    counter = mock_counter_constructor.return_value
+    scope = {"path": "/v1/foo/1", "method": "GET", "state": {"path_id": "/v1/foo/{x}"}}
+
+    middleware.observe(scope, 200, 1)
+    middleware.observe({**scope, "path": "/v1/foo/2"}, 200, 2)
+    middleware.observe(scope, 404, 3)
+
+    # Labels are bound once per (status, method, path_id)
+    assert histogram.labels.call_args_list == [
+        call("Marvin", "200", "GET", "/v1/foo/{x}"),
+        call("Marvin", "404", "GET", "/v1/foo/{x}"),
+    ]
+    assert counter.labels.call_args_list == [
+        call("Marvin", "200", "GET"),
+        call("Marvin", "404", "GET"),
+    ]
+    assert histogram.labels.return_value.observe.call_args_list == [
+        call(1),
+        call(2),
+        call(3),
+    ]
+    assert counter.labels.return_value.inc.call_count == 3
+
+
+def registered_middleware(
+    registry: CollectorRegistry, **kwargs: Any
+) -> PrometheusMiddleware:
+    with (
+        patch("asgimiddlewares.prometheus.disable_created_metrics"),
+        patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister"),
+        patch("asgimiddlewares.prometheus._setup_prometheus"),
+        patch(
+            "asgimiddlewares.prometheus.Counter",
+            functools.partial(Counter, registry=registry),
+        ),
+        patch(
+            "asgimiddlewares.prometheus.Histogram",
+            functools.partial(Histogram, registry=registry),
+        ),
+    ):
+        return PrometheusMiddleware(AsyncMock(), **kwargs)
+
+
+def test_prometheus_middleware_buffered() -> None:
+    registry, buffered_registry = CollectorRegistry(), CollectorRegistry()
+    unbuffered = registered_middleware(registry)
+    buffered = registered_middleware(buffered_registry, flush_interval=3600)
+    scope = {"path": "/v1/foo/1", "method": "GET", "state": {"path_id": "/v1/foo/{x}"}}
+    observations = [(200, 0.003), (200, 0.2), (200, 0.25), (404, 42), (200, 10)]
+
+    for status, duration in observations:
+        unbuffered.observe(scope, status, duration)
+        buffered.observe(scope, status, duration)
+
+    def samples(registry: CollectorRegistry) -> list[Any]:
+        return [
+            sample
+            for metric in registry.collect()
+            for sample in metric.samples
+            if not sample.name.endswith("_created")
+        ]
+
+    assert all(sample.value == 0 for sample in samples(buffered_registry))
+    assert buffered.buffer is not None
+    buffered.buffer.flush()
+    assert samples(buffered_registry) == samples(registry)
+    # Nothing is applied twice
+    buffered.buffer.close()
+    assert samples(buffered_registry) == samples(registry)
+
+
+def test_metric_buffer_flushes_periodically() -> None:
+    registry = CollectorRegistry()
+    counter = Counter("periodic_total", "", registry=registry)
+    histogram = Histogram("periodic_seconds", "", registry=registry)
+    buffer = MetricBuffer(0.001)
+
+    buffer.add((histogram, counter), 1)
+    with patch.object(buffer, "flush", wraps=buffer.flush) as flush:
+        while not flush.called:
+            pass
+    buffer.close()
+
+    assert registry.get_sample_value("periodic_total") == 1
+    assert registry.get_sample_value("periodic_seconds_sum") == 1
+    assert registry.get_sample_value("periodic_seconds_count") == 1
+
+
+def test_metric_buffer_forked_worker() -> None:
+    registry = CollectorRegistry()
+    histogram = Histogram("forked_seconds", "", registry=registry)
+    buffer = MetricBuffer(3600)
+    # Closed before any update, the thread is not started
+    MetricBuffer(3600).close()
+
+    with patch("asgimiddlewares.prometheus.os.getpid", return_value=1):
+        buffer.add((histogram, None), 1)
+        parent_thread = buffer._thread
+    with patch("asgimiddlewares.prometheus.os.getpid", return_value=2):
+        # The copy of the parent's updates is not flushed by the worker
+        buffer.flush()
+        assert registry.get_sample_value("forked_seconds_count") == 0
+        buffer.add((histogram, None), 2)
+        assert buffer._thread is not parent_thread
+        buffer.close()
+
+    assert registry.get_sample_value("forked_seconds_sum") == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("flush_interval", [None, 3600])
+@pytest.mark.parametrize("compact", [True, False])
+@pytest.mark.parametrize(
+    "message_type",
+    ["lifespan.startup.complete", "lifespan.shutdown.complete"],
+)
+@patch("asgimiddlewares.prometheus.Counter", MagicMock())
+@patch("asgimiddlewares.prometheus.Histogram", MagicMock())
+@patch("asgimiddlewares.prometheus.disable_created_metrics", MagicMock())
+@patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister", MagicMock())
+@patch("asgimiddlewares.prometheus._setup_prometheus", MagicMock())
+async def test_prometheus_middleware_lifespan(
+    flush_interval: Optional[float], compact: bool, message_type: str
+) -> None:
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        await send({"type": message_type})
+
+    middleware = PrometheusMiddleware(
+        app,
+        flush_interval=flush_interval,
+        metrics_path="/metrics" if compact else None,
+        compact=compact,
+    )
+    send = AsyncMock()
+
+    with patch.object(PrometheusMiddleware, "shutdown") as shutdown:
+        await middleware({"type": "lifespan"}, AsyncMock(), send)
+
+    send.assert_awaited_once_with({"type": message_type})
+    assert shutdown.call_count == (
+        (flush_interval is not None or compact)
+        and message_type == "lifespan.shutdown.complete"
+    )
+    if middleware.buffer is not None:
+        middleware.buffer.close()
+
+
+async def scrape(app: Any, method: str = "GET") -> list[Dict[str, Any]]:
+    send = AsyncMock()
+    await app({"type": "http", "path": "/metrics", "method": method}, AsyncMock(), send)
+    return [call.args[0] for call in send.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint() -> None:
+    registry = CollectorRegistry()
+    counter = Counter("scraped_total", "Scrapes", registry=registry)
+    endpoint = MetricsEndpoint(ttl=3600, registry=registry)
+    endpoint.CHUNK_SIZE = 16
+
+    messages = await scrape(endpoint)
+    counter.inc()
+    cached = await scrape(endpoint)
+    endpoint._expires = 0
+    rendered = await scrape(endpoint)
+
+    start, *body = messages
+    output = b"".join(message["body"] for message in body)
+    assert start["status"] == 200
+    assert (b"content-length", str(len(output)).encode()) in start["headers"]
+    assert b"scraped_total 0.0" in output
+    assert len(body) > 1
+    assert [message["more_body"] for message in body] == [True] * (len(body) - 1) + [
+        False
+    ]
+    assert cached == messages
+    assert b"scraped_total 1.0" in b"".join(m["body"] for m in rendered[1:])
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_head() -> None:
+    endpoint = MetricsEndpoint(registry=CollectorRegistry())
+
+    messages = await scrape(endpoint, "HEAD")
+
+    assert messages[1:] == [{"type": "http.response.body", "body": b""}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("method", ["POST", "PUT", "DELETE", "OPTIONS"])
+async def test_metrics_endpoint_method_not_allowed(method: str) -> None:
+    endpoint = MetricsEndpoint(registry=CollectorRegistry())
+
+    with patch.object(endpoint, "render") as render:
+        messages = await scrape(endpoint, method)
+
+    render.assert_not_called()
+    assert messages == [
+        {
+            "type": "http.response.start",
+            "status": 405,
+            "headers": [(b"allow", b"GET, HEAD"), (b"content-length", b"0")],
+        },
+        {"type": "http.response.body", "body": b""},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_concurrent_scrapes() -> None:
+    endpoint = MetricsEndpoint(registry=CollectorRegistry())
+
+    with patch(
+        "asgimiddlewares.prometheus.generate_latest", return_value=b"metrics"
+    ) as generate:
+        results = await asyncio.gather(*(endpoint.render() for _ in range(5)))
+
+    generate.assert_called_once_with(endpoint.registry)
+    assert results == [b"metrics"] * 5
+
+
+@pytest.mark.parametrize("multiproc_dir", [True, False])
+@patch("asgimiddlewares.prometheus.multiprocess.MultiProcessCollector")
+def test_metrics_endpoint_registry(
+    mock_collector: MagicMock,
+    multiproc_dir: bool,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    if multiproc_dir:
+        monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", "/tmp")
+    else:
+        monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+
+    endpoint = MetricsEndpoint()
+
+    if multiproc_dir:
+        mock_collector.assert_called_once_with(endpoint.registry, "/tmp")
+    else:
+        assert endpoint.registry is REGISTRY
+        mock_collector.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("asgimiddlewares.prometheus.Counter", MagicMock())
+@patch("asgimiddlewares.prometheus.Histogram", MagicMock())
+@patch("asgimiddlewares.prometheus.disable_created_metrics", MagicMock())
+@patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister", MagicMock())
+@patch("asgimiddlewares.prometheus._setup_prometheus")
+async def test_prometheus_middleware_metrics_path(
+    mock_setup_prometheus: MagicMock,
+) -> None:
+    app = AsyncMock()
+    middleware = PrometheusMiddleware(app, metrics_path="/metrics", metrics_ttl=1)
+    assert middleware.metrics is not None
+
+    with patch.object(middleware.metrics, "render", AsyncMock(return_value=b"metrics")):
+        messages = await scrape(middleware)
+
+    mock_setup_prometheus.assert_not_called()
+    app.assert_not_called()
+    assert messages[1]["body"] == b"metrics"
+    assert middleware.metrics.ttl == 1
+    assert middleware.is_excluded({"path": "/metrics"})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("compact", [True, False])
+async def test_metrics_endpoint_multiprocess(
+    compact: bool, tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    endpoint = MetricsEndpoint(compact=compact)
+
+    with (
+        patch("asgimiddlewares.prometheus.compact_multiprocess_dir") as mock_compact,
+        patch("asgimiddlewares.prometheus.generate_latest", return_value=b"metrics"),
+    ):
+        assert await endpoint.render() == b"metrics"
+
+    if compact:
+        mock_compact.assert_called_once_with(str(tmp_path))
+    else:
+        mock_compact.assert_not_called()
+
+
+@pytest.mark.parametrize("multiproc_dir", [True, False])
+@patch("asgimiddlewares.prometheus.Counter", MagicMock())
+@patch("asgimiddlewares.prometheus.Histogram", MagicMock())
+@patch("asgimiddlewares.prometheus.disable_created_metrics", MagicMock())
+@patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister", MagicMock())
+@patch("asgimiddlewares.prometheus._setup_prometheus", MagicMock())
+@patch("asgimiddlewares.prometheus.compact_multiprocess_dir")
+def test_prometheus_middleware_compact_on_shutdown(
+    mock_compact: MagicMock, multiproc_dir: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    if multiproc_dir:
+        monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", "/tmp")
+    else:
+        monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    middleware = PrometheusMiddleware(
+        AsyncMock(), flush_interval=3600, metrics_path="/metrics", compact=True
+    )
+    assert middleware.buffer is not None
+
+    with patch.object(middleware.buffer, "close") as close:
+        middleware.shutdown()
+
+    close.assert_called_once()
+    assert mock_compact.call_count == multiproc_dir
+
+
+def test_prometheus_middleware_compact_without_metrics_path() -> None:
+    with pytest.raises(ValueError, match="Compaction requires the metrics_path!"):
+        PrometheusMiddleware(AsyncMock(), compact=True)
+
+
+@pytest.mark.asyncio
+@patch("asgimiddlewares.prometheus.Counter", MagicMock())
+@patch("asgimiddlewares.prometheus.Histogram", MagicMock())
+@patch("asgimiddlewares.prometheus.disable_created_metrics", MagicMock())
+@patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister", MagicMock())
+@patch("asgimiddlewares.prometheus._setup_prometheus", MagicMock())
+async def test_prometheus_middleware_excluded_without_wrapper() -> None:
+    mock_app = AsyncMock()
+    middleware = PrometheusMiddleware(mock_app, excluded_paths=("/v1/{name}/ping",))
+    scope = {"type": "http", "path": "/v1/foo/ping", "method": "GET"}
+    receive, send = AsyncMock(), AsyncMock()
+
+    await middleware(scope, receive, send)
+
+    mock_app.assert_awaited_once_with(scope, receive, send)
+    assert middleware.is_excluded({"type": "http"})
+
+
+async def streaming_app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+    while (await receive()).get("more_body", False):
+        pass
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    for chunk in (b"a" * 600, b"b" * 600):
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("flush_interval", [None, 3600])
+async def test_prometheus_middleware_size_metrics(
+    flush_interval: Optional[float],
+) -> None:
+    registry = CollectorRegistry()
+    middleware = registered_middleware(
+        registry, size_metrics=True, flush_interval=flush_interval
+    )
+    middleware.app = streaming_app
+    middleware.hostname = "Marvin"
+    scope = {
+        "type": "http",
+        "path": "/v1/foo/1",
+        "method": "POST",
+        "state": {"path_id": "/v1/foo/{x}"},
+    }
+    receive = AsyncMock(
+        side_effect=[
+            {"type": "http.request", "body": b"x" * 50, "more_body": True},
+            {"type": "http.request", "body": b"x" * 30},
+        ]
+    )
+
+    await middleware(scope, receive, AsyncMock())
+    if middleware.buffer is not None:
+        middleware.buffer.close()
+
+    labels = {"hostname": "Marvin", "method": "POST", "url_rule": "/v1/foo/{x}"}
+    assert registry.get_sample_value("http_request_size_bytes_sum", labels) == 80
+    assert registry.get_sample_value("http_response_size_bytes_sum", labels) == 1200
+    assert (
+        registry.get_sample_value(
+            "http_response_size_bytes_bucket", {**labels, "le": "1000.0"}
+        )
+        == 0
+    )
+    assert (
+        registry.get_sample_value(
+            "http_response_size_bytes_bucket", {**labels, "le": "10000.0"}
+        )
+        == 1
+    )
+    assert (
+        registry.get_sample_value("http_request_total", {**labels, "status": "200"})
+        is None
+    )
+    assert (
+        registry.get_sample_value(
+            "http_request_total",
+            {"hostname": "Marvin", "method": "POST", "status": "200"},
+        )
+        == 1
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("flush_interval", [None, 3600])
+async def test_prometheus_middleware_phase_metrics(
+    flush_interval: Optional[float],
+) -> None:
+    registry = CollectorRegistry()
+    middleware = registered_middleware(
+        registry, phase_metrics=True, flush_interval=flush_interval
+    )
+    middleware.app = RequestTimeMiddleware(streaming_app, phases=True)
+    middleware.hostname = "Marvin"
+    scope = {
+        "type": "http",
+        "path": "/v1/foo/1",
+        "method": "GET",
+        "state": {"path_id": "/v1/foo/{x}"},
+    }
+    receive = AsyncMock(return_value={"type": "http.request"})
+
+    await Context().run(asyncio.ensure_future, middleware(scope, receive, AsyncMock()))
+    if middleware.buffer is not None:
+        middleware.buffer.close()
+
+    labels = {"hostname": "Marvin", "method": "GET", "url_rule": "/v1/foo/{x}"}
+    for phase in ("body_read", "first_byte", "complete", "send_wait"):
+        assert (
+            registry.get_sample_value(
+                "http_request_phase_duration_seconds_count", {**labels, "phase": phase}
+            )
+            == 1
+        )
+
+
+@patch("asgimiddlewares.prometheus.Counter", MagicMock())
+@patch("asgimiddlewares.prometheus.Histogram", MagicMock())
+@patch("asgimiddlewares.prometheus.disable_created_metrics", MagicMock())
+@patch("asgimiddlewares.prometheus.prometheus_client.REGISTRY.unregister", MagicMock())
+@patch("asgimiddlewares.prometheus._setup_prometheus", MagicMock())
+def test_prometheus_middleware_phase_metrics_without_phases() -> None:
+    middleware = PrometheusMiddleware(AsyncMock(), phase_metrics=True)
+    phases = RequestPhases()
+    phases.first_byte = 1
+
+    Context().run(middleware.observe_phases, {"method": "GET"})
+    context = Context()
+    context.run(request_phases_ctx_var.set, phases)
+    context.run(middleware.observe_phases, {"method": "GET"})
+
+    assert middleware.phase_histogram.labels.call_args_list == [
+        call(middleware.hostname, "GET", None, "first_byte"),
+        call(middleware.hostname, "GET", None, "send_wait"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_prometheus_middleware_cache_metrics() -> None:
+    registry = CollectorRegistry()
+    middleware = registered_middleware(registry, cache_metrics=True)
+    middleware.hostname = "Marvin"
+
+    async def cached_app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        scope["state"]["response_cache"] = "hit"
+        scope["state"]["response_cache_evictions"] = ["expired", "size", "size"]
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware.app = cached_app
+    scope = {
+        "type": "http",
+        "path": "/v1/foo/1",
+        "method": "GET",
+        "state": {"path_id": "/v1/foo/{x}"},
+    }
+    await middleware(scope, AsyncMock(), AsyncMock())
+    # Not a cached route
+    middleware.observe_cache({"method": "GET", "state": {"path_id": "/v1/bar"}})
+
+    assert (
+        registry.get_sample_value(
+            "http_response_cache_total",
+            {"hostname": "Marvin", "url_rule": "/v1/foo/{x}", "result": "hit"},
+        )
+        == 1
+    )
+    for reason, evictions in (("expired", 1), ("size", 2)):
+        assert (
+            registry.get_sample_value(
+                "http_response_cache_evictions_total",
+                {"hostname": "Marvin", "reason": reason},
+            )
+            == evictions
+        )
+    assert (
+        registry.get_sample_value(
+            "http_response_cache_total",
+            {"hostname": "Marvin", "url_rule": "/v1/bar", "result": "hit"},
+        )
+        is None
+    )
@@ -1,8 +1,16 @@
+import asyncio
+from contextvars import Context
+from typing import Any
+
 import pytest
 
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, patch
 
-from asgimiddlewares.utils import request_time_ctx_var
+from asgimiddlewares.utils import (
+    logging_ctx_var,
+    request_phases_ctx_var,
+    request_time_ctx_var,
+)
 from asgimiddlewares import RequestTimeMiddleware
 
 
@@ -20,3 +28,69 @@ async def test_request_time_middleware() -> None:
 
     assert request_time_ctx_var.get() is not None
     assert isinstance(request_time_ctx_var.get(), float)
+
+
+@pytest.mark.asyncio
+async def test_request_time_middleware_phases() -> None:
+    async def app(scope: Any, receive: Any, send: Any) -> None:
+        while (await receive()).get("more_body", False):
+            pass
+        await send({"type": "http.response.start", "status": 200})
+        await send({"type": "http.response.body", "body": b"a", "more_body": True})
+        await send({"type": "http.response.body", "body": b"b"})
+
+    receive = AsyncMock(
+        side_effect=[
+            {"type": "http.request", "body": b"a", "more_body": True},
+            {"type": "http.request", "body": b"b"},
+        ]
+    )
+    send = AsyncMock()
+    data: dict[str, Any] = {"path": "/v1/foo"}
+    logging_ctx_var.set(data)
+    middleware = RequestTimeMiddleware(app, phases=True)
+
+    # Every send takes 1 s, everything else 0.5 s
+    with patch(
+        "asgimiddlewares.request_time.time.perf_counter",
+        side_effect=[0, 0.5, 1, 1.5, 2.5, 3, 4, 4.5, 5.5],
+    ):
+        await middleware({"type": "http"}, receive, send)
+
+    phases = request_phases_ctx_var.get()
+    assert phases is not None
+    assert phases.as_dict() == {
+        "body_read": 0.5,
+        "first_byte": 1.5,
+        "complete": 5.5,
+        "send_wait": 3,
+    }
+    assert request_time_ctx_var.get() == 1.5
+    assert data == {"path": "/v1/foo", "phases": phases.as_dict()}
+    assert send.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_request_time_middleware_phases_without_logging() -> None:
+    mock_app = AsyncMock()
+    middleware = RequestTimeMiddleware(mock_app, phases=True)
+
+    # Without ExtendedLoggingMiddleware, logging_ctx_var is not set
+    await Context().run(asyncio.ensure_future, middleware({}, AsyncMock(), AsyncMock()))
+
+    mock_app.assert_awaited_once()
+    # The default value is shared by all requests, it is left alone
+    assert Context().run(logging_ctx_var.get) == {}
+
+
+@pytest.mark.asyncio
+async def test_request_time_middleware_phases_of_skipped_request() -> None:
+    middleware = RequestTimeMiddleware(AsyncMock(), phases=True)
+    # ExtendedLoggingMiddleware leaves the fields empty if its sampler skips
+    # the request
+    data: dict[str, Any] = {}
+    logging_ctx_var.set(data)
+
+    await middleware({"type": "http"}, AsyncMock(), AsyncMock())
+
+    assert data == {}
@@ -0,0 +1,431 @@
+import asyncio
+from typing import Any, Optional
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from starlette.types import Message, Receive, Scope, Send
+
+from asgimiddlewares import CacheRule, ResponseCacheMiddleware
+from asgimiddlewares.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    normalized_query,
+    response_vary,
+    vary_values,
+)
+
+PATH_ID = "/v1/foo/{bar}"
+
+
+class CountingApp:
+    """App responding with the number of its calls, optionally after an event."""
+
+    def __init__(
+        self,
+        headers: Optional[list[tuple[bytes, bytes]]] = None,
+        status: int = 200,
+        chunks: int = 1,
+    ) -> None:
+        self.headers = headers or [(b"content-type", b"application/json")]
+        self.status = status
+        self.chunks = chunks
+        self.calls = 0
+        self.release: Optional[asyncio.Event] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.calls += 1
+        calls = self.calls
+        if self.release is not None:
+            await self.release.wait()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status,
+                "headers": list(self.headers),
+            }
+        )
+        for chunk in range(self.chunks):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": b"%d" % calls,
+                    "more_body": chunk < self.chunks - 1,
+                }
+            )
+
+
+def http_scope(
+    query_string: bytes = b"",
+    headers: Optional[list[tuple[bytes, bytes]]] = None,
+    path: str = "/v1/foo/spam",
+) -> dict[str, Any]:
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": query_string,
+        "headers": headers or [],
+        "state": {"path_id": PATH_ID},
+    }
+
+
+async def call(
+    middleware: ResponseCacheMiddleware, scope: dict[str, Any]
+) -> list[Message]:
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await middleware(scope, None, send)  # type: ignore
+    return sent
+
+
+def response(size: int = 10, stored: float = 0.0) -> CachedResponse:
+    return CachedResponse(200, (), b"x" * size, (), size, stored, 60.0, 60.0)
+
+
+@pytest.mark.parametrize(
+    ["query_string", "expected"],
+    [
+        pytest.param(b"", (), id="empty"),
+        pytest.param(b"b=2&a=1", (("a", "1"), ("b", "2")), id="sorted"),
+        pytest.param(b"a=%41&b=", (("a", "A"), ("b", "")), id="decoded"),
+        pytest.param(
+            b"tag=z&a=1&tag=y", (("a", "1"), ("tag", "z"), ("tag", "y")), id="repeated"
+        ),
+    ],
+)
+def test_normalized_query(query_string: bytes, expected: tuple[Any, ...]) -> None:
+    assert normalized_query(query_string) == expected
+
+
+@pytest.mark.parametrize(
+    ["headers", "expected"],
+    [
+        pytest.param([], (), id="no headers"),
+        pytest.param(
+            [(b"vary", b"Accept-Language, accept"), (b"vary", b"Accept")],
+            (b"accept", b"accept-language"),
+            id="vary",
+        ),
+        pytest.param(
+            [(b"cache-control", b"public, max-age=60")], (), id="public cache-control"
+        ),
+        pytest.param([(b"cache-control", b"No-Store")], None, id="no-store"),
+        pytest.param([(b"cache-control", b"private")], None, id="private"),
+        pytest.param([(b"set-cookie", b"session=1")], None, id="set-cookie"),
+        pytest.param([(b"vary", b"*")], None, id="vary *"),
+    ],
+)
+def test_response_vary(
+    headers: list[tuple[bytes, bytes]], expected: Optional[tuple[bytes, ...]]
+) -> None:
+    assert response_vary(headers) == expected
+
+
+def test_vary_values() -> None:
+    headers = [(b"accept", b"text/html"), (b"x-a", b"1"), (b"accept", b"*/*")]
+
+    assert vary_values(headers, ()) == ()
+    assert vary_values(headers, (b"accept", b"accept-language")) == (
+        b"text/html,*/*",
+        b"",
+    )
+
+
+def test_response_cache() -> None:
+    cache = ResponseCache(max_bytes=25)
+
+    assert cache.put("a", response(10)) == 0
+    assert cache.put("b", response(10)) == 0
+    # The least recently used response is "b" now
+    assert cache.get("a") is not None
+    assert cache.put("c", response(10)) == 1
+    assert cache.get("b") is None
+    assert (len(cache), cache.size) == (2, 20)
+    # Replacing a response does not count its old size
+    assert cache.put("c", response(5)) == 0
+    assert cache.size == 15
+    assert cache.put("d", response(30)) == 3
+    assert (len(cache), cache.size) == (0, 0)
+    cache.pop("missing")
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_hit() -> None:
+    app = CountingApp()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule(ttl=60)})
+    first, second = http_scope(b"b=2&a=1"), http_scope(b"a=1&b=2")
+
+    miss = await call(middleware, first)
+    hit = await call(middleware, second)
+
+    assert app.calls == 1
+    assert first["state"]["response_cache"] == "miss"
+    assert second["state"]["response_cache"] == "hit"
+    assert miss[1]["body"] == hit[1]["body"] == b"1"
+    assert hit[0]["status"] == 200
+    assert hit[0]["headers"] == [
+        (b"content-type", b"application/json"),
+        (b"age", b"0"),
+    ]
+    assert not hit[1].get("more_body", False)
+    # Another query is another response
+    await call(middleware, http_scope(b"a=2"))
+    assert app.calls == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "scope",
+    [
+        pytest.param({**http_scope(), "method": "POST"}, id="POST"),
+        pytest.param({"type": "websocket", "method": "GET"}, id="websocket"),
+        pytest.param({**http_scope(), "state": {"path_id": "/v1/bar"}}, id="route"),
+        pytest.param({**http_scope(), "state": {}}, id="no path_id"),
+    ],
+)
+async def test_response_cache_middleware_not_cached_route(
+    scope: dict[str, Any],
+) -> None:
+    app = CountingApp()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()})
+
+    await call(middleware, dict(scope))
+    await call(middleware, dict(scope))
+
+    assert app.calls == 2
+    assert "response_cache" not in scope.get("state", {})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(CountingApp(status=404), id="status"),
+        pytest.param(CountingApp([(b"set-cookie", b"a=1")]), id="set-cookie"),
+        pytest.param(CountingApp([(b"cache-control", b"no-store")]), id="no-store"),
+        pytest.param(CountingApp(chunks=20), id="too large"),
+    ],
+)
+async def test_response_cache_middleware_not_cached_response(app: CountingApp) -> None:
+    middleware = ResponseCacheMiddleware(
+        app, {PATH_ID: CacheRule()}, max_response_bytes=10
+    )
+
+    await call(middleware, http_scope())
+    sent = await call(middleware, http_scope())
+
+    assert app.calls == 2
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"2" * (
+        app.chunks
+    )
+    assert len(middleware.cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_vary() -> None:
+    app = CountingApp([(b"vary", b"Accept-Language")])
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()})
+    english = [(b"accept-language", b"en")]
+    czech = [(b"accept-language", b"cs")]
+
+    await call(middleware, http_scope(headers=english))
+    # Stored by the request headers named by the Vary of the first response
+    await call(middleware, http_scope(headers=english))
+    assert app.calls == 1
+
+    sent = await call(middleware, http_scope(headers=czech))
+    assert sent[1]["body"] == b"2"
+    sent = await call(middleware, http_scope(headers=czech))
+    assert sent[1]["body"] == b"2"
+    sent = await call(middleware, http_scope(headers=english))
+    assert sent[1]["body"] == b"1"
+    assert app.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_paths() -> None:
+    app = CountingApp()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()})
+    spam, eggs = http_scope(path="/v1/foo/spam"), http_scope(path="/v1/foo/eggs")
+
+    # The paths of the same template are different responses
+    await call(middleware, spam)
+    sent = await call(middleware, eggs)
+
+    assert app.calls == 2
+    assert spam["state"]["response_cache"] == eggs["state"]["response_cache"] == "miss"
+    assert sent[1]["body"] == b"2"
+    assert (await call(middleware, http_scope(path="/v1/foo/spam")))[1]["body"] == b"1"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", [b"authorization", b"cookie"])
+async def test_response_cache_middleware_credentials(name: bytes) -> None:
+    app = CountingApp()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()})
+    await call(middleware, http_scope())
+    alice = [(name, b"alice")]
+
+    # The cached response is not served to a user, their response is not cached
+    first, second = http_scope(headers=alice), http_scope(headers=alice)
+    await call(middleware, first)
+    sent = await call(middleware, second)
+
+    assert app.calls == 3
+    assert first["state"]["response_cache"] == second["state"]["response_cache"]
+    assert second["state"]["response_cache"] == "miss"
+    assert sent[1]["body"] == b"3"
+    assert len(middleware.cache) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", [b"authorization", b"cookie"])
+async def test_response_cache_middleware_vary_credentials(name: bytes) -> None:
+    app = CountingApp([(b"vary", name)])
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()})
+    alice, bob = [(name, b"alice")], [(name, b"bob")]
+
+    await call(middleware, http_scope(headers=alice))
+    hit = await call(middleware, http_scope(headers=alice))
+    other = await call(middleware, http_scope(headers=bob))
+
+    assert app.calls == 2
+    assert hit[1]["body"] == b"1"
+    assert other[1]["body"] == b"2"
+    # Not cached when the response stops naming the credentials in Vary
+    app.headers = []
+    await call(middleware, http_scope(b"a=1", headers=alice))
+    await call(middleware, http_scope(b"a=1", headers=alice))
+    assert app.calls == 4
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_expired() -> None:
+    app = CountingApp()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule(ttl=10, stale=5)})
+    clock = MagicMock()
+    evicted, stale_but_alone = http_scope(), http_scope()
+
+    with patch("asgimiddlewares.response_cache.time", clock):
+        clock.monotonic.return_value = 100.0
+        await call(middleware, http_scope())
+        clock.monotonic.return_value = 112.0
+        # Within the stale seconds, but nobody is refreshing it
+        await call(middleware, stale_but_alone)
+        clock.monotonic.return_value = 109.0 + 12.0
+        hit = await call(middleware, http_scope())
+        clock.monotonic.return_value = 140.0
+        await call(middleware, evicted)
+
+    assert app.calls == 3
+    assert stale_but_alone["state"]["response_cache"] == "miss"
+    assert (b"age", b"9") in hit[0]["headers"]
+    assert evicted["state"]["response_cache"] == "miss"
+    assert evicted["state"]["response_cache_evictions"] == ["expired"]
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_byte_budget() -> None:
+    app = CountingApp()
+    # Fits the headers and the body of one response only
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()}, max_bytes=40)
+    second = http_scope(b"a=2")
+
+    await call(middleware, http_scope(b"a=1"))
+    await call(middleware, second)
+
+    assert second["state"]["response_cache_evictions"] == ["size"]
+    assert len(middleware.cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_coalesced() -> None:
+    app = CountingApp()
+    app.release = asyncio.Event()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()})
+    scopes = [http_scope() for _ in range(4)]
+
+    requests = asyncio.gather(*(call(middleware, scope) for scope in scopes))
+    await asyncio.sleep(0)
+    app.release.set()
+    responses = await requests
+
+    assert app.calls == 1
+    assert [scope["state"]["response_cache"] for scope in scopes] == [
+        "miss",
+        "coalesced",
+        "coalesced",
+        "coalesced",
+    ]
+    assert all(sent[1]["body"] == b"1" for sent in responses)
+    assert not middleware._pending
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_stale() -> None:
+    app = CountingApp()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule(ttl=10, stale=5)})
+    clock = MagicMock()
+    refresh, stale = http_scope(), http_scope()
+
+    with patch("asgimiddlewares.response_cache.time", clock):
+        clock.monotonic.return_value = 100.0
+        await call(middleware, http_scope())
+        clock.monotonic.return_value = 112.0
+        app.release = asyncio.Event()
+        refreshing = asyncio.ensure_future(call(middleware, refresh))
+        await asyncio.sleep(0)
+        sent = await call(middleware, stale)
+        app.release.set()
+        refreshed = await refreshing
+
+    assert (refresh["state"]["response_cache"], stale["state"]["response_cache"]) == (
+        "miss",
+        "stale",
+    )
+    assert (sent[1]["body"], refreshed[1]["body"]) == (b"1", b"2")
+    assert (b"age", b"12") in sent[0]["headers"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ["headers", "status"],
+    [
+        pytest.param([], 404, id="not cacheable"),
+        pytest.param([(b"vary", b"Accept")], 200, id="other vary"),
+    ],
+)
+async def test_response_cache_middleware_coalesced_miss(
+    headers: list[tuple[bytes, bytes]], status: int
+) -> None:
+    app = CountingApp(headers, status)
+    app.release = asyncio.Event()
+    middleware = ResponseCacheMiddleware(app, {PATH_ID: CacheRule()})
+    scopes = [http_scope() for _ in range(3)]
+
+    requests = asyncio.gather(*(call(middleware, scope) for scope in scopes))
+    await asyncio.sleep(0)
+    app.release.set()
+    await requests
+
+    # The waiting requests call the app themselves
+    assert app.calls == 3
+    assert all(scope["state"]["response_cache"] == "miss" for scope in scopes)
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_error() -> None:
+    async def failing_app(scope: Scope, receive: Receive, send: Send) -> None:
+        raise RuntimeError("Boom")
+
+    middleware = ResponseCacheMiddleware(failing_app, {PATH_ID: CacheRule()})
+
+    with pytest.raises(RuntimeError):
+        await call(middleware, http_scope())
+
+    assert not middleware._pending
+    assert len(middleware.cache) == 0
@@ -0,0 +1,279 @@
+from typing import Any, Optional, cast
+from unittest.mock import AsyncMock
+
+import pytest
+
+from starlette.routing import BaseRoute, Match, Mount, Route, Router
+
+from asgimiddlewares.route_index import IndexedRouter, RouteIndex
+
+
+def endpoint() -> None:
+    pass
+
+
+ROUTES = [
+    Route("/ping", endpoint, methods=["GET"]),
+    Route("/foo/{bar}/{spam}", endpoint, methods=["GET"]),
+    Route("/foo/{bar}/{spam}", endpoint, methods=["POST"], name="post_spam"),
+    Route("/foo/{bar}", endpoint, methods=["GET"]),
+    Route("/foo/{bar}/literal", endpoint, methods=["GET"]),
+    Route("/foo/fixed", endpoint, methods=["PUT"]),
+    Route("/items/{item_id:int}", endpoint, methods=["GET"]),
+    Route("/files/{name}.json", endpoint, methods=["GET"]),
+    Route("/static/{rest:path}", endpoint, methods=["GET"]),
+    Route("/", endpoint, methods=["GET"]),
+    Route("/trailing/", endpoint, methods=["GET"]),
+    Mount("/mounted", app=AsyncMock()),
+]
+
+
+def linear_scan(
+    routes: list[BaseRoute], scope: dict[str, Any]
+) -> tuple[Match, Optional[BaseRoute], dict[str, Any]]:
+    """Reference implementation, mimics the loop of Starlette's Router."""
+    partial = None
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return match, route, child_scope
+        if match == Match.PARTIAL and partial is None:
+            partial = (match, route, child_scope)
+    return partial or (Match.NONE, None, {})
+
+
+@pytest.mark.parametrize("method", ["GET", "POST", "PUT"])
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/ping",
+        "/ping/",
+        "/foo/a",
+        "/foo/a/b",
+        "/foo/a/literal",
+        "/foo/fixed",
+        "/foo/fixed/literal",
+        "/foo//b",
+        "/foo/",
+        "/items/42",
+        "/items/abc",
+        "/files/report.json",
+        "/files/report.xml",
+        "/static/css/main.css",
+        "/",
+        "/trailing/",
+        "/trailing",
+        "/mounted/anything",
+        "/missing/path",
+        "no-leading-slash",
+    ],
+)
+@pytest.mark.parametrize("reverse", [False, True])
+def test_route_index_matches_linear_scan(path: str, method: str, reverse: bool):
+    routes = list(reversed(ROUTES)) if reverse else ROUTES
+    scope = {"type": "http", "path": path, "method": method, "path_params": {"x": 1}}
+
+    assert RouteIndex(routes).lookup(scope)[:3] == linear_scan(routes, scope)
+
+
+def test_route_index_skips_regex_routes_behind_a_match():
+    regex_route = Route("/items/{item_id:int}", endpoint)
+    routes = [Route("/items/{item_id}", endpoint), regex_route]
+    index = RouteIndex(routes)
+    scope = {"type": "http", "path": "/items/1", "method": "GET"}
+
+    assert index.regex_routes == [(1, regex_route)]
+    match, route, child_scope, layer = index.lookup(scope)
+    assert match == Match.FULL
+    assert route is routes[0]
+    assert child_scope == {"endpoint": endpoint, "path_params": {"item_id": "1"}}
+    assert layer == 0
+
+
+def test_route_index_prefers_earlier_regex_partial():
+    routes = [
+        Route("/items/{item_id:int}", endpoint, methods=["POST"]),
+        Route("/items/{item_id}", endpoint, methods=["PUT"]),
+    ]
+    scope = {"type": "http", "path": "/items/1", "method": "GET"}
+
+    match, route, _, _ = RouteIndex(routes).lookup(scope)
+    assert match == Match.PARTIAL
+    assert route is routes[0]
+
+
+CHAINED_ROUTES = [
+    Route("/foo/{bar}", endpoint, methods=["DELETE"]),
+    Route("/foo/{bar}/{spam}", endpoint, methods=["PUT"]),
+    Route("/chained", endpoint, methods=["GET"]),
+    Route("/items/{item_id:int}/sub", endpoint, methods=["GET"]),
+]
+
+
+@pytest.mark.parametrize("method", ["GET", "PUT", "DELETE"])
+@pytest.mark.parametrize(
+    "path",
+    ["/foo/a", "/foo/a/b", "/chained", "/items/1/sub", "/items/1", "/missing"],
+)
+def test_route_index_chained_layers(path: str, method: str):
+    index = RouteIndex(ROUTES)
+    index.add_layer(CHAINED_ROUTES)
+    scope = {"type": "http", "path": path, "method": method}
+
+    # A chained router only sees requests no route of the first router matched
+    expected = linear_scan(ROUTES, scope)
+    layer = 0
+    if expected[1] is None:
+        expected = linear_scan(CHAINED_ROUTES, scope)
+        layer = 1
+
+    lookup = index.lookup(scope)
+    assert lookup[:3] == expected
+    assert lookup.layer == (layer if expected[1] is not None else None)
+
+
+@pytest.mark.asyncio
+async def test_indexed_router_dispatch():
+    app = AsyncMock()
+    default = AsyncMock()
+    router = IndexedRouter([Route("/foo/{bar}", app, methods=["GET"])], default)
+    scope = {"type": "http", "path": "/foo/spam", "method": "GET"}
+
+    await router(scope, AsyncMock(), AsyncMock())
+
+    app.assert_awaited_once()
+    default.assert_not_called()
+    assert scope["router"] is router
+    assert scope["route"] is router.routes[0]
+    assert scope["path_params"] == {"bar": "spam"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ["path", "location"],
+    [("/foo/spam/", "/foo/spam"), ("/bar", "/bar/")],
+)
+async def test_indexed_router_redirect_slashes(path: str, location: str):
+    default = AsyncMock()
+    routes = [Route("/foo/{bar}", AsyncMock()), Route("/bar/", AsyncMock())]
+    router = IndexedRouter(routes, default)
+    send = AsyncMock()
+    scope = {
+        "type": "http",
+        "path": path,
+        "method": "GET",
+        "scheme": "http",
+        "server": ("localhost", 80),
+        "headers": [],
+        "query_string": b"",
+    }
+
+    await router(scope, AsyncMock(), send)
+
+    default.assert_not_called()
+    start = send.call_args_list[0].args[0]
+    assert start["status"] == 307
+    assert (b"location", f"http://localhost{location}".encode()) in start["headers"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/", "/unknown"])
+async def test_indexed_router_default(path: str):
+    default = AsyncMock()
+    router = IndexedRouter([Route("/foo", AsyncMock())], default)
+    scope = {"type": "http", "path": path, "method": "GET"}
+
+    await router(scope, AsyncMock(), AsyncMock())
+
+    default.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(["path", "called"], [("/foo", 0), ("/bar", 1), ("/", 2)])
+async def test_indexed_router_chain(path: str, called: int):
+    apps = [AsyncMock(), AsyncMock(), AsyncMock()]
+    first_default = AsyncMock()
+    router = IndexedRouter([Route("/foo", apps[0])], first_default)
+    chained = IndexedRouter([Route("/bar", apps[1])], apps[2])
+    router.chain(chained)
+    scope = {"type": "http", "path": path, "method": "GET"}
+
+    await router(scope, AsyncMock(), AsyncMock())
+
+    assert router.default is chained
+    assert router.chained == [router, chained]
+    for index, app in enumerate(apps):
+        assert app.await_count == (index == called)
+    first_default.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("redirect_slashes", [True, False])
+@pytest.mark.parametrize("path", ["/foo", "/foo/", "/bar", "/bar/", "/baz/"])
+async def test_indexed_router_chain_redirect_order(path: str, redirect_slashes: bool):
+    async def dispatch(router: Router, apps: list[AsyncMock]) -> tuple[Any, ...]:
+        send = AsyncMock()
+        scope = {
+            "type": "http",
+            "path": path,
+            "method": "GET",
+            "scheme": "http",
+            "server": ("localhost", 80),
+            "headers": [],
+            "query_string": b"",
+        }
+        await router(scope, AsyncMock(), send)
+        if not send.called:
+            return tuple(app.await_count for app in apps)
+        start = send.call_args_list[0].args[0]
+        return start["status"], dict(start["headers"])[b"location"]
+
+    def layers(router_class: type[Router]) -> tuple[list[Router], list[AsyncMock]]:
+        apps = [AsyncMock() for _ in range(5)]
+        routers = [
+            router_class([Route("/foo", apps[0])]),
+            router_class([Route("/foo/", apps[1]), Route("/bar", apps[2])]),
+            router_class([Route("/bar/", apps[3])], default=apps[4]),
+        ]
+        routers[0].redirect_slashes = redirect_slashes
+        return routers, apps
+
+    # Baseline: every router passes the request it does not handle to the next one
+    routers, apps = layers(Router)
+    routers[0].default = routers[1]
+    routers[1].default = routers[2]
+    expected = await dispatch(routers[0], apps)
+
+    routers, apps = layers(IndexedRouter)
+    indexed = cast(IndexedRouter, routers[0])
+    indexed.chain(routers[1])
+    indexed.chain(routers[2])
+    assert await dispatch(indexed, apps) == expected
+
+
+@pytest.mark.asyncio
+async def test_indexed_router_chain_websocket():
+    app = AsyncMock()
+    router = IndexedRouter([Mount("/ws", app=AsyncMock())])
+    router.chain(Router([Mount("/chained", app=app)]))
+    scope = {"type": "websocket", "path": "/chained/chat"}
+
+    await router(scope, AsyncMock(), AsyncMock())
+
+    app.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_indexed_router_websocket_falls_back_to_router():
+    app = AsyncMock()
+    router = IndexedRouter([Mount("/ws", app=app)])
+    scope = {"type": "websocket", "path": "/ws/chat"}
+
+    await router(scope, AsyncMock(), AsyncMock())
+
+    app.assert_awaited_once()
+
+
+def test_indexed_router_is_router():
+    routes = [Route("/foo", endpoint)]
+    assert IndexedRouter(routes) == Router(routes)
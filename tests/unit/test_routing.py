@@ -1,3 +1,6 @@
+from typing import Optional
+
+from connexion.spec import Specification
 from starlette.routing import Route, Mount
 from unittest.mock import MagicMock, patch, AsyncMock
 
@@ -5,6 +8,7 @@ import pytest
 
 
 from asgimiddlewares import CustomRoutingMiddleware
+from asgimiddlewares.route_index import IndexedRouter
 
 
 @pytest.mark.parametrize(
@@ -62,3 +66,125 @@ async def test_scope_change():
     scope = {"type": "http"}
     await middleware(scope, AsyncMock(), AsyncMock())
     assert scope["router"] == mock_router
+
+
+@patch("asgimiddlewares.routing.RoutingAPI")
+def test_routing_middleware_route_index(mock_routing_api_constructor: MagicMock):
+    middleware = CustomRoutingMiddleware(AsyncMock(), route_index=True)
+    middleware.router = MagicMock()
+    middleware.router.routes = []
+    mock_api = mock_routing_api_constructor.return_value
+    routes = [Route("/foo/{bar}", lambda bar: bar), Route("/ping", lambda: "pong")]
+    mock_api.router.routes = routes.copy()
+    default = mock_api.router.default
+    mock_api.base_path = "/v1"
+
+    middleware.add_api(MagicMock(), "/v1")
+
+    assert isinstance(mock_api.router, IndexedRouter)
+    assert mock_api.router.routes == routes
+    assert mock_api.router.default == default
+    middleware.router.mount.assert_called_once_with("/v1", app=mock_api.router)
+
+
+SPECIFICATION = {
+    "openapi": "3.0.0",
+    "info": {"title": "sample", "version": "1"},
+    "paths": {
+        "/ping": {
+            "get": {
+                "operationId": "os.getcwd",
+                "responses": {"200": {"description": "ok"}},
+            },
+        },
+        "/foo/{bar}": {
+            "get": {
+                "operationId": "os.getcwd",
+                "parameters": [
+                    {
+                        "name": "bar",
+                        "in": "path",
+                        "required": True,
+                        "schema": {"type": "string"},
+                    }
+                ],
+                "responses": {"200": {"description": "ok"}},
+            },
+        },
+    },
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("route_index", [False, True])
+@pytest.mark.parametrize(
+    ["path", "method", "path_id"],
+    [
+        ("/v1/ping", "GET", "/v1/ping"),
+        ("/v1/foo/spam", "GET", "/v1/foo/{bar}"),
+        ("/v1/unknown", "GET", None),
+        ("/v2/ping", "GET", None),
+    ],
+)
+async def test_route_match_in_state(
+    path: str, method: str, path_id: Optional[str], route_index: bool
+):
+    mock_app = AsyncMock()
+    middleware = CustomRoutingMiddleware(mock_app, route_index=route_index)
+    middleware.add_api(Specification.load(SPECIFICATION), base_path="/v1")
+    scope = {"type": "http", "path": path, "method": method, "headers": []}
+
+    await middleware(scope, AsyncMock(), AsyncMock())
+
+    next_scope = mock_app.call_args.args[0]
+    assert next_scope["router"] is middleware.router
+    route_match = next_scope["state"]["route_match"]
+    if path_id is None:
+        assert route_match is None
+    else:
+        assert route_match.path_id == path_id
+        assert route_match.mount_path == "/v1"
+
+
+CHAINED_SPECIFICATION = {
+    "openapi": "3.0.0",
+    "info": {"title": "chained", "version": "1"},
+    "paths": {
+        "/bar": {
+            "get": {
+                "operationId": "os.getcwd",
+                "responses": {"200": {"description": "ok"}},
+            },
+        },
+    },
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("route_index", [False, True])
+@pytest.mark.parametrize(
+    ["path", "path_id"],
+    [
+        ("/v1/ping", "/v1/ping"),
+        ("/v1/foo/spam", "/v1/foo/{bar}"),
+        ("/v1/bar", "/v1/bar"),
+        ("/v1/unknown", None),
+    ],
+)
+async def test_chained_apis(path: str, path_id: Optional[str], route_index: bool):
+    mock_app = AsyncMock()
+    middleware = CustomRoutingMiddleware(mock_app, route_index=route_index)
+    middleware.add_api(Specification.load(SPECIFICATION), base_path="/v1")
+    middleware.add_api(Specification.load(CHAINED_SPECIFICATION), base_path="/v1")
+    scope = {"type": "http", "path": path, "method": "GET", "headers": []}
+
+    await middleware(scope, AsyncMock(), AsyncMock())
+
+    route_match = mock_app.call_args.args[0]["state"]["route_match"]
+    if path_id is None:
+        assert route_match is None
+    else:
+        assert route_match.path_id == path_id
+    if route_index:
+        first, chained = middleware.router.routes[:2]
+        assert first.app.chained == [first.app, chained.app]
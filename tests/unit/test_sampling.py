@@ -0,0 +1,56 @@
+from unittest.mock import patch
+
+import pytest
+
+from asgimiddlewares import AccessLogSampler
+
+
+def test_access_log_sampler_caps_the_routes():
+    sampler = AccessLogSampler(rate=2, burst=2)
+
+    with patch("asgimiddlewares.sampling.time.monotonic", return_value=0):
+        weights = [sampler.sample("/v1/ping", 200, 0.01) for _ in range(5)]
+        # Every route and status has its own bucket
+        other = sampler.sample("/v1/foo/{bar}", 200, 0.01)
+        not_found = sampler.sample("/v1/ping", 404, 0.01)
+    with patch("asgimiddlewares.sampling.time.monotonic", return_value=0.5):
+        refilled = [sampler.sample("/v1/ping", 200, 0.01) for _ in range(2)]
+
+    assert weights == [1, 1, 0, 0, 0]
+    assert (other, not_found) == (1, 1)
+    # The kept record stands for the three skipped requests too
+    assert refilled == [4, 0]
+
+
+def test_access_log_sampler_keeps_errors_and_slow_requests():
+    sampler = AccessLogSampler(rate=1, slow=0.5)
+
+    with patch("asgimiddlewares.sampling.time.monotonic", return_value=0):
+        assert sampler.sample("/v1/ping", 200, 0.01) == 1
+        assert sampler.sample("/v1/ping", 200, 0.01) == 0
+        assert sampler.sample("/v1/ping", 500, 0.01) == 1
+        assert sampler.sample("/v1/ping", 503, 0.01) == 1
+        assert sampler.sample("/v1/ping", 200, 0.5) == 1
+        assert sampler.sample("/v1/ping", 200, 0.01) == 0
+
+
+def test_access_log_sampler_without_slow_requests():
+    sampler = AccessLogSampler(rate=1, slow=None, error_status=400)
+
+    with patch("asgimiddlewares.sampling.time.monotonic", return_value=0):
+        assert sampler.sample(None, 200, 60) == 1
+        assert sampler.sample(None, 200, 60) == 0
+        assert sampler.sample(None, 404, 0) == 1
+
+
+@pytest.mark.parametrize(
+    ["kwargs", "message"],
+    [
+        ({"rate": 0}, "The rate must be positive!"),
+        ({"rate": 0.5}, "The burst must be at least 1!"),
+        ({"burst": 0}, "The burst must be at least 1!"),
+    ],
+)
+def test_access_log_sampler_invalid(kwargs: dict, message: str):
+    with pytest.raises(ValueError, match=message):
+        AccessLogSampler(**kwargs)
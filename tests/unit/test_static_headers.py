@@ -0,0 +1,46 @@
+import pytest
+
+from asgimiddlewares.static_headers import HeaderRule, StaticHeaders
+
+
+@pytest.mark.parametrize(
+    ["path", "expected"],
+    [
+        pytest.param("/health", [b"all"], id="No prefix"),
+        pytest.param("/v1/foo/1", [b"all", b"v1"], id="Included"),
+        pytest.param("/v1", [b"all", b"v1"], id="The prefix itself"),
+        pytest.param("/v1/ui/#/foo", [b"v1-ui"], id="Excluded"),
+        pytest.param("/v1/uid", [b"v1-ui"], id="Longer path"),
+        pytest.param("/v1/u", [b"all", b"v1"], id="Shorter than the prefix"),
+        pytest.param("/v2/ui", [b"all", b"v1-ui"], id="Excluded elsewhere"),
+        pytest.param("", [b"all"], id="Empty path"),
+    ],
+)
+def test_static_headers_for_path(path: str, expected: list[bytes]):
+    static_headers = StaticHeaders(
+        [
+            HeaderRule("X-All", "all", exclude=("/v1/ui",)),
+            HeaderRule("X-All", "v1", include=("/v1",), exclude=("/v1/ui", "/v2")),
+            HeaderRule("X-All", "v1-ui", include=("/v1/ui", "/v2/ui")),
+        ]
+    )
+
+    headers = static_headers.for_path(path)
+
+    assert headers == tuple((b"x-all", value) for value in expected)
+
+
+def test_static_headers_empty_prefix():
+    static_headers = StaticHeaders(
+        [
+            HeaderRule("X-Everywhere", "1", include=("",)),
+            HeaderRule("X-Nowhere", "1", exclude=("",)),
+        ]
+    )
+
+    assert static_headers.for_path("/foo") == ((b"x-everywhere", b"1"),)
+    assert static_headers.for_path("") == ((b"x-everywhere", b"1"),)
+
+
+def test_static_headers_without_rules():
+    assert StaticHeaders([]).for_path("/foo") == ()
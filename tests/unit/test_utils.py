@@ -1,3 +1,7 @@
+import copy
+import json
+import logging
+import pickle
 from unittest.mock import MagicMock
 
 import pytest
@@ -6,7 +10,14 @@ from typing import Any
 
 from opentelemetry.trace import INVALID_SPAN, Span
 
-from asgimiddlewares.utils import replace_middleware, server_request_hook
+from asgimiddlewares.utils import (
+    LoggingContextFilter,
+    TraceContext,
+    logging_context,
+    logging_ctx_var,
+    replace_middleware,
+    server_request_hook,
+)
 
 
 @pytest.mark.parametrize(
@@ -50,6 +61,109 @@ def test_server_request_hook() -> None:
     span = MagicMock()
     span.is_recording.return_value = True
     span.get_span_context.return_value.trace_id = 1234567890
+    span.get_span_context.return_value.span_id = 255
     scope: dict[str, Any] = {"state": {}}
     server_request_hook(span, scope)
-    assert scope["state"]["trace_id"] == "0x499602d2"
+    trace_id = scope["state"]["trace_id"]
+    assert isinstance(trace_id, TraceContext)
+    assert trace_id.span_id_hex == "00000000000000ff"
+    assert trace_id == "000000000000000000000000499602d2"
+
+
+def test_server_request_hook_invalid_trace_id() -> None:
+    span = MagicMock()
+    span.get_span_context.return_value.trace_id = 0
+    scope: dict[str, Any] = {"state": {}}
+    server_request_hook(span, scope)
+    assert scope["state"]["trace_id"] is None
+
+
+def test_trace_context_is_string() -> None:
+    trace_context = TraceContext(0x5D66F33F56B69EAD5D79F7A928FDE097, 0xFF)
+
+    assert isinstance(trace_context, str)
+    assert trace_context == "5d66f33f56b69ead5d79f7a928fde097"
+    assert f"{trace_context}" == "5d66f33f56b69ead5d79f7a928fde097"
+    assert hash(trace_context) == hash("5d66f33f56b69ead5d79f7a928fde097")
+    assert (trace_context.trace_id, trace_context.span_id) == (
+        0x5D66F33F56B69EAD5D79F7A928FDE097,
+        0xFF,
+    )
+    # The logging fields are serialized like with the string of the trace_id
+    assert json.dumps({"trace_id": trace_context}) == (
+        '{"trace_id": "5d66f33f56b69ead5d79f7a928fde097"}'
+    )
+
+
+@pytest.mark.parametrize(
+    "copier",
+    [copy.copy, copy.deepcopy, lambda value: pickle.loads(pickle.dumps(value))],
+    ids=["copy", "deepcopy", "pickle"],
+)
+def test_trace_context_copy(copier: Any) -> None:
+    trace_context = TraceContext(0xABC, 0xFF)
+
+    copied = copier(trace_context)
+
+    assert isinstance(copied, TraceContext)
+    assert copied == "0" * 29 + "abc"
+    assert (copied.trace_id, copied.span_id) == (0xABC, 0xFF)
+    assert copier({"trace_id": trace_context}) == {"trace_id": trace_context}
+
+
+def test_logging_context() -> None:
+    before = logging_ctx_var.get()
+
+    with logging_context({"path": "/foo"}) as data:
+        assert logging_ctx_var.get() is data
+        # Inner contexts add their fields to the outermost one
+        with logging_context({"status": None}) as inner:
+            assert inner is data
+            inner["status"] = 200
+        assert logging_ctx_var.get() == {"path": "/foo", "status": 200}
+
+    assert logging_ctx_var.get() is before
+
+
+def test_logging_context_reset_on_error() -> None:
+    before = logging_ctx_var.get()
+
+    try:
+        with logging_context({"path": "/foo"}):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    assert logging_ctx_var.get() is before
+    with logging_context({}) as data:
+        assert data == {}
+
+
+def make_record(level: int) -> logging.LogRecord:
+    return logging.LogRecord("foo", level, __file__, 1, "message", None, None)
+
+
+def test_logging_context_filter() -> None:
+    log_filter = LoggingContextFilter()
+    record = make_record(logging.DEBUG)
+
+    with logging_context({"path": "/foo"}) as data:
+        assert log_filter.filter(record)
+        data["status"] = 200
+
+    # The record refers to the fields of the request
+    assert record.request is data
+    assert record.request == {"path": "/foo", "status": 200}
+
+
+def test_logging_context_filter_level() -> None:
+    log_filter = LoggingContextFilter("fields", level=logging.INFO)
+    debug = make_record(logging.DEBUG)
+    info = make_record(logging.INFO)
+
+    with logging_context({"path": "/foo"}):
+        assert log_filter.filter(debug)
+        assert log_filter.filter(info)
+
+    assert not hasattr(debug, "fields")
+    assert info.fields == {"path": "/foo"}